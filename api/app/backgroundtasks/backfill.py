@@ -0,0 +1,96 @@
+import asyncio
+from dataclasses import dataclass
+import os
+from pybit.unified_trading import HTTP
+from app.db.producer.trades import TradesStreamWriter
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+BACKFILL_CATEGORY = os.getenv("BACKFILL_CATEGORY", "linear")
+BACKFILL_LIMIT = int(os.getenv("BACKFILL_LIMIT", 1000))  # bybit returns at most the 1000 most recent trades
+
+
+class BybitTradeHistory:
+    """Recent trades from the REST api of bybit, in the `publicTrade` format of the websocket.
+
+    Args:
+        session:    pybit HTTP session, by default a public (unauthenticated) one
+        category:   product type, e.g. `linear`
+        limit:      number of trades per request
+    """
+
+    def __init__(self, session: HTTP | None = None, category: str = BACKFILL_CATEGORY, limit: int = BACKFILL_LIMIT):
+        self.session = session or HTTP(testnet=False)
+        self.category = category
+        self.limit = limit
+
+    async def fetch_recent_trades(self, symbol: str) -> list[dict]:
+        """the most recent trades of the symbol, oldest first"""
+        # pybit is blocking, keep it off the event loop
+        response = await asyncio.to_thread(
+            self.session.get_public_trade_history, category=self.category, symbol=symbol, limit=self.limit
+        )
+        trades = [
+            {
+                "T": int(trade["time"]), "s": trade["symbol"], "S": trade["side"], "v": trade["size"],
+                "p": trade["price"], "L": "", "i": trade["execId"], "BT": trade.get("isBlockTrade", False),
+            }
+            for trade in response["result"]["list"]
+        ]
+        trades.reverse()  # newest first => oldest first
+        return trades
+
+
+@dataclass
+class BackfillStats:
+    gaps: int = 0
+    trades: int = 0
+    incomplete: int = 0  # gaps that were longer than the history of the exchange
+    errors: int = 0
+
+
+class TradeBackfiller:
+    """Fills the gap between the last stored trade of a stream and the first trade received after
+    a (re)connect with the trades from the REST api of the exchange.
+
+    Args:
+        client:     source of recent trades, with an async `fetch_recent_trades(symbol)`
+    """
+
+    def __init__(self, client: BybitTradeHistory | None = None):
+        self.client = client or BybitTradeHistory()
+        self.stats = BackfillStats()
+
+    async def backfill(self, writer: TradesStreamWriter, first_trades: list[dict]) -> int:
+        """add the missing trades before `first_trades` to the writer, the writer skips the ones it already has
+
+        Args:
+            writer:         writer of the stream, its `last_id` is the last stored trade
+            first_trades:   the trades of the first frame after the (re)connect
+
+        Returns:
+            the number of added trades"""
+        last_ts = writer.last_ts
+        first_ts = min(int(trade["T"]) for trade in first_trades)
+        if last_ts == 0 or first_ts <= last_ts:
+            return 0  # a new stream, or no gap
+        self.stats.gaps += 1
+        symbol = first_trades[0]["s"]
+        try:
+            trades = await self.client.fetch_recent_trades(symbol)
+        except Exception as e:
+            self.stats.errors += 1
+            logger.error(f"{writer.stream_name}: backfill of {last_ts} - {first_ts} failed: {e}")
+            return 0
+        if not trades or int(trades[0]["T"]) > last_ts:
+            self.stats.incomplete += 1
+            logger.warning(f"{writer.stream_name}: the trade history doesn't reach back to {last_ts}, trades are missing")
+        missing = sorted((trade for trade in trades if last_ts <= int(trade["T"]) <= first_ts), key=lambda trade: int(trade["T"]))
+        before = len(writer.buffer)
+        writer.add(missing)
+        added = len(writer.buffer) - before
+        self.stats.trades += added
+        logger.info(f"{writer.stream_name}: backfilled {added} trades between {last_ts} and {first_ts}")
+        return added
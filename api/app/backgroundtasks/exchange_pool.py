@@ -0,0 +1,490 @@
+import asyncio
+from dataclasses import asdict, dataclass
+import json
+import math
+import os
+import time
+import redis.asyncio as redis
+import websockets
+from app.backgroundtasks.backfill import TradeBackfiller
+from app.db.producer.orderbook import OrderBookWriter
+from app.db.producer.trades import TradesStreamWriter, create_trades_writer
+from app.db.utils import make_redis_client
+from app.logger import streaming_logger
+from app.profiling import stage_timers
+from app.serialize import loads
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+BYBIT_WS_URI = os.getenv("BYBIT_WS_URI", "wss://stream.bybit.com/v5/public/linear")
+# uri = "wss://stream-testnet.bybit.com/v5/public/linear"
+EXCHANGE_MAX_CONNECTIONS = int(os.getenv("EXCHANGE_MAX_CONNECTIONS", 4))
+EXCHANGE_MAX_TOPICS_PER_CONNECTION = int(os.getenv("EXCHANGE_MAX_TOPICS_PER_CONNECTION", 100))
+# frames waiting between the receiving and the writing stage of a connection
+EXCHANGE_QUEUE_SIZE = int(os.getenv("EXCHANGE_QUEUE_SIZE", 10000))
+EXCHANGE_OVERFLOW_POLICY = os.getenv("EXCHANGE_OVERFLOW_POLICY", "block")
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest")
+# seconds before reconnecting, doubled after every failed attempt
+EXCHANGE_RECONNECT_DELAY = float(os.getenv("EXCHANGE_RECONNECT_DELAY", 1))
+EXCHANGE_RECONNECT_MAX_DELAY = float(os.getenv("EXCHANGE_RECONNECT_MAX_DELAY", 60))
+SUBSCRIBE_ARGS_LIMIT = 10  # max number of topics in one (un)subscribe request
+LOADS_TIMER = stage_timers.timer("exchange.loads")
+ADD_FRAME_TIMER = stage_timers.timer("exchange.add_frame")
+FLUSH_TIMER = stage_timers.timer("exchange.flush")
+PING_INTERVAL = 20  # bybit docs state a recommended ping interval of 20 secs (https://bybit-exchange.github.io/docs/v5/ws/connect#how-to-send-the-heartbeat-packet)
+
+
+def topic_to_stream_name(topic: str) -> str:
+    """name of the redis stream of an exchange topic, e.g. `publicTrade.BTCUSDT` => `publicTrade:BTCUSDT`"""
+    return topic.replace(".", ":")
+
+
+async def create_writer(redis_db: redis.Redis, topic: str) -> TradesStreamWriter | OrderBookWriter:
+    """the writer of an exchange topic, `orderbook.<depth>.<symbol>` topics maintain an in process order book"""
+    if topic.startswith("orderbook."):
+        return OrderBookWriter(redis_db, topic)
+    return await create_trades_writer(redis_db, topic_to_stream_name(topic))
+
+
+async def wait_for(aw, timeout: float | None):
+    """`asyncio.wait_for` that never swallows a cancellation. Before python 3.12 `asyncio.wait_for`
+    returns the result when the awaitable completes at the same time as the task is cancelled
+
+    Raises:
+        asyncio.TimeoutError:   when `aw` didn't complete within `timeout` seconds, it is cancelled"""
+    future = asyncio.ensure_future(aw)
+    try:
+        done, _ = await asyncio.wait([future], timeout=timeout)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    if not done:
+        future.cancel()
+        raise asyncio.TimeoutError
+    return future.result()
+
+
+def receive_queue_length(websocket) -> int:
+    """number of received messages of the exchange websocket that are not read yet"""
+    try:
+        return len(websocket.messages)  # legacy websockets protocol
+    except AttributeError:
+        return len(websocket.recv_messages.frames)
+
+
+@dataclass
+class FrameQueueStats:
+    """Counters of the queue between the receiving and the writing stage of a connection"""
+    frames_received: int = 0
+    frames_written: int = 0
+    frames_dropped: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    last_queue_lag_ms: float = 0.0  # time the last written frame waited in the queue
+    max_queue_lag_ms: float = 0.0
+    reconnects: int = 0
+
+
+class ExchangeConnection:
+    """One websocket connection to the exchange carrying many topics. A receiving stage only reads
+    the frames and puts them with their arrival time in a bounded queue, a writing stage decodes them
+    and demultiplexes them on their `topic` to the writer of the matching redis stream. So a slow
+    redis doesn't stall reading from the exchange, up to `queue_size` frames.
+
+    A closed connection is reconnected with exponential backoff, the trades missed in between
+    are fetched by the `backfiller` before the first new trade of a topic is written.
+
+    Args:
+        uri:                websocket uri of the exchange
+        writers:            writers keyed on topic, can be shared with other connections
+        name:               name used in the logging
+        queue_size:         number of frames that can wait for the writing stage
+        overflow_policy:    what to do with a frame when the queue is full
+                            `block`: stop receiving until there is room, the frames wait in the socket buffer
+                            `drop_newest`: the received frame is dropped
+                            `drop_oldest`: the oldest waiting frame is dropped
+        backfiller:         fills the gaps after (re)connecting, None disables the backfill
+        reconnect_delay:    seconds before the first reconnect, doubled on every failed attempt
+        max_reconnect_delay: upper limit of the reconnect delay
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        writers: dict[str, TradesStreamWriter | OrderBookWriter],
+        name: str = "exchange",
+        queue_size: int = EXCHANGE_QUEUE_SIZE,
+        overflow_policy: str = EXCHANGE_OVERFLOW_POLICY,
+        backfiller: TradeBackfiller | None = None,
+        reconnect_delay: float = EXCHANGE_RECONNECT_DELAY,
+        max_reconnect_delay: float = EXCHANGE_RECONNECT_MAX_DELAY,
+    ):
+        assert overflow_policy in OVERFLOW_POLICIES, f"only overflow policies {OVERFLOW_POLICIES} are allowed"
+        self.uri = uri
+        self.writers = writers
+        self.name = name
+        self.queue_size = max(1, queue_size)
+        self.overflow_policy = overflow_policy
+        self.backfiller = backfiller
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.topics: set[str] = set()
+        self.websocket = None
+        self.task: asyncio.Task | None = None
+        self.queue: asyncio.Queue[tuple[float, str | bytes] | None] = asyncio.Queue(maxsize=self.queue_size)
+        self.receiving = False
+        self.closing = False
+        self.stats = FrameQueueStats()
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def _send_op(self, op: str, topics: list[str]) -> None:
+        for i in range(0, len(topics), SUBSCRIBE_ARGS_LIMIT):
+            payload = {"op": op, "args": topics[i: i + SUBSCRIBE_ARGS_LIMIT]}
+            await self.websocket.send(json.dumps(payload))
+
+    async def subscribe(self, topics: list[str]) -> None:
+        """add topics, they get subscribed right away when connected, otherwise on connecting"""
+        new_topics = [topic for topic in topics if topic not in self.topics]
+        self.topics.update(new_topics)
+        if self.websocket is not None and new_topics:
+            await self._send_op("subscribe", new_topics)
+
+    async def unsubscribe(self, topics: list[str]) -> None:
+        old_topics = [topic for topic in topics if topic in self.topics]
+        self.topics.difference_update(old_topics)
+        if self.websocket is not None and old_topics:
+            await self._send_op("unsubscribe", old_topics)
+
+    def _next_flush_timeout(self) -> float | None:
+        """seconds until a writer of this connection needs a flush, None when nothing is buffered"""
+        timeouts = []
+        for topic in self.topics:
+            writer = self.writers.get(topic)
+            if writer is not None and (time_to_flush := writer.time_to_flush()) is not None:
+                timeouts.append(time_to_flush)
+        return min(timeouts, default=None)
+
+    async def flush_due_writers(self) -> None:
+        for topic in list(self.topics):
+            writer = self.writers.get(topic)
+            if writer is not None and writer.due:
+                timed = stage_timers.enabled
+                if timed:
+                    start = time.perf_counter()
+                await writer.flush()
+                if timed:
+                    FLUSH_TIMER.observe(time.perf_counter() - start)
+
+    async def handle_message(self, msg: str | bytes) -> None:
+        """route a frame to the writer of its topic, the writing stage flushes
+        the writers after every drained batch of frames"""
+        timed = stage_timers.enabled
+        if timed:
+            start = time.perf_counter()
+        obj = loads(msg)
+        if timed:
+            LOADS_TIMER.observe(time.perf_counter() - start)
+        topic = obj.get("topic")
+        if topic is None:
+            logger.debug(f"{self.name}: {obj}")  # (un)subscribe responses and pongs
+            return
+        writer = self.writers.get(topic)
+        if writer is None:
+            logger.debug(f"{self.name}: no writer for topic {topic}, frame is dropped")
+            return
+        if writer.needs_backfill and self.backfiller is not None:
+            writer.needs_backfill = False
+            await self.backfiller.backfill(writer, obj["data"])
+        if self.websocket is not None:  # the writing stage drains the queue after the connection closed
+            queue_length = receive_queue_length(self.websocket)
+            writer.stats.record_queue_length(queue_length)
+            # lazy formatting, this runs for every frame
+            logger.debug("%s queue length: %s. data length:%s", writer.stream_name, queue_length, len(obj["data"]))
+        if timed:
+            start = time.perf_counter()
+        writer.add_frame(obj)
+        if timed:
+            ADD_FRAME_TIMER.observe(time.perf_counter() - start)
+
+    async def enqueue(self, msg: str | bytes) -> None:
+        """put a received frame in the queue of the writing stage, following the overflow policy when it is full"""
+        self.stats.frames_received += 1
+        item = (time.monotonic(), msg)
+        if self.queue.full():
+            if self.overflow_policy == "drop_newest":
+                self.stats.frames_dropped += 1
+                return
+            if self.overflow_policy == "drop_oldest":
+                self.queue.get_nowait()
+                self.stats.frames_dropped += 1
+        await self.queue.put(item)
+        self.stats.queue_depth = self.queue.qsize()
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+
+    async def receive_frames(self, websocket, writing: asyncio.Task) -> None:
+        """receiving stage: read frames and keep the connection alive, until it closes or the writing stage fails"""
+        loop = asyncio.get_running_loop()
+        ping_due = loop.time() + PING_INTERVAL
+        while not self.closing and not writing.done():
+            try:
+                msg = await wait_for(websocket.recv(), max(0.0, ping_due - loop.time()))
+            except asyncio.TimeoutError:
+                msg = None
+            if loop.time() >= ping_due:
+                await websocket.send(json.dumps({"op": "ping"}))
+                ping_due = loop.time() + PING_INTERVAL
+            if msg is not None:
+                await self.enqueue(msg)
+
+    async def write_frames(self) -> None:
+        """writing stage: hand the queued frames to the writers, until the receiving stage stopped and the queue is empty"""
+        try:
+            while self.receiving or not self.queue.empty():
+                try:
+                    item = await wait_for(self.queue.get(), self._next_flush_timeout())
+                except asyncio.TimeoutError:
+                    item = None
+                items = [item]
+                while not self.queue.empty():
+                    items.append(self.queue.get_nowait())
+                self.stats.queue_depth = 0
+                for item in items:
+                    if item is None:
+                        continue  # flush timeout or wake up call
+                    received_at, msg = item
+                    lag_ms = (time.monotonic() - received_at) * 1000
+                    self.stats.last_queue_lag_ms = lag_ms
+                    self.stats.max_queue_lag_ms = max(self.stats.max_queue_lag_ms, lag_ms)
+                    await self.handle_message(msg)
+                    self.stats.frames_written += 1
+                await self.flush_due_writers()
+        except Exception:
+            # make room for a receiving stage that blocks on the full queue, it stops on the failed task
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            raise
+        finally:
+            # don't lose the trades that are still waiting in the flush window
+            for topic in list(self.topics):
+                if topic in self.writers:
+                    await self.writers[topic].flush(force=True)
+
+    async def run(self) -> None:
+        """stream the topics to redis, reconnecting with exponential backoff until the connection is closed"""
+        failed_attempts = 0
+        while not self.closing:
+            connected = await self.run_once()
+            if self.closing:
+                break
+            failed_attempts = 0 if connected else failed_attempts + 1
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** failed_attempts)
+            self.stats.reconnects += 1
+            logger.warning(f"{self.name}: reconnecting in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+            for topic in self.topics:
+                if topic in self.writers:
+                    self.writers[topic].on_reconnect()
+
+    async def run_once(self) -> bool:
+        """connect, subscribe to all topics and write the received trades until the connection closes
+
+        Returns:
+            True when the connection was made"""
+        connected = False
+        try:
+            async with websockets.connect(self.uri) as websocket_exchange:
+                logger.info(f"{self.name}: connected to websocket stream ({self.uri}) for {len(self.topics)} topics")
+                connected = True
+                self.websocket = websocket_exchange
+                if self.topics:
+                    await self._send_op("subscribe", sorted(self.topics))
+
+                self.receiving = True
+                writing = asyncio.create_task(self.write_frames())
+                try:
+                    await self.receive_frames(websocket_exchange, writing)
+                finally:
+                    self.websocket = None
+                    self.receiving = False
+                    if not self.queue.full():
+                        self.queue.put_nowait(None)  # wake up the writing stage
+                    await writing
+        except websockets.exceptions.ConnectionClosedOK as e:
+            logger.info(f"{self.name}: connection closed OK! {e}")
+        except websockets.ConnectionClosedError as e:
+            logger.error(f"{self.name}: connection closed due to an error! {e}")
+        except asyncio.CancelledError:
+            logger.info(f"{self.name}: connection cancelled")
+            raise
+        except Exception as e:
+            logger.error(f"{self.name}: {e}")
+        return connected
+
+    async def close(self) -> None:
+        self.closing = True
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+
+class ExchangeConnectionPool:
+    """Shares a small pool of exchange websocket connections between many topics.
+
+    New topics are assigned to the least loaded connection, a new connection is opened
+    when all connections carry `max_topics_per_connection` topics (up to `max_connections`).
+
+    Args:
+        uri:                            websocket uri of the exchange
+        max_connections:                maximum number of websocket connections
+        max_topics_per_connection:      number of topics a connection carries before another one is opened
+        redis_db:                       redis connection for the writers, by default one is created on `start`
+        queue_size:                     frames that can wait for the writing stage of a connection
+        overflow_policy:                see `ExchangeConnection`
+        backfiller:                     fills the gaps after (re)connecting, None disables the backfill
+    """
+
+    def __init__(
+        self,
+        uri: str = BYBIT_WS_URI,
+        max_connections: int = EXCHANGE_MAX_CONNECTIONS,
+        max_topics_per_connection: int = EXCHANGE_MAX_TOPICS_PER_CONNECTION,
+        redis_db: redis.Redis | None = None,
+        queue_size: int = EXCHANGE_QUEUE_SIZE,
+        overflow_policy: str = EXCHANGE_OVERFLOW_POLICY,
+        backfiller: TradeBackfiller | None = None,
+    ):
+        self.uri = uri
+        self.backfiller = backfiller
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.max_connections = max(1, max_connections)
+        self.max_topics_per_connection = max(1, max_topics_per_connection)
+        self.redis_db = redis_db
+        self._owns_redis = redis_db is None
+        self.connections: list[ExchangeConnection] = []
+        self.writers: dict[str, TradesStreamWriter | OrderBookWriter] = {}
+        self._lock = asyncio.Lock()
+        self._counter = 0
+
+    @property
+    def topics(self) -> set[str]:
+        return set(self.writers)
+
+    def assignment(self) -> dict[str, list[str]]:
+        """topics per connection"""
+        return {connection.name: sorted(connection.topics) for connection in self.connections}
+
+    def stats(self) -> list[dict]:
+        """frame queue counters per connection"""
+        return [{"connection": connection.name, **asdict(connection.stats)} for connection in self.connections]
+
+    async def start(self) -> None:
+        if self.redis_db is None:
+            self.redis_db = make_redis_client()
+
+    async def close(self) -> None:
+        for connection in self.connections:
+            await connection.close()
+        self.connections = []
+        for writer in self.writers.values():
+            await writer.flush(force=True)
+        if self._owns_redis and self.redis_db is not None:
+            await self.redis_db.aclose()
+            self.redis_db = None
+
+    def _new_connection(self) -> ExchangeConnection:
+        self._counter += 1
+        connection = ExchangeConnection(
+            self.uri, self.writers, name=f"exchange-{self._counter}", queue_size=self.queue_size, overflow_policy=self.overflow_policy,
+            backfiller=self.backfiller,
+        )
+        self.connections.append(connection)
+        connection.start()
+        return connection
+
+    def _pick_connection(self) -> ExchangeConnection:
+        """least loaded connection with room left, or a new one when the pool is not full yet"""
+        candidates = [c for c in self.connections if len(c) < self.max_topics_per_connection]
+        if candidates:
+            return min(candidates, key=len)
+        if len(self.connections) < self.max_connections:
+            return self._new_connection()
+        logger.warning(f"all {len(self.connections)} exchange connections are full, overloading the least loaded one")
+        return min(self.connections, key=len)
+
+    async def add_topics(self, topics: list[str]) -> None:
+        """start writing the topics to their redis streams"""
+        async with self._lock:
+            for topic in topics:
+                if topic in self.writers:
+                    continue
+                self.writers[topic] = await create_writer(self.redis_db, topic)
+                await self._pick_connection().subscribe([topic])
+
+    async def remove_topics(self, topics: list[str]) -> None:
+        """stop writing the topics, connections without topics are closed and the rest gets rebalanced"""
+        async with self._lock:
+            for topic in topics:
+                for connection in self.connections:
+                    if topic in connection.topics:
+                        await connection.unsubscribe([topic])
+                writer = self.writers.pop(topic, None)
+                if isinstance(writer, OrderBookWriter):
+                    await writer.close()
+                elif writer is not None:
+                    await writer.flush(force=True)
+            for connection in [c for c in self.connections if len(c) == 0]:
+                self.connections.remove(connection)
+                await connection.close()
+            await self._rebalance()
+
+    async def restart_topics(self, topics: list[str]) -> None:
+        """stop and start the topics with new writers, the trades missed in between are backfilled"""
+        topics = [topic for topic in topics if topic in self.writers]
+        await self.remove_topics(topics)
+        await self.add_topics(topics)
+
+    def topic_health(self, topic: str) -> dict | None:
+        """the connection and the last write of a topic, None when this process doesn't ingest it"""
+        writer = self.writers.get(topic)
+        if writer is None:
+            return None
+        connection = next((c for c in self.connections if topic in c.topics), None)
+        return {
+            "connection": connection.name if connection is not None else None,
+            "connected": connection is not None and connection.websocket is not None,
+            "reconnects": connection.stats.reconnects if connection is not None else 0,
+            "last_write": writer.stats.last_flush_time,
+        }
+
+    async def rebalance(self) -> None:
+        """spread the topics evenly, the number of connections is kept as small as the load allows"""
+        async with self._lock:
+            await self._rebalance()
+
+    async def _rebalance(self) -> None:
+        needed = min(self.max_connections, math.ceil(len(self.writers) / self.max_topics_per_connection))
+        while len(self.connections) < needed:
+            self._new_connection()
+        while self.connections:
+            busiest = max(self.connections, key=len)
+            idlest = min(self.connections, key=len)
+            if len(busiest) - len(idlest) <= 1:
+                break
+            topic = sorted(busiest.topics)[-1]
+            # subscribe before unsubscribing so no trades are missed, the writer skips the duplicates
+            await idlest.subscribe([topic])
+            await busiest.unsubscribe([topic])
+            logger.info(f"moved topic {topic} from {busiest.name} to {idlest.name}")
@@ -0,0 +1,179 @@
+"""Leases that assign the ingestion of each topic to exactly one worker process.
+
+Every worker wants all topics, the first one that takes the lease of a topic (a redis lock with
+a ttl) ingests it and renews the lease on every heartbeat. When a worker dies its leases expire
+and another worker takes them over on its next heartbeat, the new writer backfills the gap."""
+import asyncio
+import os
+import socket
+import time
+from typing import Awaitable, Callable
+from uuid import uuid4
+import redis.asyncio as redis
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockError
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+LEASE_TTL = float(os.getenv("LEASE_TTL", 15))  # seconds a lease lives without heartbeat
+LEASE_HEARTBEAT_INTERVAL = float(os.getenv("LEASE_HEARTBEAT_INTERVAL", 5))
+# max number of topics a worker ingests, the other workers take the rest. 0 is unlimited
+LEASE_MAX_TOPICS = int(os.getenv("LEASE_MAX_TOPICS", 0))
+
+
+def lease_key(topic: str) -> str:
+    return f"ingest-lease:{topic}"
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
+TopicsCallback = Callable[[list[str]], Awaitable[None]]
+
+
+class IngestionLeases:
+    """Takes and renews the leases of the wanted topics for this worker.
+
+    Args:
+        redis_db:               Redis connection
+        on_acquired:            called with the topics this worker starts ingesting
+        on_lost:                called with the topics another worker took over, stop ingesting them
+        ttl:                    seconds a lease lives without heartbeat, the failover time after a crash
+        heartbeat_interval:     seconds between the renewals, well below `ttl`
+        worker_id:              owner token of the leases, unique per process by default
+        max_topics:             max number of leases this worker holds, 0 is unlimited
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        on_acquired: TopicsCallback | None = None,
+        on_lost: TopicsCallback | None = None,
+        ttl: float = LEASE_TTL,
+        heartbeat_interval: float = LEASE_HEARTBEAT_INTERVAL,
+        worker_id: str | None = None,
+        max_topics: int = LEASE_MAX_TOPICS,
+    ):
+        self.redis_db = redis_db
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = worker_id or make_worker_id()
+        self.max_topics = max_topics
+        self.wanted: set[str] = set()
+        self.held: dict[str, Lock] = {}
+        self.expires: dict[str, float] = {}  # local (monotonic) end of the lease when the renewals fail
+        self.task: asyncio.Task | None = None
+
+    async def acquire(self, topic: str) -> bool:
+        """take the lease of the topic when it is free, True when this worker holds it"""
+        if topic in self.held:
+            return True
+        lock = self.redis_db.lock(lease_key(topic), timeout=self.ttl, blocking=False, thread_local=False)
+        started = time.monotonic()
+        if not await lock.acquire(token=self.worker_id):
+            return False
+        self.held[topic] = lock
+        self.expires[topic] = started + self.ttl
+        logger.info(f"{self.worker_id}: acquired the lease of {topic}")
+        return True
+
+    async def renew(self) -> list[str]:
+        """extend the held leases, returns the topics that were lost"""
+        lost = []
+        for topic, lock in list(self.held.items()):
+            started = time.monotonic()
+            try:
+                await lock.reacquire()
+                self.expires[topic] = started + self.ttl
+            except LockError:
+                lost.append(topic)  # expired and taken by another worker
+            except Exception as e:
+                # redis is unreachable: keep ingesting until the lease would have expired anyway
+                logger.error(f"{self.worker_id}: renewing the lease of {topic} failed: {e}")
+                if time.monotonic() >= self.expires[topic]:
+                    lost.append(topic)
+        for topic in lost:
+            del self.held[topic]
+            del self.expires[topic]
+            logger.warning(f"{self.worker_id}: lost the lease of {topic}")
+        return lost
+
+    async def heartbeat(self) -> None:
+        """renew the held leases and try to take the free ones of the wanted topics"""
+        lost = await self.renew()
+        if lost and self.on_lost is not None:
+            await self.on_lost(lost)
+        acquired = []
+        for topic in sorted(self.wanted - set(self.held)):
+            if self.max_topics and len(self.held) >= self.max_topics:
+                break  # left for the other workers
+            if await self.acquire(topic):
+                acquired.append(topic)
+        if acquired and self.on_acquired is not None:
+            await self.on_acquired(acquired)
+
+    async def add_topics(self, topics: list[str]) -> None:
+        """want the topics, the free ones are acquired right away"""
+        self.wanted.update(topics)
+        await self.heartbeat()
+
+    async def remove_topics(self, topics: list[str]) -> None:
+        """don't want the topics anymore, the held ones are stopped (`on_lost`) and their leases released"""
+        self.wanted.difference_update(topics)
+        held = [topic for topic in topics if topic in self.held]
+        if held and self.on_lost is not None:
+            await self.on_lost(held)
+        await self.release(held)
+
+    async def release(self, topics: list[str]) -> None:
+        """hand the leases over, e.g. on shutdown, so another worker doesn't have to wait for the ttl"""
+        for topic in topics:
+            lock = self.held.pop(topic, None)
+            self.expires.pop(topic, None)
+            if lock is None:
+                continue
+            try:
+                await lock.release()
+            except LockError:
+                pass  # already expired
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"{self.worker_id}: lease heartbeat failed: {e}")
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def stop(self) -> None:
+        """stop the heartbeats, the leases are kept until `close` or their ttl"""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self) -> None:
+        """stop the heartbeats and release the leases, stop the ingestion before"""
+        await self.stop()
+        await self.release(list(self.held))
+
+    async def status(self) -> dict:
+        """the held topics and the owners of the other wanted topics"""
+        others = sorted(self.wanted - set(self.held))
+        owners = await self.redis_db.mget([lease_key(topic) for topic in others]) if others else []
+        return {
+            "worker": self.worker_id,
+            "held": sorted(self.held),
+            "others": {topic: owner.decode() if owner else None for topic, owner in zip(others, owners)},
+        }
@@ -0,0 +1,174 @@
+"""Runtime control of the ingestion per symbol.
+
+The enabled symbols are kept in the `SymbolRegistry`, every api process syncs the topics it wants
+a lease of (see `app.backgroundtasks.leases`) with them. So a symbol started or stopped through
+any process is picked up by all of them on their next sync, and ingested by exactly one."""
+import asyncio
+import os
+import time
+import redis.asyncio as redis
+from app.backgroundtasks.exchange_pool import ExchangeConnectionPool
+from app.backgroundtasks.leases import IngestionLeases
+from app.db.producer.orderbook import orderbook_topic
+from app.db.symbols import SymbolRegistry
+from app.errors import SymbolError
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+SUPERVISOR_MAX_SYMBOLS = int(os.getenv("SUPERVISOR_MAX_SYMBOLS", 500))  # enabled symbols of all processes together
+SUPERVISOR_SYNC_INTERVAL = float(os.getenv("SUPERVISOR_SYNC_INTERVAL", 5))
+SUPERVISOR_STALE_AFTER = float(os.getenv("SUPERVISOR_STALE_AFTER", 300))  # seconds without writes before a topic is `idle`
+
+
+def symbol_topics(symbol: str) -> list[str]:
+    """the exchange topics that are ingested for a symbol"""
+    return [f"publicTrade.{symbol}", orderbook_topic(symbol)]
+
+
+def topic_symbol(topic: str) -> str:
+    """`publicTrade.BTCUSDT` => `BTCUSDT`"""
+    return topic.rsplit(".", 1)[-1]
+
+
+def restart_key(topic: str) -> str:
+    return f"ingest-restart:{topic}"
+
+
+class IngestionSupervisor:
+    """Starts, stops and restarts the ingestion of symbols and reports its health.
+
+    Args:
+        registry:       the enabled symbols and the instruments of the exchange
+        leases:         the leases of the topics, `on_acquired` and `on_lost` (un)subscribe them on the `pool`
+        pool:           the exchange connections of this process
+        max_symbols:    max number of enabled symbols
+        sync_interval:  seconds between the syncs with the enabled symbols
+        stale_after:    seconds without writes before an ingested topic is reported `idle`
+    """
+
+    def __init__(
+        self,
+        registry: SymbolRegistry,
+        leases: IngestionLeases,
+        pool: ExchangeConnectionPool,
+        max_symbols: int = SUPERVISOR_MAX_SYMBOLS,
+        sync_interval: float = SUPERVISOR_SYNC_INTERVAL,
+        stale_after: float = SUPERVISOR_STALE_AFTER,
+    ):
+        self.registry = registry
+        self.leases = leases
+        self.pool = pool
+        self.max_symbols = max_symbols
+        self.sync_interval = sync_interval
+        self.stale_after = stale_after
+        self.task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def redis_db(self) -> redis.Redis:
+        return self.registry.redis_db
+
+    async def sync(self) -> None:
+        """want the topics of the enabled symbols and handle the restart requests of the held ones"""
+        async with self._lock:
+            wanted = {topic for symbol in await self.registry.enabled() for topic in symbol_topics(symbol)}
+            removed = sorted(self.leases.wanted - wanted)
+            if removed:
+                await self.leases.remove_topics(removed)
+                logger.info(f"stopped {removed}")
+            added = sorted(wanted - self.leases.wanted)
+            if added:
+                await self.leases.add_topics(added)
+            held = sorted(self.leases.held)
+            if held:
+                requested = [topic for topic, flag in zip(held, await self.redis_db.mget([restart_key(topic) for topic in held])) if flag]
+                if requested:
+                    await self.redis_db.delete(*[restart_key(topic) for topic in requested])
+                    await self.pool.restart_topics(requested)
+                    logger.info(f"restarted {requested}")
+
+    async def start_symbol(self, symbol: str) -> list[dict]:
+        """enable the symbol, returns the health of its topics"""
+        instruments = await self.registry.instruments()
+        if instruments:  # before the first refresh (e.g. offline) every symbol is accepted
+            instrument = instruments.get(symbol)
+            if instrument is None:
+                raise SymbolError(f"unknown {self.registry.category} symbol {symbol}")
+            if instrument.get("status") != "Trading":
+                raise SymbolError(f"{symbol} is not trading ({instrument.get('status')})")
+        enabled = await self.registry.enabled()
+        if symbol not in enabled and len(enabled) >= self.max_symbols:
+            raise SymbolError(f"already {len(enabled)} symbols enabled, the maximum is {self.max_symbols}")
+        await self.registry.enable(symbol)
+        await self.sync()
+        return await self.health(symbol)
+
+    async def stop_symbol(self, symbol: str) -> list[dict]:
+        """disable the symbol, the other processes stop it on their next sync"""
+        await self.registry.disable(symbol)
+        await self.sync()
+        return await self.health(symbol)
+
+    async def restart_symbol(self, symbol: str) -> list[dict]:
+        """reconnect the topics of the symbol with new writers, the missed trades are backfilled.
+        The topics held by other processes are restarted on their next sync"""
+        if symbol not in await self.registry.enabled():
+            raise SymbolError(f"{symbol} is not enabled")
+        async with self.redis_db.pipeline(transaction=False) as pipe:
+            for topic in symbol_topics(symbol):
+                pipe.set(restart_key(topic), self.leases.worker_id, px=max(1, int(10 * self.sync_interval * 1000)))
+            await pipe.execute()
+        await self.sync()
+        return await self.health(symbol)
+
+    async def health(self, symbol: str | None = None) -> list[dict]:
+        """the owner and the state of the wanted topics (of `symbol`)
+
+        states:
+            `ok`            written within `stale_after`
+            `idle`          no writes within `stale_after`
+            `starting`      ingested by this process, nothing written yet
+            `disconnected`  ingested by this process, the exchange connection is down
+            `remote`        ingested by another process
+            `pending`       no process holds the lease, e.g. all processes ingest their `max_topics`
+        """
+        status = await self.leases.status()
+        owners = {topic: self.leases.worker_id for topic in status["held"]} | status["others"]
+        topics = sorted(self.leases.wanted) if symbol is None else [topic for topic in symbol_topics(symbol) if topic in self.leases.wanted]
+        now = time.time()
+        report = []
+        for topic in topics:
+            health = self.pool.topic_health(topic) if topic in self.leases.held else None
+            if health is not None:
+                if not health["connected"]:
+                    state = "disconnected"
+                elif not health["last_write"]:
+                    state = "starting"
+                else:
+                    state = "ok" if now - health["last_write"] <= self.stale_after else "idle"
+            else:
+                state = "remote" if owners.get(topic) else "pending"
+            report.append({"symbol": topic_symbol(topic), "topic": topic, "owner": owners.get(topic), "state": state, **(health or {})})
+        return report
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"syncing the ingestion with the enabled symbols failed: {e}")
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def close(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
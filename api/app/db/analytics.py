@@ -0,0 +1,145 @@
+"""Trade statistics of a time range, computed with NumPy on chunks of the range so the memory
+use doesn't depend on the length of the range."""
+import math
+import os
+import numpy as np
+import redis.asyncio as redis
+from app.db.columnar import SIDE_NAMES, SIDES, iter_chunks
+from app.db.producer.trades import TRADES_STORAGE_FORMAT
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", 10000))
+ANALYTICS_DTYPE = np.dtype([("T", "<i8"), ("p", "<f8"), ("v", "<f8"), ("S", "u1")])
+SELL = SIDES.index("Sell")
+
+
+def entries_to_records(entries: list[tuple[bytes, dict]]) -> np.ndarray:
+    """the timestamp, price, size and side of stream entries with the string fields of the exchange"""
+    records = np.empty(len(entries), dtype=ANALYTICS_DTYPE)
+    records["T"] = np.array([fields[b"T"] for _, fields in entries]).astype(np.int64)
+    records["p"] = np.array([fields[b"p"] for _, fields in entries]).astype(np.float64)
+    records["v"] = np.array([fields[b"v"] for _, fields in entries]).astype(np.float64)
+    records["S"] = np.array([fields[b"S"] for _, fields in entries]) == b"Sell"
+    return records
+
+
+async def iter_trade_records(
+    redis_db: redis.Redis,
+    stream_name: str,
+    start: int | str = "-",
+    end: int | str = "+",
+    chunk_size: int = ANALYTICS_CHUNK_SIZE,
+    storage_format: str = TRADES_STORAGE_FORMAT,
+):
+    """yields the trades between `start` and `end` (ms, inclusive) as arrays of `ANALYTICS_DTYPE`
+    (or the wider columnar records), at most `chunk_size` trades at a time for the fields format"""
+    if storage_format == "columnar":
+        async for records in iter_chunks(redis_db, stream_name, start, end, count=max(1, chunk_size // 1000)):
+            yield records
+        return
+    last_key = start
+    while True:
+        entries = await redis_db.xrange(stream_name, last_key, end, count=chunk_size)
+        if not entries:
+            return
+        yield entries_to_records(entries)
+        if len(entries) < chunk_size:
+            return
+        last_key = f"({entries[-1][0].decode()}"
+
+
+class TradeAnalytics:
+    """Running statistics over chunks of trades
+
+    Args:
+        large_trade_size:   trades at least this size are reported as large trades. By default a trade is large
+                            when it is `large_trade_factor` times the average size of the trades so far
+        large_trade_factor: see `large_trade_size`
+        max_large_trades:   number of large trades that is kept, the largest ones win
+    """
+
+    def __init__(self, large_trade_size: float | None = None, large_trade_factor: float = 10.0, max_large_trades: int = 100):
+        self.large_trade_size = large_trade_size
+        self.large_trade_factor = large_trade_factor
+        self.max_large_trades = max_large_trades
+        self.count = 0
+        self.volume = 0.0
+        self.buy_volume = 0.0
+        self.notional = 0.0
+        self.sum_squared_returns = 0.0
+        self.first: np.void | None = None
+        self.last_price: float | None = None
+        self.last_timestamp: int | None = None
+        self.high = -math.inf
+        self.low = math.inf
+        self.large_trades = np.empty(0, dtype=ANALYTICS_DTYPE)
+
+    def update(self, records: np.ndarray) -> None:
+        if not len(records):
+            return
+        prices, sizes = records["p"], records["v"]
+        if self.first is None:
+            self.first = records[0]
+        self.count += len(records)
+        self.volume += float(sizes.sum())
+        self.buy_volume += float(sizes[records["S"] != SELL].sum())
+        self.notional += float(prices @ sizes)
+        self.high = max(self.high, float(prices.max()))
+        self.low = min(self.low, float(prices.min()))
+
+        # log returns from trade to trade, the first one against the last price of the previous chunk
+        log_prices = np.log(prices)
+        if self.last_price is not None:
+            log_prices = np.concatenate(([math.log(self.last_price)], log_prices))
+        self.sum_squared_returns += float(np.square(np.diff(log_prices)).sum())
+        self.last_price = float(prices[-1])
+        self.last_timestamp = int(records["T"][-1])
+
+        threshold = self.large_trade_size
+        if threshold is None:
+            threshold = self.large_trade_factor * self.volume / self.count
+        large = records[sizes >= threshold]
+        if len(large):
+            large = np.concatenate((self.large_trades, large[["T", "p", "v", "S"]].astype(ANALYTICS_DTYPE)))
+            if len(large) > self.max_large_trades:
+                large = large[np.argsort(large["v"], kind="stable")[::-1][: self.max_large_trades]]
+            self.large_trades = np.sort(large, order="T")
+
+    def result(self) -> dict:
+        sell_volume = self.volume - self.buy_volume
+        return {
+            "count": self.count,
+            "volume": self.volume,
+            "buy_volume": self.buy_volume,
+            "sell_volume": sell_volume,
+            "imbalance": (self.buy_volume - sell_volume) / self.volume if self.volume else None,
+            "vwap": self.notional / self.volume if self.volume else None,
+            "open": float(self.first["p"]) if self.first is not None else None,
+            "high": self.high if self.count else None,
+            "low": self.low if self.count else None,
+            "close": self.last_price,
+            "first_timestamp": int(self.first["T"]) if self.first is not None else None,
+            "last_timestamp": self.last_timestamp,
+            "realized_volatility": math.sqrt(self.sum_squared_returns),
+            "large_trades": [
+                {"T": int(T), "p": float(p), "v": float(v), "S": SIDE_NAMES[S]} for T, p, v, S in self.large_trades.tolist()
+            ],
+        }
+
+
+async def analyze_trades(
+    redis_db: redis.Redis,
+    stream_name: str,
+    start: int | str = "-",
+    end: int | str = "+",
+    chunk_size: int = ANALYTICS_CHUNK_SIZE,
+    **kwargs,
+) -> dict:
+    """statistics of the trades between `start` and `end` (ms, inclusive), see `TradeAnalytics`"""
+    analytics = TradeAnalytics(**kwargs)
+    async for records in iter_trade_records(redis_db, stream_name, start, end, chunk_size):
+        analytics.update(records)
+    return analytics.result()
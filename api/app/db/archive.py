@@ -0,0 +1,224 @@
+"""Cold storage of trades in Parquet files, partitioned by symbol and hour:
+
+    <ARCHIVE_DIR>/symbol=BTCUSDT/hour=2024011215/<first id>_<last id>.parquet
+
+The id of the last archived entry of a stream is kept in redis (`archive:<stream>`), the entries up
+to there are served from the files and everything after it from the stream (see `read_trades`)."""
+import asyncio
+from datetime import datetime, timezone
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import redis.asyncio as redis
+from app.db.columnar import SIDE_NAMES, TICK_NAMES, chunk_stream_name, decode_chunk, decode_trade_ids
+from app.db.producer.trades import TRADES_STORAGE_FORMAT
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 50000))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("T", pa.int64()),
+    ("s", pa.string()),
+    ("S", pa.string()),
+    ("v", pa.float64()),
+    ("p", pa.float64()),
+    ("L", pa.string()),
+    ("i", pa.string()),
+    ("BT", pa.int8()),
+])
+
+
+def watermark_key(stream_name: str) -> str:
+    return f"archive:{stream_name}"
+
+
+def hour_partition(timestamp_ms: int) -> int:
+    """1705072083137 => 2024011215"""
+    return int(datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y%m%d%H"))
+
+
+def entries_to_frame(entries: list[tuple[bytes, dict]]) -> pd.DataFrame:
+    """stream entries with the string fields of the exchange as a typed data frame"""
+    columns = {name: [fields.get(name.encode(), b"").decode() for _, fields in entries] for name in ("s", "S", "L", "i")}
+    return pd.DataFrame({
+        "id": [entry_id.decode() for entry_id, _ in entries],
+        "T": np.array([fields[b"T"] for _, fields in entries]).astype(np.int64),
+        "s": columns["s"],
+        "S": columns["S"],
+        "v": np.array([fields[b"v"] for _, fields in entries]).astype(np.float64),
+        "p": np.array([fields[b"p"] for _, fields in entries]).astype(np.float64),
+        "L": columns["L"],
+        "i": columns["i"],
+        "BT": np.array([fields[b"BT"] for _, fields in entries]).astype(np.int8),
+    })
+
+
+def chunks_to_frame(chunks: list[tuple[bytes, dict]], symbol: str) -> pd.DataFrame:
+    """columnar chunks (see `app.db.columnar`) as a typed data frame, the trades get the id of their chunk"""
+    sides = np.array(SIDE_NAMES, dtype=object)
+    ticks = np.array(TICK_NAMES, dtype=object)
+    frames = []
+    for chunk_id, fields in chunks:
+        records = decode_chunk(fields)
+        frames.append(pd.DataFrame({
+            "id": chunk_id.decode(), "T": records["T"], "s": symbol, "S": sides[records["S"]], "v": records["v"],
+            "p": records["p"], "L": ticks[records["L"]], "i": decode_trade_ids(records, fields), "BT": records["BT"].astype(np.int8),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_partitions(frame: pd.DataFrame, symbol: str, archive_dir: str = ARCHIVE_DIR) -> list[str]:
+    """write the trades in one parquet file per hour, returns the paths"""
+    paths = []
+    hours = frame["T"].map(hour_partition)
+    for hour, part in frame.groupby(hours, sort=True):
+        directory = os.path.join(archive_dir, f"symbol={symbol}", f"hour={hour}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{part['id'].iloc[0]}_{part['id'].iloc[-1]}.parquet")
+        table = pa.Table.from_pandas(part, schema=ARCHIVE_SCHEMA, preserve_index=False)
+        # a partial file is never picked up by the readers
+        pq.write_table(table, path + ".tmp", compression=ARCHIVE_COMPRESSION)
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+async def archive_range(
+    redis_db: redis.Redis,
+    stream_name: str,
+    end_ms: int,
+    archive_dir: str = ARCHIVE_DIR,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    columnar: bool = False,
+) -> int:
+    """export the entries after the watermark up to (not including) `end_ms` to parquet files,
+    in batches of `batch_size` entries. The watermark is moved after every batch.
+
+    Args:
+        redis_db:       Redis connection
+        stream_name:    e.g. `publicTrade:BTCUSDT`, or its chunk stream with `columnar`
+        end_ms:         timestamp (ms) of the first entry that stays
+        archive_dir:    root directory of the parquet files
+        batch_size:     number of stream entries per XRANGE and file
+        columnar:       the stream holds columnar chunks
+
+    Returns:
+        the number of archived entries
+    """
+    symbol = stream_name.split(":", 1)[-1]
+    watermark = await redis_db.get(watermark_key(stream_name))
+    start = f"({watermark.decode()}" if watermark else "-"
+    archived = 0
+    while True:
+        entries = await redis_db.xrange(stream_name, start, end_ms - 1, count=batch_size)
+        if not entries:
+            return archived
+        frame = chunks_to_frame(entries, symbol) if columnar else entries_to_frame(entries)
+        paths = await asyncio.to_thread(write_partitions, frame, symbol, archive_dir)
+        last_id = entries[-1][0].decode()
+        await redis_db.set(watermark_key(stream_name), last_id)
+        archived += len(entries)
+        logger.info(f"{stream_name}: archived {len(entries)} entries up to {last_id} in {len(paths)} files")
+        start = f"({last_id}"
+
+
+def read_archive(symbol: str, start: int, end: int, archive_dir: str = ARCHIVE_DIR, limit: int | None = None) -> pd.DataFrame:
+    """the archived trades of a symbol between `start` and `end` (ms, inclusive), ordered on their id.
+    With a `limit` the hours are read one by one until there are `limit` trades"""
+    directory = os.path.join(archive_dir, f"symbol={symbol}")
+    if not os.path.isdir(directory):
+        return ARCHIVE_SCHEMA.empty_table().to_pandas()
+    dataset = ds.dataset(directory, format="parquet", partitioning="hive", schema=ARCHIVE_SCHEMA.append(pa.field("hour", pa.int64())))
+    condition = (ds.field("T") >= start) & (ds.field("T") <= end)
+    if limit is None:
+        hour_condition = (ds.field("hour") >= hour_partition(start)) & (ds.field("hour") <= hour_partition(end))
+        return sort_on_id(dataset.to_table(filter=hour_condition & condition, columns=ARCHIVE_SCHEMA.names).to_pandas())
+    hours = sorted(
+        int(name.split("=", 1)[1]) for name in os.listdir(directory)
+        if name.startswith("hour=") and hour_partition(start) <= int(name.split("=", 1)[1]) <= hour_partition(end)
+    )
+    frames = []
+    rows = 0
+    for hour in hours:
+        frame = dataset.to_table(filter=(ds.field("hour") == hour) & condition, columns=ARCHIVE_SCHEMA.names).to_pandas()
+        frames.append(sort_on_id(frame))
+        rows += len(frame)
+        if rows >= limit:
+            break
+    if not frames:
+        return ARCHIVE_SCHEMA.empty_table().to_pandas()
+    return pd.concat(frames, ignore_index=True).head(limit)
+
+
+def sort_on_id(frame: pd.DataFrame) -> pd.DataFrame:
+    """stream ids `<ms>-<seq>` don't sort as strings"""
+    if frame.empty:
+        return frame
+    seq = frame["id"].str.split("-", n=1).str[1].astype(np.int64)
+    order = np.lexsort((np.arange(len(frame)), seq.to_numpy(), frame["T"].to_numpy()))
+    return frame.iloc[order].reset_index(drop=True)
+
+
+async def read_trades(
+    redis_db: redis.Redis,
+    stream_name: str,
+    start: int = 0,
+    end: int | None = None,
+    archive_dir: str = ARCHIVE_DIR,
+    columnar: bool = TRADES_STORAGE_FORMAT == "columnar",
+    limit: int | None = None,
+) -> pd.DataFrame:
+    """the trades between `start` and `end` (ms, inclusive) from the parquet files up to the watermark
+    and from the redis stream after it, as one data frame ordered on id
+
+    Args:
+        redis_db:       Redis connection
+        stream_name:    e.g. `publicTrade:BTCUSDT`
+        start, end:     timestamps in ms, `end` None reads up to the last trade
+        archive_dir:    root directory of the parquet files
+        columnar:       read the hot trades from the chunk stream
+        limit:          the first `limit` trades, the archive and the stream are read until there are enough
+    """
+    symbol = stream_name.split(":", 1)[-1]
+    hot_stream = chunk_stream_name(stream_name) if columnar else stream_name
+    end = end if end is not None else 2**63 - 1
+    frames = []
+    hot_start = start
+    watermark = await redis_db.get(watermark_key(hot_stream))
+    if watermark is not None:
+        watermark = watermark.decode()
+        watermark_ms = int(watermark.split("-")[0])
+        if start <= watermark_ms:
+            frames.append(await asyncio.to_thread(read_archive, symbol, start, min(end, watermark_ms), archive_dir, limit))
+            hot_start = f"({watermark}"
+
+    remaining = None if limit is None else limit - sum(len(frame) for frame in frames)
+    last_key = hot_start
+    while remaining is None or remaining > 0:
+        # a stream entry is a trade, a chunk holds several
+        count = ARCHIVE_BATCH_SIZE if remaining is None or columnar else min(ARCHIVE_BATCH_SIZE, remaining)
+        batch = await redis_db.xrange(hot_stream, last_key, "+" if columnar else end, count=count)
+        if batch:
+            hot = chunks_to_frame(batch, symbol) if columnar else entries_to_frame(batch)
+            hot = hot[(hot["T"] >= start) & (hot["T"] <= end)]
+            frames.append(hot)
+            if remaining is not None:
+                remaining -= len(hot)
+        # a chunk is keyed on its last trade, the first chunk beyond `end` can still hold trades before `end`
+        if len(batch) < count or (columnar and int(batch[-1][0].split(b"-")[0]) > end):
+            break
+        last_key = f"({batch[-1][0].decode()}"
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return ARCHIVE_SCHEMA.empty_table().to_pandas()
+    frame = pd.concat(frames, ignore_index=True)
+    return frame if limit is None else frame.head(limit)
@@ -0,0 +1,167 @@
+"""Compact storage of trades: chunks of fixed width binary records instead of one stream entry with
+string fields per trade. A chunk is a single entry of the stream `publicTradeChunk:<symbol>` with
+the id of its last trade, and the fields
+
+    n:      number of trades in the chunk
+    v:      version of the record layout
+    data:   the records, `TRADE_DTYPE` packed
+    ids:    (optional) newline separated trade ids, when the ids of the chunk aren't all UUIDs
+"""
+import os
+import time
+import uuid
+import numpy as np
+import redis.asyncio as redis
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+COLUMNAR_CHUNK_SIZE = int(os.getenv("COLUMNAR_CHUNK_SIZE", 1000))
+COLUMNAR_CHUNK_MAX_AGE_MS = int(os.getenv("COLUMNAR_CHUNK_MAX_AGE_MS", 1000))
+CHUNK_VERSION = 1
+
+TRADE_DTYPE = np.dtype([
+    ("T", "<i8"),     # trade timestamp (ms)
+    ("p", "<f8"),     # price
+    ("v", "<f8"),     # size
+    ("S", "u1"),      # side, index in SIDES
+    ("L", "u1"),      # tick direction, index in TICK_DIRECTIONS
+    ("BT", "u1"),     # block trade
+    ("i", "S16"),     # trade id as UUID bytes, or the index in the `ids` field of the chunk
+])
+SIDES = ("Buy", "Sell")
+TICK_DIRECTIONS = ("PlusTick", "ZeroPlusTick", "MinusTick", "ZeroMinusTick")
+UNKNOWN = 255
+_SIDE_CODES = {side: code for code, side in enumerate(SIDES)}
+_TICK_CODES = {tick: code for code, tick in enumerate(TICK_DIRECTIONS)}
+# the names by code, an empty string for `UNKNOWN`
+SIDE_NAMES = SIDES + ("",) * (UNKNOWN + 1 - len(SIDES))
+TICK_NAMES = TICK_DIRECTIONS + ("",) * (UNKNOWN + 1 - len(TICK_DIRECTIONS))
+
+
+def chunk_stream_name(stream_name: str) -> str:
+    """`publicTrade:BTCUSDT` => `publicTradeChunk:BTCUSDT`"""
+    prefix, symbol = stream_name.split(":", 1)
+    return f"{prefix}Chunk:{symbol}"
+
+
+def encode_trades(trades: list[dict]) -> dict:
+    """pack the trades (dicts with the bybit `publicTrade` fields) into the fields of a chunk"""
+    records = np.empty(len(trades), dtype=TRADE_DTYPE)
+    records["T"] = [int(trade["T"]) for trade in trades]
+    records["p"] = [float(trade["p"]) for trade in trades]
+    records["v"] = [float(trade["v"]) for trade in trades]
+    records["S"] = [_SIDE_CODES.get(trade["S"], UNKNOWN) for trade in trades]
+    records["L"] = [_TICK_CODES.get(trade.get("L", ""), UNKNOWN) for trade in trades]
+    records["BT"] = [int(trade["BT"]) for trade in trades]
+    fields = {"n": len(trades), "v": CHUNK_VERSION}
+    try:
+        records["i"] = [uuid.UUID(trade["i"]).bytes for trade in trades]
+    except ValueError:
+        # not all ids are UUIDs, store them dictionary encoded
+        ids = [trade["i"] for trade in trades]
+        unique_ids = list(dict.fromkeys(ids))
+        index = {trade_id: n for n, trade_id in enumerate(unique_ids)}
+        records["i"] = [index[trade_id].to_bytes(16, "little") for trade_id in ids]
+        fields["ids"] = "\n".join(unique_ids)
+    fields["data"] = records.tobytes()
+    return fields
+
+
+def decode_chunk(fields: dict) -> np.ndarray:
+    """the records of a chunk as read from redis, without copying the data"""
+    data = fields.get(b"data", fields.get("data"))
+    return np.frombuffer(data, dtype=TRADE_DTYPE)
+
+
+def decode_trade_ids(records: np.ndarray, fields: dict) -> list[str]:
+    ids = fields.get(b"ids", fields.get("ids"))
+    if ids is None:
+        # numpy strips the trailing null bytes of S16 values
+        return [str(uuid.UUID(bytes=raw_id.ljust(16, b"\0"))) for raw_id in records["i"]]
+    if isinstance(ids, bytes):
+        ids = ids.decode()
+    unique_ids = ids.split("\n")
+    return [unique_ids[int.from_bytes(raw_id, "little")] for raw_id in records["i"]]
+
+
+def records_to_dicts(records: np.ndarray, trade_ids: list[str], symbol: str) -> list[dict]:
+    """the records in the `publicTrade` format of the exchange"""
+    return [
+        {"T": int(T), "s": symbol, "S": SIDE_NAMES[S], "v": repr(float(v)), "p": repr(float(p)), "L": TICK_NAMES[L], "i": i, "BT": int(BT)}
+        for T, p, v, S, L, BT, i in zip(
+            records["T"], records["p"], records["v"], records["S"], records["L"], records["BT"], trade_ids
+        )
+    ]
+
+
+class ColumnarChunkBuffer:
+    """Collects the trades (with their stream ids) until a chunk is full or too old
+
+    Args:
+        chunk_size:     number of trades per chunk
+        max_age_ms:     a partial chunk is emitted when its first trade was buffered longer ago
+    """
+
+    def __init__(self, chunk_size: int = COLUMNAR_CHUNK_SIZE, max_age_ms: int = COLUMNAR_CHUNK_MAX_AGE_MS):
+        self.chunk_size = max(1, chunk_size)
+        self.max_age_ms = max_age_ms
+        self.buffer: list[tuple[str, dict]] = []
+        self.buffered_since: float | None = None
+
+    def add(self, entries: list[tuple[str, dict]]) -> None:
+        if entries and self.buffered_since is None:
+            self.buffered_since = time.monotonic()
+        self.buffer.extend(entries)
+
+    def pop_chunks(self, force: bool = False) -> list[tuple[str, dict]]:
+        """the (id, fields) of the chunks ready to be written, the id of a chunk is the id of its last trade"""
+        chunks = []
+        while len(self.buffer) >= self.chunk_size:
+            chunk, self.buffer = self.buffer[: self.chunk_size], self.buffer[self.chunk_size:]
+            chunks.append((chunk[-1][0], encode_trades([trade for _, trade in chunk])))
+        if self.buffer and (force or (time.monotonic() - self.buffered_since) * 1000 >= self.max_age_ms):
+            chunks.append((self.buffer[-1][0], encode_trades([trade for _, trade in self.buffer])))
+            self.buffer = []
+        self.buffered_since = time.monotonic() if self.buffer else None
+        return chunks
+
+
+async def iter_chunks(redis_db: redis.Redis, stream_name: str, start: int | str = "-", end: int | str = "+", count: int = 100):
+    """yields the records of the chunks with trades between `start` and `end` (ms, inclusive),
+    each as zero copy numpy array on the data returned by redis
+
+    Args:
+        redis_db:       Redis connection
+        stream_name:    the trades stream, e.g. `publicTrade:BTCUSDT`
+        start, end:     timestamps in ms
+        count:          number of chunks fetched per XRANGE
+    """
+    name = chunk_stream_name(stream_name)
+    end_ms = None if end == "+" else int(end)
+    last_key = start
+    while True:
+        chunks = await redis_db.xrange(name, last_key, "+", count=count)
+        if not chunks:
+            return
+        for chunk_id, fields in chunks:
+            records = decode_chunk(fields)
+            mask = np.ones(len(records), dtype=bool)
+            if start != "-":
+                mask &= records["T"] >= int(start)
+            if end_ms is not None:
+                mask &= records["T"] <= end_ms
+            yield records if mask.all() else records[mask]
+            # a chunk is keyed on its last trade, the first chunk beyond `end` can still hold trades before `end`
+            if end_ms is not None and int(chunk_id.split(b"-")[0]) > end_ms:
+                return
+        last_key = f"({chunks[-1][0].decode()}"
+
+
+async def read_trades_columnar(redis_db: redis.Redis, stream_name: str, start: int | str = "-", end: int | str = "+") -> np.ndarray:
+    """all the records between `start` and `end` (ms, inclusive) in one array"""
+    arrays = [records async for records in iter_chunks(redis_db, stream_name, start, end)]
+    if not arrays:
+        return np.empty(0, dtype=TRADE_DTYPE)
+    return np.concatenate(arrays)
@@ -0,0 +1,73 @@
+"""Binary wire formats of the data packages of the `/trades` websocket, send as binary frames.
+Info packages stay JSON text frames in every encoding.
+
+    msgpack:    the JSON package (`type`, `stream`, `id`, `data`) as MessagePack, requires `msgpack`
+    columnar:   a batch of trades without repeated keys, every field is a column:
+                    4 bytes     length of the header, unsigned little endian
+                    header      JSON with `type`, `stream`, `id` (of the last trade), `n` (number of trades),
+                                `v` (version of the layout) and `ids` (see `app.db.columnar`)
+                    columns     the fields of `TRADE_DTYPE` one after the other, `n` little endian values each
+
+The permessage-deflate compression of the frames is negotiated by the client in the websocket
+handshake and done by uvicorn (`--ws-per-message-deflate`), in every encoding."""
+import numpy as np
+from app.db.columnar import CHUNK_VERSION, TRADE_DTYPE, decode_trade_ids, encode_trades
+from app.db.consumer.hub import StreamEntry
+from app.serialize import dumps, loads
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+WIRE_ENCODINGS = ("json", "msgpack", "columnar")
+
+
+def msgpack_package(entry: StreamEntry) -> bytes:
+    package = {"type": "data", "id": entry.id, "data": entry.fields}
+    if entry.stream is not None:
+        package["stream"] = entry.stream
+    return msgpack.packb(package)
+
+
+def msgpack_batch(entries: list[StreamEntry]) -> bytes:
+    last = entries[-1]
+    package = {"type": "data", "id": last.id, "data": [entry.fields for entry in entries]}
+    if last.stream is not None:
+        package["stream"] = last.stream
+    return msgpack.packb(package)
+
+
+def columnar_batch(entries: list[StreamEntry]) -> bytes:
+    """the trades of one stream in the columnar layout"""
+    last = entries[-1]
+    fields = encode_trades([entry.fields for entry in entries])
+    records = np.frombuffer(fields["data"], dtype=TRADE_DTYPE)
+    header = {"type": "data", "stream": last.stream, "id": last.id, "n": len(entries), "v": CHUNK_VERSION}
+    if "ids" in fields:
+        header["ids"] = fields["ids"]
+    header = dumps(header).encode()
+    return b"".join([len(header).to_bytes(4, "little"), header, *(records[name].tobytes() for name in TRADE_DTYPE.names)])
+
+
+def decode_columnar_batch(data: bytes) -> tuple[dict, np.ndarray, list[str]]:
+    """the header, the records (`TRADE_DTYPE`) and the trade ids of a columnar package"""
+    header_size = int.from_bytes(data[:4], "little")
+    header = loads(data[4: 4 + header_size])
+    records = np.empty(header["n"], dtype=TRADE_DTYPE)
+    offset = 4 + header_size
+    for name in TRADE_DTYPE.names:
+        size = records.dtype[name].itemsize * header["n"]
+        records[name] = np.frombuffer(data, dtype=records.dtype[name], count=header["n"], offset=offset)
+        offset += size
+    return header, records, decode_trade_ids(records, header)
+
+
+def encode_binary_packages(entries: list[StreamEntry], batch_size: int, encoding: str) -> list[bytes]:
+    """the packages of entries of one stream, see `encode_packages`. The msgpack package of a single entry is
+    encoded once for all subscribers, a columnar package is always a batch"""
+    if encoding == "msgpack" and batch_size == 1:
+        return [entry.encoded(encoding, msgpack_package) for entry in entries]
+    encode = msgpack_batch if encoding == "msgpack" else columnar_batch
+    return [encode(entries[i: i + batch_size]) for i in range(0, len(entries), batch_size)]
@@ -0,0 +1,322 @@
+import asyncio
+from contextlib import asynccontextmanager
+import os
+import time
+from redis import ResponseError
+from app.db.utils import parse_stream_id, redis_conn_manager
+from app.errors import SlowConsumerError
+from app.logger import streaming_logger
+from app.profiling import stage_timers
+from app.serialize import dumps
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+HUB_QUEUE_SIZE = int(os.getenv("HUB_QUEUE_SIZE", 10000))
+HUB_SLOW_CONSUMER_POLICY = os.getenv("HUB_SLOW_CONSUMER_POLICY", "drop")
+HUB_BLOCK_MS = 10000
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+FANOUT_TIMER = stage_timers.timer("hub.fanout")
+
+
+class StreamEntry:
+    """A redis stream entry, decoded and JSON encoded once and shared by all subscribers"""
+    __slots__ = ("id", "key", "stream", "fields", "_json", "_package", "_encoded")
+
+    def __init__(self, raw_id: bytes, raw_fields: dict, stream: str | None = None):
+        self.id = raw_id.decode()
+        self.stream = stream
+        self.key = parse_stream_id(self.id)
+        self.fields = {k.decode(): v.decode() for k, v in raw_fields.items()}
+        self._json = None
+        self._package = None
+        self._encoded = None
+
+    @classmethod
+    def from_fields(cls, entry_id: str, fields: dict, stream: str | None = None) -> "StreamEntry":
+        """an entry with decoded fields that was not read from redis, e.g. an aggregate of entries"""
+        entry = cls.__new__(cls)
+        entry.id = entry_id
+        entry.stream = stream
+        entry.key = parse_stream_id(entry_id)
+        entry.fields = fields
+        entry._json = None
+        entry._package = None
+        entry._encoded = None
+        return entry
+
+    @property
+    def json(self) -> str:
+        """the fields as JSON object, encoded on first use"""
+        if self._json is None:
+            self._json = dumps(self.fields)
+        return self._json
+
+    @property
+    def package(self) -> str:
+        """the encoded data package (see `make_data_package`) that is send to the websocket clients"""
+        if self._package is None:
+            stream = '"stream":' + dumps(self.stream) + ',' if self.stream is not None else ""
+            self._package = '{"type":"data",' + stream + '"id":"' + self.id + '","data":' + self.json + '}'
+        return self._package
+
+    def encoded(self, encoding: str, encode) -> bytes:
+        """the package in a binary `encoding`, encoded with `encode(entry)` on first use"""
+        if self._encoded is None:
+            self._encoded = {}
+        package = self._encoded.get(encoding)
+        if package is None:
+            package = self._encoded[encoding] = encode(self)
+        return package
+
+
+class Subscriber:
+    """Bounded queue of live entries for one consumer of a stream.
+
+    Args:
+        stream:     name of the redis stream
+        maxsize:    number of entries that can wait in the queue
+        policy:     what to do when the queue is full
+                    `drop`: the new entry is dropped for this subscriber
+                    `coalesce`: the oldest waiting entry is dropped, so the subscriber stays close to live
+                    `disconnect`: the subscriber gets a `SlowConsumerError` on its next `get`
+        replaying:  the consumer replays the cached entries first. Until `end_replay` a full queue doesn't
+                    apply the `policy`, the entries that don't fit are read from redis by the replay
+    """
+
+    def __init__(self, stream: str, maxsize: int = HUB_QUEUE_SIZE, policy: str = HUB_SLOW_CONSUMER_POLICY, replaying: bool = False):
+        assert policy in SLOW_CONSUMER_POLICIES, f"only policies {SLOW_CONSUMER_POLICIES} are allowed"
+        self.stream = stream
+        self.policy = policy
+        self.queue: asyncio.Queue[StreamEntry] = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.error: Exception | None = None
+        self.replaying = replaying
+        self.overflowed = False  # entries didn't fit in the queue during the replay
+
+    def push(self, entry: StreamEntry) -> None:
+        """called by the stream reader, never blocks"""
+        if self.error is not None:
+            return
+        try:
+            self.queue.put_nowait(entry)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.replaying:
+            self.overflowed = True
+            return
+        self.dropped += 1
+        if self.policy == "coalesce":
+            self.queue.get_nowait()
+            self.queue.put_nowait(entry)
+        elif self.policy == "disconnect":
+            self.close(SlowConsumerError(f"subscriber of {self.stream} is too slow, {self.queue.maxsize} entries waiting"))
+
+    def end_replay(self, replayed) -> bool:
+        """called when the replay reached the end of the stream(s). When live entries didn't fit in the
+        queue meanwhile, the queue is emptied and False returned: the replay has to continue, the entries
+        pushed from now on are kept. Otherwise the waiting entries for which `replayed(entry)` is True are
+        removed, the live entries follow and the policy applies"""
+        waiting = []
+        while not self.queue.empty():
+            waiting.append(self.queue.get_nowait())
+        if self.overflowed:
+            self.overflowed = False
+            return False
+        for entry in waiting:
+            if entry is None or not replayed(entry):
+                self.queue.put_nowait(entry)
+        self.replaying = False
+        return True
+
+    def close(self, error: Exception) -> None:
+        """let the next `get` raise the error"""
+        self.error = error
+        if self.queue.empty():
+            self.queue.put_nowait(None)  # wake up a waiting `get`
+
+    async def get(self) -> StreamEntry:
+        """next entry, raises the error of `close` once the waiting entries are consumed
+        (immediately for a slow consumer)"""
+        if self.error is not None and (self.queue.empty() or isinstance(self.error, SlowConsumerError)):
+            raise self.error
+        entry = await self.queue.get()
+        if entry is None:
+            raise self.error
+        return entry
+
+    def get_nowait(self) -> StreamEntry | None:
+        """next entry when one is waiting, otherwise None"""
+        if self.error is not None and (self.queue.empty() or isinstance(self.error, SlowConsumerError)):
+            raise self.error
+        try:
+            entry = self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+        if entry is None:
+            raise self.error
+        return entry
+
+
+class StreamTail:
+    """Live state of a redis stream in the hub: the last read id and the subscribers of the stream"""
+
+    def __init__(self, stream: str):
+        self.stream = stream
+        self.subscribers: set[Subscriber] = set()
+        self.ready = asyncio.Event()
+        self.last_id = "0-0"
+        self.entries_read = 0
+
+    async def init(self, redis_db) -> None:
+        try:
+            # start after the current last entry, subscribers replay everything up to there themselves
+            info = await redis_db.xinfo_stream(self.stream)
+            self.last_id = info["last-generated-id"].decode()
+        except ResponseError:
+            self.last_id = "0-0"
+        self.ready.set()
+
+    def push(self, raw_entries: list) -> None:
+        """decode the entries and put them in the queues of the subscribers"""
+        if stage_timers.enabled:
+            start = time.perf_counter()
+        for raw_id, raw_fields in raw_entries:
+            entry = StreamEntry(raw_id, raw_fields, self.stream)
+            for subscriber in tuple(self.subscribers):
+                subscriber.push(entry)
+        self.entries_read += len(raw_entries)
+        self.last_id = entry.id
+        if stage_timers.enabled:
+            FANOUT_TIMER.observe(time.perf_counter() - start)
+
+    def close(self, error: Exception) -> None:
+        self.ready.set()
+        for subscriber in tuple(self.subscribers):
+            subscriber.close(error)
+
+    def stats(self) -> dict:
+        depths = [subscriber.queue.qsize() for subscriber in self.subscribers]
+        return {
+            "stream": self.stream,
+            "subscribers": len(self.subscribers),
+            "entries_read": self.entries_read,
+            "last_id": self.last_id,
+            "max_queue_depth": max(depths, default=0),
+            "total_queue_depth": sum(depths),
+            "dropped": sum(subscriber.dropped for subscriber in self.subscribers),
+        }
+
+
+class TradesHub:
+    """In process broadcast of redis streams: a single reader follows all watched streams with one
+    multi-key XREAD, no matter how many websocket clients are watching them.
+
+    Args:
+        conn_manager:   context manager providing the redis connection of the reader
+        block_ms:       max time the reader blocks in XREAD
+    """
+
+    def __init__(self, conn_manager=redis_conn_manager, block_ms: int = HUB_BLOCK_MS):
+        self.conn_manager = conn_manager
+        self.block_ms = block_ms
+        self.tails: dict[str, StreamTail] = {}
+        self.task: asyncio.Task | None = None
+        self.closing = False
+        self.wakeup = asyncio.Event()  # a stream was added, restart the blocking XREAD
+
+    async def read(self, redis_db) -> None:
+        """XREAD the streams until one is added, then the XREAD is abandoned and started again with the new stream.
+        Nothing gets lost, the next XREAD continues from the same ids"""
+        self.wakeup.clear()
+        if self.closing or not all(tail.ready.is_set() for tail in self.tails.values()):
+            return  # a stream was added while the others were initialized
+        streams = {tail.stream: tail.last_id for tail in self.tails.values()}
+        if not streams:
+            await self.wakeup.wait()
+            return
+        reading = asyncio.create_task(redis_db.xread(streams, count=10000, block=self.block_ms))
+        waking = asyncio.create_task(self.wakeup.wait())
+        try:
+            await asyncio.wait((reading, waking), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            reading.cancel()  # closing, the connection goes with the hub
+            raise
+        finally:
+            waking.cancel()
+        if not reading.done():
+            reading.cancel()  # the client drops the connection of a cancelled command
+            # a cancellation right after the start of the command can be swallowed, the result is used then
+            await asyncio.wait((reading,))
+        if reading.cancelled():
+            return
+        for stream, raw_entries in reading.result() or ():
+            tail = self.tails.get(stream.decode())
+            if tail is not None and raw_entries:
+                tail.push(raw_entries)
+
+    async def run(self) -> None:
+        err = None
+        try:
+            async with self.conn_manager() as redis_db:
+                while not self.closing:
+                    for tail in [tail for tail in self.tails.values() if not tail.ready.is_set()]:
+                        await tail.init(redis_db)
+                    await self.read(redis_db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"unknown error in the reader of the trades hub: {e}")
+            err = e
+        finally:
+            for tail in self.tails.values():
+                tail.close(err or ConnectionError(f"reader of stream {tail.stream} stopped"))
+            self.tails = {}
+
+    @asynccontextmanager
+    async def subscribe(self, streams: str | list[str], maxsize: int = HUB_QUEUE_SIZE, policy: str = HUB_SLOW_CONSUMER_POLICY,
+                        replaying: bool = False):
+        """subscribe to the live entries of one or more streams, entries before the subscription are not delivered.
+        Once entered, every entry after `tail.last_id` of its stream will be pushed to the subscriber.
+        With `replaying` the subscriber replays the cached entries first, see `Subscriber`"""
+        streams = [streams] if isinstance(streams, str) else list(streams)
+        subscriber = Subscriber(",".join(streams), maxsize=maxsize, policy=policy, replaying=replaying)
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.task = asyncio.create_task(self.run())
+        tails = []
+        for stream in streams:
+            tail = self.tails.get(stream)
+            if tail is None:
+                tail = self.tails[stream] = StreamTail(stream)
+                self.wakeup.set()
+            tail.subscribers.add(subscriber)
+            tails.append(tail)
+        try:
+            for tail in tails:
+                await tail.ready.wait()
+            yield subscriber
+        finally:
+            for tail in tails:
+                tail.subscribers.discard(subscriber)
+                # the reader stops reading the stream after its current XREAD
+                if not tail.subscribers and self.tails.get(tail.stream) is tail:
+                    del self.tails[tail.stream]
+
+    async def close(self) -> None:
+        # the flag stops the reader after its current XREAD, in case the client swallows the cancellation
+        self.closing = True
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.tails = {}
+
+    def stats(self) -> list[dict]:
+        return [tail.stats() for tail in self.tails.values()]
+
+
+trades_hub = TradesHub()
@@ -1,12 +1,24 @@
+import asyncio
+import heapq
+import math
+import time
+from app.db.consumer.encodings import encode_binary_packages
+from app.db.consumer.hub import StreamEntry, Subscriber, parse_stream_id, trades_hub
+from app.db.consumer.views import TradeView
 from app.db.utils import redis_conn_manager
+from app.errors import SlowConsumerError
 from app.logger import streaming_logger
+from app.metrics import REDIS_LATENCY, SEND_LAG
+from app.profiling import stage_timers
+from app.serialize import dumps
 import os
 
 
 logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+ENCODE_TIMER = stage_timers.timer("consumer.encode")
 
 
-def make_data_package(type: str, content: str|dict) -> dict:
+def make_data_package(type: str, content: str|dict, id: str|None = None) -> dict:
     assert type in ['info', 'data'], "only types 'info' and 'data' are allowed"
     try:
         content = {k.decode(): v.decode() for k, v in content.items()}
@@ -14,47 +26,203 @@ def make_data_package(type: str, content: str|dict) -> dict:
         pass
     if type=="info":
         return {"type":"info", "msg":content}
+    elif id is not None:
+        return {"type":"data", "id":id, "data":content}
     else:
         return {"type":"data", "data":content}
 
 
-async def trades_consumer(stream: str, start_timestamp: int) -> dict:
+def encode_info_package(msg: str) -> str:
+    return dumps(make_data_package("info", msg))
+
+
+def encode_data_batch(entries: list[StreamEntry]) -> str:
+    """one data package with a list of trades of one stream, built from the already encoded entries.
+    The `id` of the package is the id of its last entry, the cursor to resume from"""
+    last = entries[-1]
+    stream = '"stream":' + dumps(last.stream) + ',' if last.stream is not None else ""
+    return '{"type":"data",' + stream + '"id":"' + last.id + '","data":[' + ",".join(entry.json for entry in entries) + ']}'
+
+
+def encode_packages(entries: list[StreamEntry], batch_size: int, encoding: str = "json") -> list[str | bytes]:
+    """the packages of entries of one stream, a package per entry or batches of at most `batch_size` entries.
+    JSON packages are strings, the packages of the binary encodings bytes"""
+    if stage_timers.enabled:
+        start = time.perf_counter()
+    if encoding != "json":
+        packages = encode_binary_packages(entries, batch_size, encoding)
+    elif batch_size == 1:
+        packages = [entry.package for entry in entries]
+    else:
+        packages = [encode_data_batch(entries[i: i + batch_size]) for i in range(0, len(entries), batch_size)]
+    if stage_timers.enabled:
+        ENCODE_TIMER.observe(time.perf_counter() - start)
+    return packages
+
+
+async def next_live_batch(subscriber: Subscriber, first: StreamEntry, batch_size: int, batch_delay_ms: int,
+                          replayed: dict[str, tuple[int, int]]) -> list[StreamEntry]:
+    """collect up to `batch_size` live entries, waiting at most `batch_delay_ms` after the first one.
+    The entries up to the `replayed` key of their stream are skipped"""
+    batch = [first]
+    deadline = asyncio.get_running_loop().time() + batch_delay_ms / 1000
+    while len(batch) < batch_size:
+        entry = subscriber.get_nowait()
+        if entry is None:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(subscriber.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+        if entry.key > replayed[entry.stream]:
+            batch.append(entry)
+    return batch
+
+
+async def replay_stream(redis_db, stream: str, start: int | str, chunk_size: int):
+    """yields chunks of the cached entries of a stream from `start` (ms, or an exclusive `(id`)"""
+    last_key = start
+    xrange_latency = REDIS_LATENCY.labels("xrange")
+    while True:
+        begin = time.perf_counter()
+        messages = await redis_db.xrange(stream, last_key, count=chunk_size)
+        xrange_latency.observe(time.perf_counter() - begin)
+        if not messages:
+            return
+        yield [StreamEntry(*message, stream) for message in messages]
+        if len(messages) < chunk_size:
+            return
+        last_key = f"({messages[-1][0].decode()}"
+
+
+async def replay_merged(redis_db, starts: dict[str, int | str], chunk_size: int):
+    """yields the cached entries of several streams merged in the order of their ids (timestamps),
+    reading every stream in chunks"""
+    readers = {stream: replay_stream(redis_db, stream, start, chunk_size) for stream, start in starts.items()}
+    buffers = {}
+    heap = []
+    for index, (stream, reader) in enumerate(readers.items()):
+        buffers[stream] = await anext(reader, [])
+        if buffers[stream]:
+            heap.append((buffers[stream][0].key, index, stream, 0))
+    heapq.heapify(heap)
+    while heap:
+        _, index, stream, position = heap[0]
+        yield buffers[stream][position]
+        position += 1
+        if position == len(buffers[stream]):
+            buffers[stream] = await anext(readers[stream], [])
+            position = 0
+        if position < len(buffers[stream]):
+            heapq.heapreplace(heap, (buffers[stream][position].key, index, stream, position))
+        else:
+            heapq.heappop(heap)
+
+
+def group_by_stream(entries: list[StreamEntry]) -> list[list[StreamEntry]]:
+    """the entries split per stream, in the order of the first entry of every stream"""
+    groups: dict[str, list[StreamEntry]] = {}
+    for entry in entries:
+        groups.setdefault(entry.stream, []).append(entry)
+    return list(groups.values())
+
+
+async def multi_trades_consumer(
+    starts: dict[str, int | str], batch_size: int = 1, batch_delay_ms: int = 0, merge: bool = False,
+    view: TradeView | None = None, encoding: str = "json",
+) -> str | bytes:
+    """yields the encoded packages for a subscriber of several streams, read live with a single XREAD
+    of the hub. Data packages of the live entries are encoded once and the same string is yielded to every
+    subscriber. Every data package carries its `stream`, a batch holds the trades of one stream.
+
+    Args:
+        starts:             replay the cached entries of every stream from this timestamp (ms) or after this
+                            exclusive `(<id>`
+        batch_size:         max number of trades per package, above 1 the `data` of a package is a list of trades
+        batch_delay_ms:     max time to wait for more live trades to fill a package
+        merge:              replay the streams merged in timestamp order, otherwise one stream after the other
+        view:               filter and downsampling of the trades, per stream
+        encoding:           of the data packages, `json` or one of the binary encodings (see `app.db.consumer.encodings`)
+    """
     err = None
+    send_lags = {stream: SEND_LAG.labels(stream) for stream in starts}
     try:
-        yield make_data_package("info", "start message")
-   
-        async with redis_conn_manager() as redis_db:
-        
-            yield make_data_package("info", "connected to redis")
-            yield make_data_package("info", "fetch cached data")
-            last_key = start_timestamp
-            try:
+        yield encode_info_package("start message")
+        # subscribe to the live entries before replaying the cached ones, so nothing gets lost in between.
+        # the live entries are read once from redis for all consumers of the streams
+        async with trades_hub.subscribe(list(starts), replaying=True) as subscriber:
+            # the live entries up to the resume cursors are skipped
+            replayed = {stream: parse_stream_id(start[1:]) if str(start).startswith("(") else (0, 0) for stream, start in starts.items()}
+            async with redis_conn_manager() as redis_db:
+                yield encode_info_package("connected to redis")
+                yield encode_info_package("fetch cached data")
+                # fetch in chunks of (about) 10000, whole batches per chunk
+                chunk_size = batch_size * math.ceil(10000 / batch_size)
                 while True:
-                    # fetch in chuncks of 10000
-                    init_messages = await redis_db.xrange(stream, last_key, count=10000 )
-                    for message in init_messages:
-                        yield make_data_package("data", message[1])
-                    last_key = init_messages[-1][0].decode()
-            except IndexError:
-                last_key = '$'  # special redis key that only new data will be supplied
-            yield make_data_package("info", "wait for new data")
+                    if merge:
+                        batch = []
+                        async for replayed_entry in replay_merged(redis_db, starts, chunk_size):
+                            replayed[replayed_entry.stream] = replayed_entry.key
+                            for entry in (replayed_entry,) if view is None else view.process([replayed_entry]):
+                                # a package holds one stream, a run of the same stream is batched
+                                if batch and (batch[-1].stream != entry.stream or len(batch) == batch_size):
+                                    for package in encode_packages(batch, batch_size, encoding):
+                                        yield package
+                                    batch = []
+                                batch.append(entry)
+                        for package in encode_packages(batch, batch_size, encoding):
+                            yield package
+                    else:
+                        for stream, start in starts.items():
+                            async for entries in replay_stream(redis_db, stream, start, chunk_size):
+                                replayed[stream] = entries[-1].key
+                                for package in encode_packages(entries if view is None else view.process(entries), batch_size, encoding):
+                                    yield package
+                    if subscriber.end_replay(lambda entry: entry.key <= replayed[entry.stream]):
+                        break
+                    # live entries were dropped during a long replay, read them from redis
+                    starts = {stream: f"({replayed[stream][0]}-{replayed[stream][1]}" if replayed[stream] != (0, 0) else start
+                              for stream, start in starts.items()}
+
+            yield encode_info_package("wait for new data")
             while True:
-                messages = await redis_db.xread({stream: last_key}, count=10000, block=10000)
-                if not messages:
-                    logger.warn("got no incomming messages from redis in 10seconds. Error?")
-                    yield make_data_package("info", "got no incomming messages from redis in 10seconds. Error?")
+                # the pending samples of a downsampling view are send when no trades follow within their interval
+                idle_timeout = view.idle_timeout if view is not None else None
+                try:
+                    entry = await asyncio.wait_for(subscriber.get(), idle_timeout or 10)
+                except asyncio.TimeoutError:
+                    if idle_timeout is not None:
+                        for group in group_by_stream(view.flush()):
+                            for package in encode_packages(group, batch_size, encoding):
+                                yield package
+                        continue
+                    logger.warning("got no incomming messages from redis in 10seconds. Error?")
+                    yield encode_info_package("got no incomming messages from redis in 10seconds. Error?")
                     continue
-                stream_msgs = messages[0]  # TODO make sure the correct stream is the first one
-                for message in stream_msgs[1]:
-                    yield make_data_package("data", message[1])
-                # set last key
-                if stream_msgs[1]:
-                    last_key = message[0].decode()
+                if entry.key <= replayed[entry.stream]:
+                    continue  # already send during the replay
+                if batch_size == 1 and view is None and encoding == "json":
+                    yield entry.package
+                else:
+                    # collect across the streams, then one package per stream
+                    batch = [entry] if batch_size == 1 else await next_live_batch(subscriber, entry, batch_size, batch_delay_ms, replayed)
+                    entry = batch[-1]
+                    for group in group_by_stream(batch if view is None else view.process(batch)):
+                        for package in encode_packages(group, batch_size, encoding):
+                            yield package
+                # the generator resumes once the package is send
+                send_lags[entry.stream].observe(time.time() - entry.key[0] / 1000)
+    except SlowConsumerError as e:
+        logger.warning(f"disconnecting the multi_trades_consumer: {e}")
+        err = e
+        yield encode_info_package(f"disconnected: {e}")
     except Exception as e:
-        logger.error(f"unknow error in `trades_consumer`: {e}")
+        logger.error(f"unknow error in `multi_trades_consumer`: {e}")
         err = e
     finally:
         if err:
-            logger.error(f"closing the trades_consumer, due to error: {err}")
+            logger.error(f"closing the multi_trades_consumer, due to error: {err}")
         else:
-            logger.info("closing the trades_consumer")
+            logger.info("closing the multi_trades_consumer")
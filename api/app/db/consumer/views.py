@@ -0,0 +1,163 @@
+"""Server side filtering and downsampling of the trades of a subscription. The view is applied to
+the decoded entries before they are encoded, a client only costs the encoding and bandwidth of
+the packages it actually receives.
+
+The intervals of the downsampling are based on the stream ids, which are the trade timestamps.
+An interval is complete once a trade of a later interval arrives or when no trades arrived for
+an interval long (see `TradeView.idle_timeout`)."""
+from app.db.consumer.hub import StreamEntry
+
+
+DOWNSAMPLE_MODES = ("latest", "aggregate")
+
+
+class TradeFilter:
+    """Passes the trades that match all of the given conditions
+
+    Args:
+        side:           `Buy` or `Sell`
+        min_size:       min size (`v`) of a trade
+        min_notional:   min size times price of a trade
+        block_trade:    only block trades (True) or only the other trades (False)
+    """
+    __slots__ = ("side", "min_size", "min_notional", "block_trade")
+
+    def __init__(self, side: str | None = None, min_size: float | None = None, min_notional: float | None = None,
+                 block_trade: bool | None = None):
+        self.side = side
+        self.min_size = min_size
+        self.min_notional = min_notional
+        self.block_trade = None if block_trade is None else ("1" if block_trade else "0")  # stored as 0/1
+
+    def __call__(self, fields: dict) -> bool:
+        if self.side is not None and fields.get("S") != self.side:
+            return False
+        if self.block_trade is not None and fields.get("BT", "0") != self.block_trade:
+            return False
+        if self.min_size is not None or self.min_notional is not None:
+            size = float(fields.get("v", 0))
+            if self.min_size is not None and size < self.min_size:
+                return False
+            if self.min_notional is not None and size * float(fields.get("p", 0)) < self.min_notional:
+                return False
+        return True
+
+
+class Aggregate:
+    """Open, high, low, close, volume and number of the trades of one interval"""
+    __slots__ = ("start", "symbol", "open", "high", "low", "close", "volume", "count", "last")
+
+    def __init__(self, start: int, entry: StreamEntry):
+        price = float(entry.fields.get("p", 0))
+        self.start = start
+        self.symbol = entry.fields.get("s")
+        self.open = self.high = self.low = self.close = price
+        self.volume = 0.0
+        self.count = 0
+        self.last = entry
+        self.add(entry, price)
+
+    def add(self, entry: StreamEntry, price: float) -> None:
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += float(entry.fields.get("v", 0))
+        self.count += 1
+        self.last = entry
+
+    def entry(self) -> StreamEntry:
+        """the aggregate as entry, with the id of its last trade so a client can resume after the interval"""
+        return StreamEntry.from_fields(self.last.id, {
+            "t": self.start, "s": self.symbol, "o": self.open, "h": self.high, "l": self.low, "c": self.close,
+            "v": self.volume, "n": self.count,
+        }, self.last.stream)
+
+
+class Downsampler:
+    """One sample per `interval_ms` per stream
+
+    Args:
+        mode:           `latest`: the last trade of the interval, the entry itself so its package is shared
+                        `aggregate`: an `Aggregate` of the trades of the interval
+        interval_ms:    length of the intervals
+    """
+
+    def __init__(self, mode: str, interval_ms: int):
+        assert mode in DOWNSAMPLE_MODES, f"only modes {DOWNSAMPLE_MODES} are allowed"
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.pending: dict[str | None, tuple[int, StreamEntry | Aggregate]] = {}  # stream => (interval, sample)
+        self.flushed: dict[str | None, int] = {}  # stream => last interval send by `flush`
+
+    def add(self, entry: StreamEntry) -> StreamEntry | None:
+        """returns the sample of the previous interval of the stream when the entry starts a new one.
+        A trade of an interval that was already send by `flush` is folded into the next interval"""
+        interval = max(entry.key[0] // self.interval_ms, self.flushed.get(entry.stream, -1) + 1)
+        pending = self.pending.get(entry.stream)
+        if pending is not None and pending[0] == interval:
+            if self.mode == "latest":
+                self.pending[entry.stream] = (interval, entry)
+            else:
+                pending[1].add(entry, float(entry.fields.get("p", 0)))
+            return None
+        sample = entry if self.mode == "latest" else Aggregate(interval * self.interval_ms, entry)
+        self.pending[entry.stream] = (interval, sample)
+        if pending is None:
+            return None
+        return pending[1] if self.mode == "latest" else pending[1].entry()
+
+    def flush(self) -> list[StreamEntry]:
+        """the samples of the intervals that are not complete yet"""
+        samples = [sample if self.mode == "latest" else sample.entry() for _, sample in self.pending.values()]
+        self.flushed.update((stream, interval) for stream, (interval, _) in self.pending.items())
+        self.pending = {}
+        return samples
+
+
+class TradeView:
+    """The filter and downsampling of a subscription
+
+    Args:
+        filter:     drops the trades that don't match
+        sampler:    samples the trades that passed the filter
+    """
+
+    def __init__(self, filter: TradeFilter | None = None, sampler: Downsampler | None = None):
+        self.filter = filter
+        self.sampler = sampler
+
+    def process(self, entries: list[StreamEntry]) -> list[StreamEntry]:
+        """the entries to send for the next entries of the streams"""
+        if self.filter is not None:
+            accept = self.filter
+            entries = [entry for entry in entries if accept(entry.fields)]
+        if self.sampler is None:
+            return entries
+        samples = []
+        for entry in entries:
+            sample = self.sampler.add(entry)
+            if sample is not None:
+                samples.append(sample)
+        return samples
+
+    def flush(self) -> list[StreamEntry]:
+        return self.sampler.flush() if self.sampler is not None else []
+
+    @property
+    def idle_timeout(self) -> float | None:
+        """seconds to wait for a next trade before the pending samples are send, None when nothing is pending"""
+        if self.sampler is None or not self.sampler.pending:
+            return None
+        return self.sampler.interval_ms / 1000
+
+
+def make_trade_view(filter: dict | None = None, downsample: dict | None = None) -> TradeView | None:
+    """the view of a subscription (see `TradeFilterModel` and `DownsampleModel`), None when it sends every trade"""
+    if filter is None and downsample is None:
+        return None
+    return TradeView(
+        TradeFilter(**filter) if filter is not None else None,
+        Downsampler(**downsample) if downsample is not None else None,
+    )
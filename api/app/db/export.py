@@ -0,0 +1,101 @@
+"""Export of a range of a trades stream as NDJSON, CSV or an Arrow IPC stream. The stream is read
+with XRANGE in chunks and every chunk is encoded and send before the next one is read, so the
+memory use doesn't depend on the length of the range.
+
+Every row has the stream `id` of the trade. A response with `limit` rows can be continued with
+the id of its last row as `cursor`."""
+import csv
+import io
+import os
+import pyarrow as pa
+from app.db.archive import ARCHIVE_SCHEMA, entries_to_frame
+from app.db.utils import redis_conn_manager
+from app.logger import streaming_logger
+from app.serialize import dumps
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 10000))
+EXPORT_COLUMNS = ARCHIVE_SCHEMA.names
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+async def iter_entry_chunks(
+    stream_name: str,
+    start: int | str = "-",
+    end: int | str = "+",
+    cursor: str | None = None,
+    limit: int | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """yields the entries between `start` and `end` (ms, inclusive) in chunks of at most `chunk_size`
+
+    Args:
+        stream_name:    e.g. `publicTrade:BTCUSDT`
+        start, end:     timestamps in ms
+        cursor:         continue after this stream id instead of at `start`
+        limit:          max number of entries, None for the whole range
+        chunk_size:     entries per XRANGE
+    """
+    last_key = f"({cursor}" if cursor else start
+    remaining = limit
+    # a connection of its own, the response is streamed after the dependencies of the endpoint are closed
+    async with redis_conn_manager() as redis_db:
+        while remaining is None or remaining > 0:
+            count = chunk_size if remaining is None else min(chunk_size, remaining)
+            entries = await redis_db.xrange(stream_name, last_key, end, count=count)
+            if not entries:
+                return
+            yield entries
+            if remaining is not None:
+                remaining -= len(entries)
+            if len(entries) < count:
+                return
+            last_key = f"({entries[-1][0].decode()}"
+
+
+async def export_ndjson(chunks):
+    """a JSON object per line"""
+    async for entries in chunks:
+        yield "".join(
+            dumps({"id": entry_id.decode(), **{k.decode(): v.decode() for k, v in fields.items()}}) + "\n"
+            for entry_id, fields in entries
+        )
+
+
+async def export_csv(chunks):
+    """a header and a row per trade"""
+    yield ",".join(EXPORT_COLUMNS) + "\r\n"
+    async for entries in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        keys = [name.encode() for name in EXPORT_COLUMNS[1:]]
+        writer.writerows([entry_id.decode(), *(fields.get(key, b"").decode() for key in keys)] for entry_id, fields in entries)
+        yield buffer.getvalue()
+
+
+async def export_arrow(chunks):
+    """an Arrow IPC stream with a typed record batch per chunk"""
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, ARCHIVE_SCHEMA)
+
+    def take() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield take()  # the schema
+    async for entries in chunks:
+        writer.write_batch(pa.RecordBatch.from_pandas(entries_to_frame(entries), schema=ARCHIVE_SCHEMA, preserve_index=False))
+        yield take()
+    writer.close()
+    yield take()  # end of stream marker
+
+
+EXPORTERS = {"ndjson": export_ndjson, "csv": export_csv, "arrow": export_arrow}
@@ -0,0 +1,92 @@
+import os
+import time
+import redis.asyncio as redis
+from app.db.producer.trades import BatchStats, ingest_stats
+from app.logger import streaming_logger
+from app.orderbook import OrderBook
+from app.serialize import dumps, loads
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+ORDERBOOK_DEPTH = int(os.getenv("ORDERBOOK_DEPTH", 50))  # 1, 50, 200 or 500 levels for linear contracts
+# ms between the snapshots of a book in redis, for the workers that don't ingest the symbol. 0 disables them
+ORDERBOOK_SNAPSHOT_INTERVAL_MS = int(os.getenv("ORDERBOOK_SNAPSHOT_INTERVAL_MS", 1000))
+
+# the books maintained by this process, keyed on symbol
+order_books: dict[str, OrderBook] = {}
+
+
+def orderbook_topic(symbol: str, depth: int = ORDERBOOK_DEPTH) -> str:
+    return f"orderbook.{depth}.{symbol}"
+
+
+def snapshot_key(symbol: str) -> str:
+    return f"orderbook:{symbol}"
+
+
+async def read_snapshot(redis_db: redis.Redis, symbol: str) -> dict | None:
+    """the last snapshot (see `OrderBook.depth`) stored by the worker that ingests the symbol"""
+    snapshot = await redis_db.get(snapshot_key(symbol))
+    return loads(snapshot) if snapshot is not None else None
+
+
+class OrderBookWriter:
+    """Applies the frames of an `orderbook.<depth>.<symbol>` topic to the in process book of the symbol
+    and stores a snapshot of it in redis every `snapshot_interval_ms`. Has the interface of
+    `TradesStreamWriter` that `ExchangeConnection` uses.
+
+    Args:
+        redis_db:               Redis connection
+        topic:                  e.g. `orderbook.50.BTCUSDT`
+        snapshot_interval_ms:   ms between the snapshots, 0 keeps the book in process only
+    """
+
+    def __init__(self, redis_db: redis.Redis, topic: str, snapshot_interval_ms: int = ORDERBOOK_SNAPSHOT_INTERVAL_MS):
+        self.redis_db = redis_db
+        self.symbol = topic.rsplit(".", 1)[-1]
+        self.stream_name = snapshot_key(self.symbol)
+        self.snapshot_interval_ms = snapshot_interval_ms
+        self.book = order_books[self.symbol] = OrderBook(self.symbol)
+        self.changed_since: float | None = None
+        self.last_snapshot = 0.0
+        self.stats = ingest_stats.setdefault(self.stream_name, BatchStats(self.stream_name))
+        self.needs_backfill = False  # the exchange sends a snapshot on the subscribe, nothing to backfill
+
+    def on_reconnect(self) -> None:
+        """the book is stale until the exchange sends a new snapshot on the subscribe"""
+        self.book.reset()
+
+    def add_frame(self, frame: dict) -> None:
+        if self.book.apply(frame) and self.changed_since is None:
+            self.changed_since = time.monotonic()
+
+    def time_to_flush(self) -> float | None:
+        """seconds until the next snapshot, None when the book didn't change"""
+        if self.changed_since is None or not self.snapshot_interval_ms:
+            return None
+        return max(0.0, self.last_snapshot + self.snapshot_interval_ms / 1000 - time.monotonic())
+
+    @property
+    def due(self) -> bool:
+        return self.time_to_flush() == 0
+
+    async def flush(self, force: bool = False) -> int:
+        """store a snapshot of the book, returns the number of stored levels"""
+        if self.changed_since is None or not self.snapshot_interval_ms or not self.book.ready:
+            return 0
+        start = time.perf_counter()
+        depth = self.book.depth()
+        # stale snapshots of a stopped ingestion expire
+        await self.redis_db.set(self.stream_name, dumps(depth), px=max(60000, 10 * self.snapshot_interval_ms))
+        levels = len(depth["b"]) + len(depth["a"])
+        self.stats.record_flush(levels, (time.perf_counter() - start) * 1000)
+        self.changed_since = None
+        self.last_snapshot = time.monotonic()
+        return levels
+
+    async def close(self) -> None:
+        """stop serving the book from this process, e.g. when another worker took over the topic.
+        No last snapshot, it could overwrite the one of the new owner"""
+        if order_books.get(self.symbol) is self.book:
+            del order_books[self.symbol]
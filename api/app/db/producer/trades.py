@@ -0,0 +1,301 @@
+import asyncio
+from dataclasses import dataclass, field
+import os
+import time
+from typing import TypedDict
+import redis.asyncio as redis
+from redis import ResponseError
+from app.db.columnar import ColumnarChunkBuffer, chunk_stream_name, decode_chunk, decode_trade_ids
+from app.db.timeseries import TIMESERIES_ENABLED, add_trades_to_pipeline, ensure_candle_series
+from app.logger import streaming_logger
+from app.metrics import INGEST_LAG, REDIS_LATENCY, TRADES_INGESTED, TRADES_REJECTED
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+INGEST_MAX_BATCH_SIZE = int(os.getenv("INGEST_MAX_BATCH_SIZE", 1000))
+INGEST_MAX_LATENCY_MS = int(os.getenv("INGEST_MAX_LATENCY_MS", 0))
+INGEST_TRANSACTION = os.getenv("INGEST_TRANSACTION", "false").lower() in ("1", "true", "yes")
+# `fields`: an entry with string fields per trade, `columnar`: chunks of binary records (see `app.db.columnar`), or `both`
+TRADES_STORAGE_FORMAT = os.getenv("TRADES_STORAGE_FORMAT", "fields")
+STORAGE_FORMATS = ("fields", "columnar", "both")
+
+
+class PublicTrade(TypedDict):
+    """A trade in the `data` list of a bybit `publicTrade` frame, as decoded from JSON"""
+    T: int      # trade timestamp (ms)
+    s: str      # symbol
+    S: str      # side, `Buy` or `Sell`
+    v: str      # size
+    p: str      # price
+    L: str      # tick direction
+    i: str      # trade id
+    BT: bool    # block trade, stored as 0/1
+
+
+@dataclass
+class BatchStats:
+    """Counters of the batched writes to one Redis stream"""
+    stream: str
+    flushes: int = 0
+    entries: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    last_flush_latency_ms: float = 0.0
+    max_flush_latency_ms: float = 0.0
+    total_flush_latency_ms: float = 0.0
+    last_flush_time: float = 0.0  # unix time of the last flush
+    rejected: int = 0  # entries dropped because redis rejected them
+    receive_queue_length: int = 0
+    max_receive_queue_length: int = 0
+    batch_size_buckets: dict = field(default_factory=lambda: {1: 0, 10: 0, 100: 0, 1000: 0, "+Inf": 0})
+
+    def record_flush(self, batch_size: int, latency_ms: float) -> None:
+        self.flushes += 1
+        self.entries += batch_size
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.last_flush_latency_ms = latency_ms
+        self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+        self.total_flush_latency_ms += latency_ms
+        self.last_flush_time = time.time()
+        for bucket in self.batch_size_buckets:
+            if bucket == "+Inf" or batch_size <= bucket:
+                self.batch_size_buckets[bucket] += 1
+                break
+
+    def record_queue_length(self, length: int) -> None:
+        self.receive_queue_length = length
+        self.max_receive_queue_length = max(self.max_receive_queue_length, length)
+
+    def as_dict(self) -> dict:
+        avg_batch_size = self.entries / self.flushes if self.flushes else 0
+        avg_latency = self.total_flush_latency_ms / self.flushes if self.flushes else 0
+        return {
+            "stream": self.stream,
+            "flushes": self.flushes,
+            "entries": self.entries,
+            "avg_batch_size": avg_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "batch_size_buckets": {str(k): v for k, v in self.batch_size_buckets.items()},
+            "avg_flush_latency_ms": avg_latency,
+            "last_flush_latency_ms": self.last_flush_latency_ms,
+            "max_flush_latency_ms": self.max_flush_latency_ms,
+            "last_flush_time": self.last_flush_time,
+            "rejected": self.rejected,
+            "receive_queue_length": self.receive_queue_length,
+            "max_receive_queue_length": self.max_receive_queue_length,
+        }
+
+
+# stats of all the streams written by this process, keyed on the stream name
+ingest_stats: dict[str, BatchStats] = {}
+
+
+class TradesStreamWriter:
+    """Buffers the trades of one exchange stream and writes them to a Redis stream
+    as a single pipelined (optionally transactional) batch per flush.
+
+    Args:
+        redis_db:           Redis connection
+        stream_name:        name of the redis stream, e.g. `publicTrade:BTCUSDT`
+        last_id:            id of the last entry in the redis stream
+        max_batch_size:     maximum number of entries send in one pipeline
+        max_latency_ms:     maximum time trades are kept in the buffer before they get flushed.
+                            0 flushes every exchange frame directly
+        transaction:        wrap every batch in MULTI/EXEC
+        storage_format:     `fields`, `columnar` or `both`, see `TRADES_STORAGE_FORMAT`
+        timeseries_symbol:  also add the trades to the candle series of this symbol (see `app.db.timeseries`)
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        stream_name: str,
+        last_id: str = "0-0",
+        max_batch_size: int = INGEST_MAX_BATCH_SIZE,
+        max_latency_ms: int = INGEST_MAX_LATENCY_MS,
+        transaction: bool = INGEST_TRANSACTION,
+        storage_format: str = TRADES_STORAGE_FORMAT,
+        timeseries_symbol: str | None = None,
+    ):
+        assert storage_format in STORAGE_FORMATS, f"only storage formats {STORAGE_FORMATS} are allowed"
+        self.redis_db = redis_db
+        self.stream_name = stream_name
+        last_ts, last_seq = last_id.split("-")
+        self.last_ts, self.last_seq = int(last_ts), int(last_seq)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency_ms = max_latency_ms
+        self.transaction = transaction
+        self.buffer: list[tuple[str, dict]] = []
+        self.buffered_since: float | None = None
+        self.ids_at_last_ts: set[str] = set()  # trade ids of the last timestamp, to skip trades received twice
+        self.needs_backfill = True  # the trades since `last_id` that were missed, see `TradeBackfiller`
+        self.flush_lock = asyncio.Lock()
+        self.write_fields = storage_format in ("fields", "both")
+        self.chunks = ColumnarChunkBuffer() if storage_format in ("columnar", "both") else None
+        self.chunk_stream_name = chunk_stream_name(stream_name) if self.chunks is not None else None
+        self.timeseries_symbol = timeseries_symbol
+        self.stats = ingest_stats.setdefault(stream_name, BatchStats(stream_name))
+        symbol = stream_name.split(":", 1)[-1]
+        self._ingested = TRADES_INGESTED.labels(symbol)
+        self._rejected = TRADES_REJECTED.labels(symbol)
+        self._ingest_lag = INGEST_LAG.labels(symbol)
+        self._pipeline_latency = REDIS_LATENCY.labels("ingest_pipeline")
+
+    @property
+    def last_id(self) -> str:
+        """id of the last trade"""
+        return f"{self.last_ts}-{self.last_seq}"
+
+    def add(self, trades: list[PublicTrade]) -> None:
+        """assign a stream id to every trade and add them to the buffer"""
+        # the hot path of the ingestion: local variables and the last id kept as integers
+        buffer = self.buffer
+        last_ts, last_seq, ids = self.last_ts, self.last_seq, self.ids_at_last_ts
+        for data in trades:
+            ts = int(data["T"])
+            if ts > last_ts:
+                last_ts, last_seq = ts, 0
+                ids = {data["i"]}
+            elif ts == last_ts:
+                if data["i"] in ids:
+                    continue  # duplicate, e.g. while a topic is moved between connections
+                last_seq += 1
+                ids.add(data["i"])
+            else:
+                logger.warning(f"{self.stream_name}: skipping trade older than the last entry ({ts} < {last_ts})")
+                continue
+            data["BT"] = int(data["BT"])  # redis doesn't accept booleans
+            buffer.append((f"{ts}-{last_seq}", data))
+        self.last_ts, self.last_seq, self.ids_at_last_ts = last_ts, last_seq, ids
+        if buffer and self.buffered_since is None:
+            self.buffered_since = time.monotonic()
+
+    def add_frame(self, frame: dict) -> None:
+        """add the trades of a `publicTrade` frame"""
+        self.add(frame["data"])
+
+    def time_to_flush(self) -> float | None:
+        """seconds until the buffer has to be flushed, None when there is nothing to flush"""
+        if self.buffered_since is None:
+            return None
+        elapsed = time.monotonic() - self.buffered_since
+        return max(0.0, self.max_latency_ms / 1000 - elapsed)
+
+    def on_reconnect(self) -> None:
+        """the trades received before the reconnect are followed by a gap, backfill it on the next frame"""
+        self.needs_backfill = True
+
+    @property
+    def due(self) -> bool:
+        """True when the buffer is full or the oldest trade waited longer than `max_latency_ms`"""
+        if not self.buffer:
+            return False
+        return len(self.buffer) >= self.max_batch_size or self.time_to_flush() == 0
+
+    async def flush(self, force: bool = False) -> int:
+        """write the buffered trades to redis, in pipelines of at most `max_batch_size` entries.
+
+        The buffer (and the columnar chunks) only advance when the pipeline was executed. On a
+        connection error the batch stays buffered and is retried by the next flush, the error is raised.
+        Commands rejected by redis (e.g. an XADD with an id at or below the last entry, written by
+        the previous owner of the lease) are not retried, their trades are dropped and counted. A rejected
+        chunk drops all its trades, only the ones of the current batch are subtracted from the written entries.
+
+        Args:
+            force:  also write a partial columnar chunk
+
+        Returns:
+            the number of written entries"""
+        written = 0
+        async with self.flush_lock:  # the writer can be shared by several exchange connections
+            while self.buffer or (force and self.chunks is not None and self.chunks.buffer):
+                batch = self.buffer[: self.max_batch_size]
+                if self.chunks is not None:
+                    chunk_state = (list(self.chunks.buffer), self.chunks.buffered_since)
+                start = time.perf_counter()
+                # per stream command the trades dropped when redis rejects it, and how many of them are of this batch
+                dropped_per_command = []
+                async with self.redis_db.pipeline(transaction=self.transaction) as pipe:
+                    if self.write_fields:
+                        for new_id, data in batch:
+                            pipe.xadd(name=self.stream_name, fields=data, id=new_id)
+                            dropped_per_command.append((1, 1))
+                    if self.chunks is not None:
+                        carried = len(self.chunks.buffer)  # trades of earlier flushes, they start the first chunk
+                        self.chunks.add(batch)
+                        offset = 0
+                        for chunk_id, chunk in self.chunks.pop_chunks(force=force):
+                            pipe.xadd(name=self.chunk_stream_name, fields=chunk, id=chunk_id)
+                            from_batch = max(0, min(offset + chunk["n"], carried + len(batch)) - max(offset, carried))
+                            dropped_per_command.append((0, 0) if self.write_fields else (chunk["n"], from_batch))
+                            offset += chunk["n"]
+                    if self.timeseries_symbol is not None:
+                        add_trades_to_pipeline(pipe, self.timeseries_symbol, [data for _, data in batch])
+                    try:
+                        results = await pipe.execute(raise_on_error=False)
+                    except Exception:
+                        if self.chunks is not None:
+                            self.chunks.buffer, self.chunks.buffered_since = chunk_state
+                        raise
+                latency = time.perf_counter() - start
+                self._pipeline_latency.observe(latency)
+                errors = [result for result in results[: len(dropped_per_command)] if isinstance(result, ResponseError)]
+                rejected = rejected_from_batch = 0
+                if errors:
+                    for (dropped, from_batch), result in zip(dropped_per_command, results):
+                        if isinstance(result, ResponseError):
+                            rejected += dropped
+                            rejected_from_batch += from_batch
+                    self.stats.rejected += rejected
+                    self._rejected.inc(rejected)
+                    logger.error(f"{self.stream_name}: redis rejected {len(errors)} commands, dropped {rejected} trades: {errors[0]}")
+                # the candle series are derived data, the trades are written without them
+                for result in results[len(dropped_per_command):]:
+                    failed = [e for e in (result if isinstance(result, list) else [result]) if isinstance(e, ResponseError)]
+                    if failed:
+                        logger.error(f"{self.stream_name}: redis rejected the candle series update: {failed[0]}")
+                if batch:
+                    self.stats.record_flush(len(batch), latency * 1000)
+                    self._ingested.inc(len(batch) - rejected_from_batch)
+                    self._ingest_lag.observe(time.time() - int(batch[0][1]["T"]) / 1000)
+                del self.buffer[: len(batch)]
+                written += len(batch) - rejected_from_batch
+            self.buffered_since = None
+        return written
+
+
+async def create_trades_writer(redis_db: redis.Redis, stream_name: str, timeseries: bool = TIMESERIES_ENABLED, **kwargs) -> TradesStreamWriter:
+    """Create a `TradesStreamWriter` that continues after the last entry of the redis stream.
+    With `timeseries` the trades also feed the candle series of the symbol, when redis has the module."""
+    storage_format = kwargs.get("storage_format", TRADES_STORAGE_FORMAT)
+    # a chunk has the id of its last trade
+    last_id_stream = chunk_stream_name(stream_name) if storage_format == "columnar" else stream_name
+    try:
+        info = await redis_db.xinfo_stream(last_id_stream)
+        last_id = info["last-entry"][0].decode("utf-8")
+    except ResponseError as e:
+        logger.debug(f"key {last_id_stream} not found, start at zero ({e})")
+        last_id = "0-0"
+    ids_at_last_ts = await read_ids_at(redis_db, stream_name, last_id, storage_format) if last_id != "0-0" else set()
+    if timeseries:
+        symbol = stream_name.split(":", 1)[-1]
+        if await ensure_candle_series(redis_db, symbol):
+            kwargs["timeseries_symbol"] = symbol
+    writer = TradesStreamWriter(redis_db, stream_name, last_id=last_id, **kwargs)
+    writer.ids_at_last_ts = ids_at_last_ts
+    return writer
+
+
+async def read_ids_at(redis_db: redis.Redis, stream_name: str, last_id: str, storage_format: str) -> set[str]:
+    """the trade ids with the timestamp of the last entry, so a writer skips them when they are received again"""
+    last_ts = last_id.split("-")[0]
+    if storage_format == "columnar":
+        chunks = await redis_db.xrevrange(chunk_stream_name(stream_name), count=1)
+        records = decode_chunk(chunks[0][1])
+        ids = decode_trade_ids(records, chunks[0][1])
+        return {trade_id for trade_id, ts in zip(ids, records["T"]) if ts == int(last_ts)}
+    entries = await redis_db.xrevrange(stream_name, max=last_id, min=f"{last_ts}-0")
+    return {fields[b"i"].decode() for _, fields in entries}
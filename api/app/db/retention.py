@@ -0,0 +1,126 @@
+import asyncio
+from dataclasses import dataclass
+import os
+import time
+import redis.asyncio as redis
+from app.db.archive import ARCHIVE_BATCH_SIZE, ARCHIVE_DIR, archive_range, watermark_key
+from app.db.producer.trades import TRADES_STORAGE_FORMAT
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+RETENTION_WINDOW_MS = int(os.getenv("RETENTION_WINDOW_MS", 24 * 3600 * 1000))  # trades kept in redis
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 300))  # seconds between the runs
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "true").lower() in ("1", "true", "yes")
+RETENTION_STREAM_PATTERNS = ("publicTrade:*", "publicTradeChunk:*")
+
+
+@dataclass
+class RetentionStats:
+    runs: int = 0
+    archived: int = 0
+    trimmed: int = 0
+    errors: int = 0
+    last_run_ms: float = 0.0
+
+
+class RetentionWorker:
+    """Keeps `window_ms` of trades in the redis streams: the older entries are exported to parquet
+    (see `app.db.archive`) and then trimmed with XTRIM MINID. A stream is only trimmed up to what
+    has been archived, and a lock per stream keeps several api processes from archiving it twice.
+
+    Args:
+        redis_db:       Redis connection
+        window_ms:      the trades of the last `window_ms` stay in redis
+        interval:       seconds between the runs of `run`
+        archive:        export before trimming, otherwise the old entries are just dropped
+        archive_dir:    root directory of the parquet files
+        batch_size:     entries per export batch
+        storage_format: with `both` only the fields stream is archived, the chunk stream is just trimmed
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        window_ms: int = RETENTION_WINDOW_MS,
+        interval: float = RETENTION_INTERVAL,
+        archive: bool = RETENTION_ARCHIVE,
+        archive_dir: str = ARCHIVE_DIR,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        storage_format: str = TRADES_STORAGE_FORMAT,
+    ):
+        self.redis_db = redis_db
+        self.window_ms = window_ms
+        self.interval = interval
+        self.archive = archive
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.storage_format = storage_format
+        self.stats = RetentionStats()
+        self.task: asyncio.Task | None = None
+
+    async def streams(self) -> list[str]:
+        names = set()
+        for pattern in RETENTION_STREAM_PATTERNS:
+            async for name in self.redis_db.scan_iter(match=pattern, _type="stream"):
+                names.add(name.decode())
+        return sorted(names)
+
+    async def apply(self, stream_name: str, now_ms: int | None = None) -> int:
+        """archive and trim one stream, returns the number of trimmed entries"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        cutoff_ms = now_ms - self.window_ms
+        lock = self.redis_db.lock(f"retention-lock:{stream_name}", timeout=max(60, 2 * self.interval), blocking=False)
+        if not await lock.acquire():
+            logger.debug(f"{stream_name} is handled by another process")
+            return 0
+        columnar = stream_name.startswith("publicTradeChunk:")
+        try:
+            if self.archive and columnar == (self.storage_format == "columnar"):
+                self.stats.archived += await archive_range(
+                    self.redis_db, stream_name, cutoff_ms, self.archive_dir, self.batch_size, columnar=columnar
+                )
+                # never trim what isn't archived, e.g. when an export batch failed
+                watermark = await self.redis_db.get(watermark_key(stream_name))
+                if watermark is None:
+                    return 0
+                watermark_ms, watermark_seq = map(int, watermark.split(b"-"))
+                min_id = min((cutoff_ms, 0), (watermark_ms, watermark_seq + 1))
+            else:
+                min_id = (cutoff_ms, 0)
+            trimmed = await self.redis_db.xtrim(stream_name, minid="-".join(map(str, min_id)), approximate=False)
+        finally:
+            await lock.release()
+        self.stats.trimmed += trimmed
+        if trimmed:
+            logger.info(f"{stream_name}: trimmed {trimmed} entries before {min_id}")
+        return trimmed
+
+    async def run_once(self, now_ms: int | None = None) -> None:
+        start = time.perf_counter()
+        for stream_name in await self.streams():
+            try:
+                await self.apply(stream_name, now_ms)
+            except Exception as e:
+                self.stats.errors += 1
+                logger.error(f"retention of {stream_name} failed: {e}")
+        self.stats.runs += 1
+        self.stats.last_run_ms = (time.perf_counter() - start) * 1000
+
+    async def run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def close(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
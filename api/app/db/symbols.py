@@ -0,0 +1,159 @@
+"""Registry of the symbols of the exchange and of the symbols that are ingested, persisted in redis
+and shared by all api processes.
+
+    symbols:instruments:<category>      hash, symbol => instrument (JSON) as listed by the exchange
+    symbols:refreshed:<category>        set for `refresh_interval` after a refresh, so only one process refreshes
+    symbols:enabled                     set of the symbols that are ingested
+    symbols:seeded                      the enabled symbols were seeded with `SYMBOLS_DEFAULT`
+"""
+import asyncio
+import os
+import time
+import redis.asyncio as redis
+from pybit.unified_trading import HTTP
+from app.logger import streaming_logger
+from app.serialize import dumps, loads
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+SYMBOLS_CATEGORY = os.getenv("SYMBOLS_CATEGORY", "linear")
+SYMBOLS_REFRESH_INTERVAL = float(os.getenv("SYMBOLS_REFRESH_INTERVAL", 3600))  # seconds between the refreshes
+SYMBOLS_CACHE_TTL = float(os.getenv("SYMBOLS_CACHE_TTL", 60))  # seconds the instruments are cached in process
+# ingested on the first start, afterwards the enabled symbols are managed through the api
+SYMBOLS_DEFAULT = [symbol for symbol in os.getenv("SYMBOLS_DEFAULT", "BTCUSDT,ETHUSDT,SOLUSDT,OPUSDT,ARBUSDT").split(",") if symbol]
+INSTRUMENTS_LIMIT = 1000  # max page size of the instruments endpoint
+ENABLED_KEY = "symbols:enabled"
+SEEDED_KEY = "symbols:seeded"
+
+
+def instruments_key(category: str) -> str:
+    return f"symbols:instruments:{category}"
+
+
+def refreshed_key(category: str) -> str:
+    return f"symbols:refreshed:{category}"
+
+
+class BybitInstruments:
+    """The instruments of a category from the REST api of bybit
+    (https://bybit-exchange.github.io/docs/v5/market/instrument).
+
+    Args:
+        session:    pybit HTTP session, by default a public (unauthenticated) one
+        category:   product type, e.g. `linear`
+    """
+
+    def __init__(self, session: HTTP | None = None, category: str = SYMBOLS_CATEGORY):
+        self.session = session or HTTP(testnet=False)
+        self.category = category
+
+    async def fetch_instruments(self) -> list[dict]:
+        """all instruments of the category, following the page cursors"""
+        instruments = []
+        cursor = ""
+        while True:
+            # pybit is blocking, keep it off the event loop
+            response = await asyncio.to_thread(
+                self.session.get_instruments_info, category=self.category, limit=INSTRUMENTS_LIMIT, cursor=cursor
+            )
+            instruments.extend(response["result"]["list"])
+            cursor = response["result"].get("nextPageCursor") or ""
+            if not cursor:
+                return instruments
+
+
+class SymbolRegistry:
+    """The instruments of the exchange, refreshed every `refresh_interval` by one of the api processes,
+    and the set of enabled symbols.
+
+    Args:
+        redis_db:           Redis connection
+        client:             source of the instruments, with an async `fetch_instruments()`
+        category:           product type, e.g. `linear`
+        refresh_interval:   seconds between the refreshes
+        cache_ttl:          seconds the instruments read from redis are kept in process
+    """
+
+    def __init__(
+        self,
+        redis_db: redis.Redis,
+        client: BybitInstruments | None = None,
+        category: str = SYMBOLS_CATEGORY,
+        refresh_interval: float = SYMBOLS_REFRESH_INTERVAL,
+        cache_ttl: float = SYMBOLS_CACHE_TTL,
+    ):
+        self.redis_db = redis_db
+        self.client = client or BybitInstruments(category=category)
+        self.category = category
+        self.refresh_interval = refresh_interval
+        self.cache_ttl = cache_ttl
+        self._cache: dict[str, dict] | None = None
+        self._cached_at = 0.0
+        self.task: asyncio.Task | None = None
+
+    async def refresh(self, force: bool = False) -> int:
+        """store the instruments of the exchange, unless another process did within `refresh_interval`.
+        Returns the number of stored instruments"""
+        if not await self.redis_db.set(refreshed_key(self.category), int(time.time() * 1000), nx=not force,
+                                       px=max(1, int(self.refresh_interval * 1000))):
+            return 0
+        try:
+            instruments = await self.client.fetch_instruments()
+        except Exception:
+            await self.redis_db.delete(refreshed_key(self.category))  # let the next attempt refresh
+            raise
+        key = instruments_key(self.category)
+        async with self.redis_db.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if instruments:
+                pipe.hset(key, mapping={instrument["symbol"]: dumps(instrument) for instrument in instruments})
+            await pipe.execute()
+        self._cache = None
+        logger.info(f"refreshed {len(instruments)} {self.category} instruments")
+        return len(instruments)
+
+    async def instruments(self) -> dict[str, dict]:
+        """the instruments keyed on symbol, cached for `cache_ttl`"""
+        if self._cache is None or time.monotonic() - self._cached_at > self.cache_ttl:
+            raw = await self.redis_db.hgetall(instruments_key(self.category))
+            self._cache = {symbol.decode(): loads(instrument) for symbol, instrument in raw.items()}
+            self._cached_at = time.monotonic()
+        return self._cache
+
+    async def get(self, symbol: str) -> dict | None:
+        return (await self.instruments()).get(symbol)
+
+    async def seed(self, symbols: list[str] = SYMBOLS_DEFAULT) -> None:
+        """enable the default symbols the first time the app starts on this redis"""
+        if await self.redis_db.set(SEEDED_KEY, 1, nx=True) and symbols:
+            await self.redis_db.sadd(ENABLED_KEY, *symbols)
+
+    async def enabled(self) -> list[str]:
+        return sorted(symbol.decode() for symbol in await self.redis_db.smembers(ENABLED_KEY))
+
+    async def enable(self, symbol: str) -> None:
+        await self.redis_db.sadd(ENABLED_KEY, symbol)
+
+    async def disable(self, symbol: str) -> None:
+        await self.redis_db.srem(ENABLED_KEY, symbol)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"refreshing the {self.category} instruments failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> asyncio.Task:
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def close(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,128 @@
+"""OHLCV candles in the RedisTimeSeries module: per symbol a raw price and volume series that
+the ingestion feeds with TS.MADD, compacted by rules into candle series per interval."""
+import os
+import redis.asyncio as redis
+from redis import ResponseError
+from app.logger import streaming_logger
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+TIMESERIES_ENABLED = os.getenv("TIMESERIES_ENABLED", "true").lower() in ("1", "true", "yes")
+TIMESERIES_RAW_RETENTION_MS = int(os.getenv("TIMESERIES_RAW_RETENTION_MS", 24 * 3600 * 1000))
+TIMESERIES_CANDLE_RETENTION_MS = int(os.getenv("TIMESERIES_CANDLE_RETENTION_MS", 0))  # 0 keeps them forever
+
+CANDLE_INTERVALS = {"1s": 1_000, "1m": 60_000, "5m": 300_000, "1h": 3_600_000}
+# candle field => (raw series, aggregation)
+CANDLE_FIELDS = {
+    "open": ("price", "first"),
+    "high": ("price", "max"),
+    "low": ("price", "min"),
+    "close": ("price", "last"),
+    "volume": ("volume", "sum"),
+}
+
+
+def raw_key(symbol: str, series: str) -> str:
+    return f"ts:trades:{symbol}:{series}"
+
+
+def candle_key(symbol: str, interval: str, field: str) -> str:
+    return f"ts:candles:{symbol}:{interval}:{field}"
+
+
+async def ensure_candle_series(redis_db: redis.Redis, symbol: str) -> bool:
+    """create the raw and candle series with their compaction rules when they don't exist yet
+
+    Returns:
+        False when the timeseries module isn't loaded in redis"""
+    try:
+        await redis_db.execute_command("TS.INFO", raw_key(symbol, "price"))
+        return True
+    except ResponseError as e:
+        if "unknown command" in str(e).lower():
+            logger.warning(f"RedisTimeSeries is not available, no candles for {symbol}: {e}")
+            return False
+    labels = ["LABELS", "symbol", symbol]
+    try:
+        await _create_candle_series(redis_db, symbol, labels)
+    except ResponseError as e:
+        if "already exists" not in str(e):
+            raise
+        logger.debug(f"the candle series of {symbol} were created by another writer ({e})")
+        return True
+    logger.info(f"created the candle series of {symbol}")
+    return True
+
+
+async def _create_candle_series(redis_db: redis.Redis, symbol: str, labels: list) -> None:
+    async with redis_db.pipeline(transaction=True) as pipe:
+        # several trades can share a millisecond: keep the last price and add up the volume
+        pipe.execute_command("TS.CREATE", raw_key(symbol, "price"), "RETENTION", TIMESERIES_RAW_RETENTION_MS,
+                             "DUPLICATE_POLICY", "LAST", *labels, "series", "price")
+        pipe.execute_command("TS.CREATE", raw_key(symbol, "volume"), "RETENTION", TIMESERIES_RAW_RETENTION_MS,
+                             "DUPLICATE_POLICY", "SUM", *labels, "series", "volume")
+        for interval, bucket_ms in CANDLE_INTERVALS.items():
+            retention = TIMESERIES_RAW_RETENTION_MS if interval == "1s" else TIMESERIES_CANDLE_RETENTION_MS
+            for field, (series, aggregation) in CANDLE_FIELDS.items():
+                key = candle_key(symbol, interval, field)
+                pipe.execute_command("TS.CREATE", key, "RETENTION", retention, *labels, "interval", interval, "field", field)
+                pipe.execute_command("TS.CREATERULE", raw_key(symbol, series), key, "AGGREGATION", aggregation, bucket_ms)
+        await pipe.execute()
+
+
+def add_trades_to_pipeline(pipe, symbol: str, trades: list[dict]) -> None:
+    """queue a TS.MADD of the price and size of the trades. A series holds one sample per millisecond,
+    trades of the same millisecond are merged here (last price, summed size) and by the duplicate
+    policies of the series when the millisecond is split over batches."""
+    samples: dict[int, list[float]] = {}
+    for trade in trades:
+        sample = samples.get(int(trade["T"]))
+        if sample is None:
+            samples[int(trade["T"])] = [float(trade["p"]), float(trade["v"])]
+        else:
+            sample[0] = float(trade["p"])
+            sample[1] += float(trade["v"])
+    args = []
+    price_key, volume_key = raw_key(symbol, "price"), raw_key(symbol, "volume")
+    for timestamp, (price, volume) in samples.items():
+        args += [price_key, timestamp, price, volume_key, timestamp, volume]
+    if args:
+        pipe.execute_command("TS.MADD", *args)
+
+
+async def get_candles(redis_db: redis.Redis, symbol: str, interval: str, start: int = 0, end: int | str = "+") -> list[dict]:
+    """candles from the compacted series. The last bucket isn't compacted until it closes,
+    it is aggregated from the raw series on the fly.
+
+    Args:
+        redis_db:   Redis connection
+        symbol:     e.g. `BTCUSDT`
+        interval:   one of `CANDLE_INTERVALS`
+        start, end: timestamps (ms) of the first and last candle
+    Returns:
+        candles as dicts with the bucket start `t` and `open`, `high`, `low`, `close`, `volume`
+    """
+    bucket_ms = CANDLE_INTERVALS[interval]
+    async with redis_db.pipeline(transaction=False) as pipe:
+        for field in CANDLE_FIELDS:
+            pipe.execute_command("TS.RANGE", candle_key(symbol, interval, field), start, end)
+        compacted = await pipe.execute()
+
+    candles: dict[int, dict] = {}
+    for field, rows in zip(CANDLE_FIELDS, compacted):
+        for timestamp, value in rows:
+            candles.setdefault(int(timestamp), {"t": int(timestamp)})[field] = float(value)
+
+    # the open bucket(s) after the last compacted one
+    open_from = max(candles) + bucket_ms if candles else start
+    if end == "+" or int(end) >= open_from:
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for field, (series, aggregation) in CANDLE_FIELDS.items():
+                pipe.execute_command("TS.RANGE", raw_key(symbol, series), open_from, end, "AGGREGATION", aggregation, bucket_ms)
+            live = await pipe.execute()
+        for field, rows in zip(CANDLE_FIELDS, live):
+            for timestamp, value in rows:
+                candles.setdefault(int(timestamp), {"t": int(timestamp)})[field] = float(value)
+
+    return [candles[timestamp] for timestamp in sorted(candles)]
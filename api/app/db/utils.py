@@ -3,6 +3,7 @@ import redis.asyncio as redis
 from redis import ResponseError
 import os
 import logging
+import time
 from app.errors import KeyTypeError
 from app.logger import streaming_logger
 
@@ -10,11 +11,106 @@ from app.logger import streaming_logger
 logger = streaming_logger("REDIS", logging.INFO)
 
 
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 20))  # seconds to wait for a free connection
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    """Blocking connection pool that counts how connections are borrowed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = 0
+        self.created = 0
+        self.borrowed: set = set()  # the connections handed out and not released yet
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def make_connection(self):
+        self.created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        connection = await super().get_connection(*args, **kwargs)
+        wait_time = time.perf_counter() - start
+        self.acquired += 1
+        self.borrowed.add(connection)
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        return connection
+
+    async def release(self, connection) -> None:
+        # also called by `get_connection` for a connection that failed to connect, before it was borrowed
+        self.borrowed.discard(connection)
+        await super().release(connection)
+
+
+_redis_pool: MeteredConnectionPool | None = None
+
+
+def create_redis_pool(
+    max_connections: int = REDIS_MAX_CONNECTIONS,
+    timeout: float = REDIS_POOL_TIMEOUT,
+    health_check_interval: int = REDIS_HEALTH_CHECK_INTERVAL,
+) -> MeteredConnectionPool:
+    return MeteredConnectionPool(
+        host=os.environ.get("REDIS_HOST"),
+        port=os.environ.get("REDIS_PORT"),
+        max_connections=max_connections,
+        timeout=timeout,
+        health_check_interval=health_check_interval,
+    )
+
+
+def get_redis_pool() -> MeteredConnectionPool:
+    """The app wide Redis connection pool, created on first use when `init_redis_pool` wasn't called"""
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = create_redis_pool()
+    return _redis_pool
+
+
+async def init_redis_pool(**kwargs) -> MeteredConnectionPool:
+    """(re)create the app wide Redis connection pool, to be called at the start of the app lifespan"""
+    global _redis_pool
+    await close_redis_pool()
+    _redis_pool = create_redis_pool(**kwargs)
+    return _redis_pool
+
+
+async def close_redis_pool() -> None:
+    global _redis_pool
+    if _redis_pool is not None:
+        await _redis_pool.aclose()
+        _redis_pool = None
+
+
+def get_redis_pool_stats() -> dict:
+    """usage of the app wide Redis connection pool"""
+    pool = get_redis_pool()
+    in_use = len(pool.borrowed)
+    return {
+        "max_connections": pool.max_connections,
+        "in_use": in_use,
+        "idle": pool.created - in_use,
+        "created": pool.created,
+        "acquired": pool.acquired,
+        "avg_wait_ms": pool.wait_time_total / pool.acquired * 1000 if pool.acquired else 0,
+        "max_wait_ms": pool.wait_time_max * 1000,
+    }
+
+
+def make_redis_client() -> redis.Redis:
+    """Create a Redis client that borrows its connections from the app wide pool.
+    Closing the client returns the connections, the pool stays open"""
+    return redis.Redis(connection_pool=get_redis_pool())
+
+
 async def get_redis_conn() -> redis.Redis:
     """Dependency for endpoints to create and manage the Redis connection"""
-    redis_conn = redis.Redis(
-        host=os.environ.get("REDIS_HOST"), port=os.environ.get("REDIS_PORT")
-    )
+    redis_conn = make_redis_client()
     try:
         yield redis_conn
     except ConnectionError as e:
@@ -27,9 +123,7 @@ async def get_redis_conn() -> redis.Redis:
 @asynccontextmanager
 async def redis_conn_manager():
     """Connection manager for inside background tasks"""
-    redis_conn = redis.Redis(
-        host=os.environ.get("REDIS_HOST"), port=os.environ.get("REDIS_PORT")
-    )
+    redis_conn = make_redis_client()
     try:
         yield redis_conn
     except ConnectionError as e:
@@ -39,6 +133,12 @@ async def redis_conn_manager():
         await redis_conn.aclose()
 
 
+def parse_stream_id(stream_id: str) -> tuple[int, int]:
+    """`1705072083137-10` => (1705072083137, 10), for comparing stream ids"""
+    ms, seq = stream_id.split("-")
+    return int(ms), int(seq)
+
+
 async def sort_stream(raw_data: list) -> list:
     """Sort the stream based on the timestamp and then on its suffix, (not lexicographically).
 
@@ -62,21 +162,22 @@ async def sort_stream(raw_data: list) -> list:
          (b'1705072083137-11', {...}),  (b'1705072083138-0', {...})]
         ```
     """
-    split_str = "-"
-    if isinstance(raw_data[0][0], bytes):
-        split_str = b"-"
-    try:
-        result_sorted = sorted(
-            raw_data,
-            key=lambda x: (
-                int(x[0].split(split_str)[0]),
-                int(x[0].split(split_str)[1]),
-            ),
-        )
-    except TypeError:
-        logger.warn("Type of the timestamp representation is not consistent")
+    if not raw_data:
+        return []
+    id_type = type(raw_data[0][0])
+    if any(type(entry[0]) is not id_type for entry in raw_data):
+        logger.warning("Type of the timestamp representation is not consistent")
         raise KeyTypeError("Type of the timestamp representation is not consistent")
-    return result_sorted
+
+    keys = [parse_stream_id(entry[0].decode() if id_type is bytes else entry[0]) for entry in raw_data]
+
+    # redis returns the entries of XRANGE ascending and of XREVRANGE descending
+    if all(previous <= key for previous, key in zip(keys, keys[1:])):
+        return list(raw_data)
+    if all(previous > key for previous, key in zip(keys, keys[1:])):
+        return raw_data[::-1]
+    order = sorted(range(len(raw_data)), key=keys.__getitem__)
+    return [raw_data[i] for i in order]
 
 async def check_stream_exsists(stream_name: str) -> bool: 
     """check if the redis steam exists"""
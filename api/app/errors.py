@@ -15,4 +15,10 @@ class SubscriptionValueError(SubscriptionError):
     pass
 
 class SubscriptionTerminatedError(SubscriptionError):
-    """raised when the subscription to a websocket server is not completed or aborted"""
\ No newline at end of file
+    """raised when the subscription to a websocket server is not completed or aborted"""
+
+class SlowConsumerError(SubscriptionError):
+    """raised when a subscriber can't keep up with its stream and gets disconnected"""
+
+class SymbolError(Exception):
+    """raised when the ingestion of a symbol can't be started, e.g. an unknown symbol or too many symbols"""
@@ -1,65 +1,100 @@
-import asyncio
 from datetime import datetime
 import json
 import os
 from typing import Annotated
 
 import redis.asyncio as redis
-from fastapi import FastAPI, WebSocket, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, WebSocket, Request
 from fastapi.responses import HTMLResponse
 from fastapi import Depends
-import numpy as np
-from pybit.unified_trading import HTTP
 import websockets
 from contextlib import asynccontextmanager
-from app.backgroundtasks.exchange_trades import fetch_exchange_ws_stream
-from app.db.utils import get_redis_conn, sort_stream
+from app.backgroundtasks.backfill import TradeBackfiller
+from app.backgroundtasks.exchange_pool import ExchangeConnectionPool
+from app.backgroundtasks.leases import IngestionLeases
+from app.backgroundtasks.supervisor import IngestionSupervisor, topic_symbol
+from app.db.consumer.hub import trades_hub
+from app.db.retention import RetentionWorker
+from app.db.symbols import SymbolRegistry
+from app.db.utils import close_redis_pool, get_redis_conn, init_redis_pool, make_redis_client
+from app.errors import SymbolError
 from app.logger import streaming_logger
-from app.routers import ws
+from app.profiling import PROFILING_LOOP_LAG_INTERVAL, loop_lag_monitor
+from app.routers import analytics, candles, history, metrics, orderbook, profiling, stats, symbols, ws
+from app.routers.admin import check_admin_token
 
 
 logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
 
 
-# Dependency to create and manage the pybit session
-def get_bybit_session() -> HTTP:
-    session = HTTP(
-        testnet=False,
-        api_key="...",
-        api_secret="...",
-    )
-    try:
-        yield session
-    finally:
-        # session has no close method
-        pass
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    for symbol in get_symbols():
-        stream = f"publicTrade.{symbol['symbol']}"
-        asyncio.create_task(fetch_exchange_ws_stream(stream))
-
-    # asyncio.create_task(fetch_exchange_ws_stream("publicTrade.ETHUSDT"))
-    # asyncio.create_task(fetch_exchange_ws_stream("publicTrade.BTCSDT"))
-    # asyncio.create_task(fetch_exchange_ws_stream("publicTrade.SOLUSDT"))
+    # all redis clients of the app borrow their connections from one pool
+    await init_redis_pool()
+
+    # one small pool of exchange connections carries the trade topics of all symbols
+    exchange_pool = ExchangeConnectionPool(backfiller=TradeBackfiller())
+    await exchange_pool.start()
+    app.state.exchange_pool = exchange_pool
+
+    # the instruments of the exchange and the enabled symbols, shared by all workers through redis
+    registry = SymbolRegistry(make_redis_client())
+    await registry.seed()
+    registry.start()
+    app.state.registry = registry
+
+    # every worker wants the topics of all enabled symbols, a lease per topic makes sure only one of them ingests it
+    leases = IngestionLeases(make_redis_client(), on_acquired=exchange_pool.add_topics, on_lost=exchange_pool.remove_topics)
+    app.state.leases = leases
+    supervisor = IngestionSupervisor(registry, leases, exchange_pool)
+    await supervisor.sync()
+    leases.start()
+    supervisor.start()
+    app.state.supervisor = supervisor
+
+    # archive and trim what is older than the retention window
+    retention = RetentionWorker(make_redis_client())
+    retention.start()
+    app.state.retention = retention
+
+    # off by default, can be started per process through /api/admin/instrumentation
+    if PROFILING_LOOP_LAG_INTERVAL > 0:
+        loop_lag_monitor.start(PROFILING_LOOP_LAG_INTERVAL)
     yield
+    await loop_lag_monitor.stop()
+    await retention.close()
+    await retention.redis_db.aclose()
+    await supervisor.close()
+    await registry.close()
+    await registry.redis_db.aclose()
+    # stop writing before handing the leases over to the other workers
+    await leases.stop()
+    await exchange_pool.close()
+    await leases.close()
+    await leases.redis_db.aclose()
+    await trades_hub.close()
+    await close_redis_pool()
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(ws.router)
-
-
-@app.get("/start_trades")
-# def start_trades(background_tasks: BackgroundTasks, stream:str = "publicTrade.ETHUSDT",  redis_db: redis.Redis = Depends(get_redis_conn)):
-def start_trades(
-    background_tasks: BackgroundTasks, stream: str = "publicTrade.ETHUSDT"
-):
-    background_tasks.add_task(
-        fetch_exchange_ws_stream,
-        stream=stream,
-    )  # redis_db=redis_db )
+app.include_router(candles.router)
+app.include_router(analytics.router)
+app.include_router(history.router)
+app.include_router(metrics.router)
+app.include_router(orderbook.router)
+app.include_router(symbols.router)
+app.include_router(profiling.router)
+app.include_router(stats.router)
+
+
+@app.get("/start_trades", dependencies=[Depends(check_admin_token)])
+async def start_trades(request: Request, stream: str = "publicTrade.ETHUSDT"):
+    """start the ingestion of the symbol of the topic, see `/api/ingestion/{symbol}/start`"""
+    try:
+        await request.app.state.supervisor.start_symbol(topic_symbol(stream))
+    except SymbolError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     return {"message": "start with fetching trade info in the background"}
 
 
@@ -87,35 +122,8 @@ async def test_redis_last(
     result_raw = await redis_db.xrevrange(
         stream_name, max=end_timestamp, min=start_timestamp, count=limit
     )
-    # sort with regard to the timestamp AND the suffix
-    result_sorted = await sort_stream(result_raw)
-    np_array = np.array(result_sorted)
-    np_result = np_array[:, 1]  # Extract the second element onwards from each row
-    list_of_dicts = [dict(entry) for entry in np_result]
-    return list_of_dicts
-
-
-@app.get("/api/orderbook")
-async def orderbook(symbol: str = "BTCUSDT", pybit_session=Depends(get_bybit_session)):
-    orderbook = pybit_session.get_orderbook(category="linear", symbol=symbol)
-    return orderbook
-
-
-@app.get("/api/symbols/")
-def get_symbols():
-    # TODO inplement database
-    # types:
-    #    inverse – Inverse Contracts;
-    #    linear  – USDT Perpetual, USDC Contracts;
-    #    spot    – Spot Trading;
-    #    option  – USDC Options;
-    symbols = []
-    symbols.append({"symbol": "BTCUSDT", "type": "linear"})
-    symbols.append({"symbol": "ETHUSDT", "type": "linear"})
-    symbols.append({"symbol": "SOLUSDT", "type": "linear"})
-    symbols.append({"symbol": "OPUSDT", "type": "linear"})
-    symbols.append({"symbol": "ARBUSDT", "type": "linear"})
-    return symbols
+    # the stream is ordered on its ids, reversing gives the ascending order
+    return [dict(fields) for _, fields in reversed(result_raw)]
 
 
 @app.get("/api/connection_info}")
@@ -0,0 +1,148 @@
+"""In process order book, maintained from the `orderbook.<depth>.<symbol>` snapshot and delta
+frames of bybit (https://bybit-exchange.github.io/docs/v5/websocket/public/orderbook).
+
+The price levels of a side are kept in sorted lists and updated with bisect, a delta touches a
+few levels of a book of at most a few hundred levels. Top of book and depth queries are list
+slices, they don't need the exchange or redis."""
+from bisect import bisect_left
+from itertools import islice
+import time
+
+
+class BookSide:
+    """The price levels of one side of the book, best price first
+
+    Args:
+        descending:     True for the bids, the highest price is the best
+    """
+    __slots__ = ("descending", "keys", "sizes")
+
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self.keys: list[float] = []  # the prices, negated for the bids so the lists are ascending
+        self.sizes: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def clear(self) -> None:
+        self.keys = []
+        self.sizes = []
+
+    def set(self, price: float, size: float) -> None:
+        """set the size of a price level, a size of 0 removes the level"""
+        key = -price if self.descending else price
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            if size:
+                self.sizes[index] = size
+            else:
+                del self.keys[index]
+                del self.sizes[index]
+        elif size:
+            self.keys.insert(index, key)
+            self.sizes.insert(index, size)
+
+    def update(self, levels: list[list[str]]) -> None:
+        """apply the `[price, size]` pairs of a bybit frame"""
+        for price, size in levels:
+            self.set(float(price), float(size))
+
+    def levels(self, limit: int | None = None) -> list[list[float]]:
+        """`[price, size]` of the best `limit` levels"""
+        sign = -1 if self.descending else 1
+        return [[sign * key, size] for key, size in islice(zip(self.keys, self.sizes), limit)]
+
+
+class OrderBook:
+    """Order book of one symbol
+
+    Args:
+        symbol:     e.g. `BTCUSDT`
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.update_id = 0  # `u` of the last applied frame
+        self.seq = 0
+        self.ts = 0  # exchange timestamp (ms) of the last applied frame
+        self.ready = False  # a snapshot was applied
+
+    def apply(self, frame: dict) -> bool:
+        """apply a snapshot or delta frame, returns False when a delta was ignored because no snapshot came before"""
+        data = frame["data"]
+        # an update id of 1 is a new snapshot after a restart of the exchange service
+        if frame.get("type") == "snapshot" or data.get("u") == 1:
+            self.bids.clear()
+            self.asks.clear()
+            self.ready = True
+        elif not self.ready:
+            return False
+        self.bids.update(data.get("b", ()))
+        self.asks.update(data.get("a", ()))
+        self.update_id = data.get("u", self.update_id)
+        self.seq = data.get("seq", self.seq)
+        self.ts = frame.get("ts", self.ts)
+        return True
+
+    def reset(self) -> None:
+        """wait for a new snapshot, e.g. after a reconnect"""
+        self.bids.clear()
+        self.asks.clear()
+        self.ready = False
+
+    def top(self) -> dict:
+        """best bid and ask, `[price, size]`, with the spread and mid price"""
+        return top_of_depth(self.depth(1))
+
+    def depth(self, limit: int | None = None) -> dict:
+        """the best `limit` levels per side, all levels by default"""
+        return {
+            "symbol": self.symbol,
+            "ts": self.ts,
+            "u": self.update_id,
+            "seq": self.seq,
+            "b": self.bids.levels(limit),
+            "a": self.asks.levels(limit),
+        }
+
+
+def trim_depth(depth: dict, limit: int) -> dict:
+    """a `depth` dict (e.g. read back from a snapshot) with at most `limit` levels per side"""
+    return {**depth, "b": depth["b"][:limit], "a": depth["a"][:limit]}
+
+
+def pybit_orderbook(depth: dict) -> dict:
+    """a `depth` dict in the shape of the `get_orderbook` response of the exchange (pybit), prices and sizes as strings"""
+    return {
+        "retCode": 0,
+        "retMsg": "OK",
+        "result": {
+            "s": depth["symbol"],
+            "b": [[str(price), str(size)] for price, size in depth["b"]],
+            "a": [[str(price), str(size)] for price, size in depth["a"]],
+            "ts": depth["ts"],
+            "u": depth["u"],
+            "seq": depth["seq"],
+        },
+        "retExtInfo": {},
+        "time": int(time.time() * 1000),
+    }
+
+
+def top_of_depth(depth: dict) -> dict:
+    """the `top` of a `depth` dict"""
+    bid = depth["b"][0] if depth["b"] else None
+    ask = depth["a"][0] if depth["a"] else None
+    both = bid is not None and ask is not None
+    return {
+        "symbol": depth["symbol"],
+        "ts": depth["ts"],
+        "u": depth["u"],
+        "bid": bid,
+        "ask": ask,
+        "spread": ask[0] - bid[0] if both else None,
+        "mid": (ask[0] + bid[0]) / 2 if both else None,
+    }
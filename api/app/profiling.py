@@ -0,0 +1,219 @@
+"""Opt-in instrumentation of the hot paths: stage timers, event loop lag and on demand profiling.
+
+Stage timers observe the duration of the stages of the ingestion (`exchange.*`), the live fan-out
+(`hub.*`, `consumer.*`) and the websocket sends (`ws.*`) in the `hot_path_stage_seconds`
+histogram. The hot paths check `stage_timers.enabled` before reading the clock, so disabled timers
+cost an attribute lookup per stage.
+
+The loop lag monitor wakes up every `interval` and observes how late it is, the time the event loop
+was blocked by something else. The profiler runs cProfile, or a sampler of the stack of the event
+loop thread, for a few seconds. All of it applies to the process that handles the request."""
+import asyncio
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from app.logger import streaming_logger
+from app.metrics import gauge, histogram
+
+
+logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
+
+PROFILING_STAGE_TIMERS = os.getenv("PROFILING_STAGE_TIMERS", "false").lower() in ("1", "true", "yes")
+PROFILING_LOOP_LAG_INTERVAL = float(os.getenv("PROFILING_LOOP_LAG_INTERVAL", 0))  # seconds, 0 disables the monitor
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", 60))
+PROFILING_SAMPLE_INTERVAL = float(os.getenv("PROFILING_SAMPLE_INTERVAL", 0.005))
+PROFILE_MODES = ("cprofile", "sampling")
+
+STAGE_SECONDS = histogram(
+    "hot_path_stage_seconds", "Duration of the stages of the ingestion and fan-out hot paths, when the stage timers are enabled",
+    ("stage",), buckets=(0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+)
+LOOP_LAG = histogram(
+    "event_loop_lag_seconds", "Delay of the wake up of the loop lag monitor, time the event loop was blocked",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+LOOP_LAG_LAST = gauge("event_loop_lag_last_seconds", "Last observed event loop lag")
+
+
+class StageTimers:
+    """Switch of the stage timers, the hot paths keep the result of `timer` and do
+
+        if stage_timers.enabled:
+            start = time.perf_counter()
+        ...
+        if stage_timers.enabled:
+            timer.observe(time.perf_counter() - start)
+    """
+
+    def __init__(self, enabled: bool = PROFILING_STAGE_TIMERS):
+        self.enabled = enabled
+
+    def timer(self, stage: str):
+        """the histogram child of a stage"""
+        return STAGE_SECONDS.labels(stage)
+
+    def stats(self) -> list[dict]:
+        return [
+            {"stage": stage, "count": child.count, "total_seconds": child.sum, "avg_us": child.sum / child.count * 1e6 if child.count else 0.0}
+            for (stage,), child in sorted(STAGE_SECONDS.children.items())
+        ]
+
+    def reset(self) -> None:
+        # the children are kept by the hot paths, reset them in place
+        for child in STAGE_SECONDS.children.values():
+            child.counts = [0] * len(child.counts)
+            child.sum = 0.0
+            child.count = 0
+
+
+stage_timers = StageTimers()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task that sleeps `interval` seconds
+
+    Args:
+        interval:   seconds between the measurements
+    """
+
+    def __init__(self, interval: float = PROFILING_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.task: asyncio.Task | None = None
+        self.last = 0.0
+        self.max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - expected)
+            self.max = max(self.max, self.last)
+            LOOP_LAG.observe(self.last)
+            LOOP_LAG_LAST.set(self.last)
+            if self.last > max(0.1, self.interval):
+                logger.warning(f"the event loop was blocked for {self.last:.3f} seconds")
+
+    def start(self, interval: float | None = None) -> asyncio.Task:
+        if interval:
+            self.interval = interval
+        if not self.running:
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def stop(self) -> None:
+        if self.running:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    def stats(self) -> dict:
+        return {"running": self.running, "interval": self.interval, "last_seconds": self.last, "max_seconds": self.max}
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+class StackSampler:
+    """Samples the stack of a thread (the event loop) from a background thread, the report has a
+    line per distinct stack, `file:function;file:function;... count`, the collapsed format of flame graphs
+
+    Args:
+        thread_id:  the sampled thread
+        interval:   seconds between the samples
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILING_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+        self.samples += 1
+
+    def run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        # the sampler waits for the GIL, by default up to 5ms, and would mostly catch the loop when it
+        # releases it in `select`. A shorter switch interval lets it interrupt python code as well
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+        self._thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            sys.setswitchinterval(self._switch_interval)
+
+    def report(self, limit: int) -> str:
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common(limit)]
+        return f"# {self.samples} samples every {self.interval * 1000:g}ms\n" + "\n".join(lines) + "\n"
+
+
+_profiling = False  # a profile is running
+
+
+async def profile(seconds: float, mode: str = "cprofile", sort: str = "cumulative", limit: int = 50) -> str:
+    """profile the event loop thread for `seconds` and return the report, one profile at a time
+
+    Args:
+        seconds:    duration, at most `PROFILING_MAX_SECONDS`
+        mode:       `cprofile`: deterministic, every function call is counted (slows the process down)
+                    `sampling`: the stack is sampled every `PROFILING_SAMPLE_INTERVAL`, a low overhead
+        sort:       pstats sort key of the cProfile report
+        limit:      number of functions or stacks in the report
+    """
+    global _profiling
+    assert mode in PROFILE_MODES, f"only modes {PROFILE_MODES} are allowed"
+    if _profiling:
+        raise RuntimeError("a profile is already running")
+    seconds = min(seconds, PROFILING_MAX_SECONDS)
+    _profiling = True
+    try:
+        if mode == "sampling":
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+            return sampler.report(limit)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        output = io.StringIO()
+        output.write(f"# cProfile of the event loop of process {os.getpid()} for {time.perf_counter() - start:.1f} seconds\n")
+        pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+    finally:
+        _profiling = False
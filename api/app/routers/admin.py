@@ -0,0 +1,12 @@
+import os
+import secrets
+from fastapi import Header, HTTPException
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # unset disables the admin endpoints
+
+
+def check_admin_token(x_admin_token: str | None = Header(default=None)) -> None:
+    """dependency of the endpoints that control the ingestion or the process, requires the `X-Admin-Token` header"""
+    if not ADMIN_TOKEN or x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="admin token required")
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+import redis.asyncio as redis
+from app.db.analytics import analyze_trades
+from app.db.utils import get_redis_conn
+
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/analytics")
+async def trade_analytics(
+    stream_name: str = "publicTrade:BTCUSDT",
+    start_timestamp: int | str = "-",
+    end_timestamp: int | str = "+",
+    large_trade_size: float | None = None,
+    redis_db: redis.Redis = Depends(get_redis_conn),
+):
+    """VWAP, buy/sell imbalance, trade count, realized volatility and the large trades of a time range (ms)"""
+    return await analyze_trades(redis_db, stream_name, start_timestamp, end_timestamp, large_trade_size=large_trade_size)
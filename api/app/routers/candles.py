@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException
+import redis.asyncio as redis
+from redis import ResponseError
+from app.db.timeseries import CANDLE_INTERVALS, get_candles
+from app.db.utils import get_redis_conn
+
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/candles")
+async def candles(
+    symbol: str = "BTCUSDT",
+    interval: str = "1m",
+    start_timestamp: int = 0,
+    end_timestamp: int | str = "+",
+    redis_db: redis.Redis = Depends(get_redis_conn),
+):
+    """OHLCV candles of a symbol between two timestamps (ms), served from the compacted timeseries"""
+    if interval not in CANDLE_INTERVALS:
+        raise HTTPException(status_code=422, detail=f"interval should be one of {list(CANDLE_INTERVALS)}")
+    try:
+        return await get_candles(redis_db, symbol, interval, start_timestamp, end_timestamp)
+    except ResponseError as e:
+        # the symbol has no candle series, or redis runs without the TimeSeries module
+        raise HTTPException(status_code=404, detail=f"no candles for {symbol}: {e}")
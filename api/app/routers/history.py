@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+import redis.asyncio as redis
+from app.db.archive import read_trades
+from app.db.export import EXPORT_CHUNK_SIZE, EXPORT_MEDIA_TYPES, EXPORTERS, iter_entry_chunks
+from app.db.utils import get_redis_conn
+
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/trades")
+async def trades_history(
+    stream_name: str = "publicTrade:BTCUSDT",
+    start_timestamp: int = 0,
+    end_timestamp: int | None = None,
+    limit: int = Query(default=10000, ge=1),
+    redis_db: redis.Redis = Depends(get_redis_conn),
+):
+    """the first `limit` trades of a time range (ms), from the parquet archive and the redis stream"""
+    frame = await read_trades(redis_db, stream_name, start_timestamp, end_timestamp, limit=limit)
+    return frame.to_dict(orient="records")
+
+
+@router.get("/trades/export")
+async def trades_export(
+    stream_name: str = "publicTrade:BTCUSDT",
+    start_timestamp: int = 0,
+    end_timestamp: int | str = "+",
+    cursor: str | None = Query(default=None, pattern=r"^\d{1,20}-\d{1,20}$"),
+    limit: int | None = Query(default=None, ge=1),
+    format: str = "ndjson",
+    chunk_size: int = Query(default=EXPORT_CHUNK_SIZE, ge=1, le=100000),
+):
+    """stream the trades of a time range (ms) in the redis stream as `ndjson`, `csv` or `arrow` (IPC stream).
+    Every row has the stream `id` of the trade, when a response has `limit` rows the next page starts
+    with the id of the last row as `cursor`"""
+    if format not in EXPORTERS:
+        raise HTTPException(status_code=422, detail=f"format should be one of {list(EXPORTERS)}")
+    chunks = iter_entry_chunks(stream_name, start_timestamp, end_timestamp, cursor, limit, chunk_size)
+    return StreamingResponse(EXPORTERS[format](chunks), media_type=EXPORT_MEDIA_TYPES[format])
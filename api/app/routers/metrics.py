@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from app.db.consumer.hub import trades_hub
+from app.db.producer.trades import ingest_stats
+from app.db.utils import get_redis_pool_stats
+from app.metrics import REGISTRY, counter, gauge
+
+
+router = APIRouter(prefix="")
+
+# copied from the stats of the components at scrape time
+EXCHANGE_RECEIVE_QUEUE = gauge("exchange_receive_queue_length", "Frames received by the websocket but not read yet", ("stream",))
+EXCHANGE_FRAME_QUEUE = gauge("exchange_frame_queue_depth", "Frames waiting for the writing stage", ("connection",))
+EXCHANGE_FRAMES_DROPPED = counter("exchange_frames_dropped_total", "Frames dropped on a full frame queue", ("connection",))
+EXCHANGE_RECONNECTS = counter("exchange_reconnects_total", "Reconnects of the exchange websocket", ("connection",))
+SUBSCRIBERS = gauge("trades_subscribers", "Live /trades subscribers", ("stream",))
+SUBSCRIBER_QUEUE_DEPTH = gauge("trades_subscriber_queue_depth", "Entries waiting for the slowest subscriber", ("stream",))
+SUBSCRIBER_DROPPED = gauge("trades_subscriber_dropped", "Entries dropped for the current slow subscribers", ("stream",))
+REDIS_POOL_IN_USE = gauge("redis_pool_connections_in_use", "Connections borrowed from the shared redis pool")
+REDIS_POOL_CREATED = counter("redis_pool_connections_created_total", "Connections opened by the shared redis pool")
+
+
+def collect(request: Request) -> None:
+    for metric in (EXCHANGE_RECEIVE_QUEUE, EXCHANGE_FRAME_QUEUE, EXCHANGE_FRAMES_DROPPED, EXCHANGE_RECONNECTS,
+                   SUBSCRIBERS, SUBSCRIBER_QUEUE_DEPTH, SUBSCRIBER_DROPPED):
+        metric.clear()
+    for stats in ingest_stats.values():
+        EXCHANGE_RECEIVE_QUEUE.labels(stats.stream).set(stats.receive_queue_length)
+    exchange_pool = getattr(request.app.state, "exchange_pool", None)
+    for stats in exchange_pool.stats() if exchange_pool is not None else []:
+        EXCHANGE_FRAME_QUEUE.labels(stats["connection"]).set(stats["queue_depth"])
+        EXCHANGE_FRAMES_DROPPED.labels(stats["connection"]).set(stats["frames_dropped"])
+        EXCHANGE_RECONNECTS.labels(stats["connection"]).set(stats["reconnects"])
+    for stats in trades_hub.stats():
+        SUBSCRIBERS.labels(stats["stream"]).set(stats["subscribers"])
+        SUBSCRIBER_QUEUE_DEPTH.labels(stats["stream"]).set(stats["max_queue_depth"])
+        SUBSCRIBER_DROPPED.labels(stats["stream"]).set(stats["dropped"])
+    pool_stats = get_redis_pool_stats()
+    REDIS_POOL_IN_USE.set(pool_stats.get("in_use", 0))
+    REDIS_POOL_CREATED.labels().set(pool_stats.get("created", 0))
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics(request: Request):
+    """ingestion, live consumer and redis metrics in the Prometheus text format"""
+    collect(request)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+import redis.asyncio as redis
+from app.db.producer.orderbook import order_books, read_snapshot
+from app.db.utils import get_redis_conn
+from app.orderbook import pybit_orderbook, top_of_depth, trim_depth
+
+
+router = APIRouter(prefix="/api")
+
+
+async def get_depth(redis_db: redis.Redis, symbol: str, limit: int) -> dict:
+    """from the book of this process when it ingests the symbol, otherwise from the snapshot in redis"""
+    book = order_books.get(symbol)
+    if book is not None and book.ready:
+        return book.depth(limit)
+    snapshot = await read_snapshot(redis_db, symbol)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"no order book for {symbol}")
+    return trim_depth(snapshot, limit)
+
+
+@router.get("/orderbook")
+async def orderbook(
+    symbol: str = "BTCUSDT",
+    limit: int = Query(default=25, ge=1, le=500),
+    redis_db: redis.Redis = Depends(get_redis_conn),
+):
+    """the best `limit` bid (`b`) and ask (`a`) levels, maintained from the websocket of the exchange.
+    In the shape of the `get_orderbook` response of the exchange this endpoint used to forward"""
+    return pybit_orderbook(await get_depth(redis_db, symbol, limit))
+
+
+@router.get("/orderbook/top")
+async def orderbook_top(symbol: str = "BTCUSDT", redis_db: redis.Redis = Depends(get_redis_conn)):
+    """best bid and ask with the spread and mid price"""
+    book = order_books.get(symbol)
+    if book is not None and book.ready:
+        return book.top()
+    return top_of_depth(await get_depth(redis_db, symbol, 1))
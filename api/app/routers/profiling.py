@@ -0,0 +1,49 @@
+import pstats
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.profiling import PROFILE_MODES, loop_lag_monitor, profile, stage_timers
+from app.routers.admin import check_admin_token
+
+
+router = APIRouter(prefix="/api/admin", dependencies=[Depends(check_admin_token)])
+
+
+@router.get("/instrumentation")
+async def get_instrumentation():
+    """the stage timings and the event loop lag of the process that handles the request"""
+    return {"stage_timers": stage_timers.enabled, "stages": stage_timers.stats(), "loop_lag": loop_lag_monitor.stats()}
+
+
+@router.post("/instrumentation")
+async def set_instrumentation(
+    enabled: bool | None = Query(default=None, alias="stage_timers"), loop_lag_interval: float | None = None, reset: bool = False
+):
+    """switch the stage timers, start the loop lag monitor every `loop_lag_interval` seconds (0 stops it),
+    `reset` clears the stage timings. For the process that handles the request only"""
+    if enabled is not None:
+        stage_timers.enabled = enabled
+    if reset:
+        stage_timers.reset()
+    if loop_lag_interval is not None:
+        if loop_lag_interval < 0:
+            raise HTTPException(status_code=422, detail="loop_lag_interval must be >= 0")
+        await loop_lag_monitor.stop()
+        if loop_lag_interval > 0:
+            loop_lag_monitor.start(loop_lag_interval)
+    return await get_instrumentation()
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def run_profile(seconds: float = 10, mode: str = "cprofile", sort: str = "cumulative", limit: int = 50):
+    """profile the event loop of the process that handles the request for `seconds`.
+    `cprofile` reports the functions sorted on `sort`, `sampling` the collapsed stacks (flame graph input)"""
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=422, detail=f"unknown mode {mode}, use one of {list(PROFILE_MODES)}")
+    if seconds <= 0 or limit <= 0:
+        raise HTTPException(status_code=422, detail="seconds and limit must be > 0")
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        raise HTTPException(status_code=422, detail=f"unknown sort {sort}, use one of {list(pstats.Stats.sort_arg_dict_default)}")
+    try:
+        return PlainTextResponse(await profile(seconds, mode, sort, limit))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
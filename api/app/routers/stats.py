@@ -0,0 +1,57 @@
+from dataclasses import asdict
+from fastapi import APIRouter, Request
+from app.db.consumer.hub import trades_hub
+from app.db.producer.trades import ingest_stats
+from app.db.utils import get_redis_pool_stats
+
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/leases")
+async def get_leases(request: Request):
+    """the topics ingested by this worker and the owners of the others"""
+    return await request.app.state.leases.status()
+
+
+@router.get("/trades_hub")
+def get_trades_hub_stats():
+    """subscriber counts and queue depths of the live trade readers, per stream"""
+    return trades_hub.stats()
+
+
+@router.get("/redis_pool")
+def get_redis_pool_info():
+    """usage of the shared redis connection pool"""
+    return get_redis_pool_stats()
+
+
+@router.get("/exchange_connections")
+def get_exchange_connections(request: Request):
+    """topics per exchange websocket connection"""
+    return request.app.state.exchange_pool.assignment()
+
+
+@router.get("/backfill")
+def get_backfill_stats(request: Request):
+    """gaps after reconnects and the trades fetched to fill them"""
+    backfiller = request.app.state.exchange_pool.backfiller
+    return asdict(backfiller.stats) if backfiller is not None else {}
+
+
+@router.get("/retention")
+def get_retention_stats(request: Request):
+    """archived and trimmed stream entries"""
+    return asdict(request.app.state.retention.stats)
+
+
+@router.get("/exchange_queues")
+def get_exchange_queues(request: Request):
+    """received, written and dropped frames and the queue depth per exchange websocket connection"""
+    return request.app.state.exchange_pool.stats()
+
+
+@router.get("/ingest_stats")
+def get_ingest_stats():
+    """batch size and flush latency counters of the trade ingestion, per redis stream"""
+    return [stats.as_dict() for stats in ingest_stats.values()]
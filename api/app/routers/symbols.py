@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from app.errors import SymbolError
+from app.routers.admin import check_admin_token
+
+
+router = APIRouter(prefix="/api")
+
+
+@router.get("/symbols/")
+async def get_symbols(request: Request):
+    """the symbols that are ingested"""
+    registry = request.app.state.registry
+    return [{"symbol": symbol, "type": registry.category} for symbol in await registry.enabled()]
+
+
+@router.get("/symbols/instruments")
+async def get_instruments(request: Request, status: str = "Trading"):
+    """the instruments of the exchange, refreshed periodically. `status=all` lists all of them"""
+    instruments = await request.app.state.registry.instruments()
+    return [instrument for instrument in instruments.values() if status == "all" or instrument.get("status") == status]
+
+
+@router.post("/symbols/refresh", dependencies=[Depends(check_admin_token)])
+async def refresh_instruments(request: Request):
+    """fetch the instruments from the exchange now"""
+    return {"instruments": await request.app.state.registry.refresh(force=True)}
+
+
+@router.get("/ingestion")
+async def get_ingestion(request: Request, symbol: str | None = None):
+    """owner and state of the ingested topics, see `IngestionSupervisor.health`"""
+    return await request.app.state.supervisor.health(symbol)
+
+
+@router.post("/ingestion/{symbol}/{action}", dependencies=[Depends(check_admin_token)])
+async def control_ingestion(request: Request, symbol: str, action: str):
+    """`start`, `stop` or `restart` the ingestion of a symbol, for all api processes"""
+    supervisor = request.app.state.supervisor
+    actions = {"start": supervisor.start_symbol, "stop": supervisor.stop_symbol, "restart": supervisor.restart_symbol}
+    if action not in actions:
+        raise HTTPException(status_code=404, detail=f"unknown action {action}, use one of {list(actions)}")
+    try:
+        return await actions[action](symbol)
+    except SymbolError as e:
+        raise HTTPException(status_code=422, detail=str(e))
@@ -1,10 +1,12 @@
-import json
 import os
+import time
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
 from websockets import ConnectionClosedError, ConnectionClosedOK
-from app.db.consumer.trades import trades_consumer
+from app.db.consumer.trades import multi_trades_consumer
+from app.db.consumer.views import make_trade_view
 from app.logger import streaming_logger
+from app.profiling import stage_timers
 from app.websocket.models import TradesStreamModel
 from app.websocket.subscribe import check_subscription_call
 
@@ -13,6 +15,7 @@ router = APIRouter(prefix="")
 
 logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
 logger.setLevel(10)  # set to debug
+SEND_TIMER = stage_timers.timer("ws.send")
 
 
 @router.websocket("/trades")
@@ -26,9 +29,31 @@ async def websocket_trades(websocket: WebSocket):
     try:
         subscription = await check_subscription_call(websocket, TradesStreamModel)
 
-        # subscribe to the redis stream
-        async for trade in trades_consumer(subscription["stream"], subscription["timestamp"]):            
-            await websocket.send_text(json.dumps(trade))
+        # filter and downsample before the trades are encoded
+        view = make_trade_view(
+            subscription.filter.model_dump() if subscription.filter is not None else None,
+            subscription.downsample.model_dump() if subscription.downsample is not None else None,
+        )
+        # subscribe to the redis stream(s), a single stream is a subscription of one stream
+        packages = multi_trades_consumer(
+            subscription.starts(),
+            batch_size=subscription.batch_size,
+            batch_delay_ms=subscription.batch_delay_ms,
+            merge=subscription.merge,
+            view=view,
+            encoding=subscription.encoding,
+        )
+        async for package in packages:
+            # already encoded, single entries once for all clients. Binary encodings are send as binary frames
+            timed = stage_timers.enabled  # read once, the timers can be switched during the send
+            if timed:
+                start = time.perf_counter()
+            if isinstance(package, bytes):
+                await websocket.send_bytes(package)
+            else:
+                await websocket.send_text(package)
+            if timed:
+                SEND_TIMER.observe(time.perf_counter() - start)
 
     except (WebSocketDisconnect, ConnectionClosedOK, ConnectionClosedError) as e:
         logger.info(f"connection closed: {e}")
@@ -0,0 +1,21 @@
+"""JSON encoding for the hot paths, uses `orjson` when it is installed"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(data: str | bytes):
+        return orjson.loads(data)
+else:
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(data: str | bytes):
+        return json.loads(data)
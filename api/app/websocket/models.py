@@ -1,6 +1,8 @@
 from datetime import datetime
 import math
-from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Literal
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from app.db.consumer import encodings
 from app.db.utils import check_stream_exsists
 from app.errors import SubscriptionValueError
 
@@ -23,17 +25,97 @@ def make_str_timestamp() -> str:
     return str(math.floor(datetime.now().timestamp() * 1000))
 
 
+TRADES_MAX_STREAMS = 100
+
+
+class StreamStartModel(BaseModel):
+    """One stream of a multi-stream subscription, with its own start. Without `timestamp` and
+    `last_id` the stream starts at the `timestamp` of the subscription"""
+    model_config = ConfigDict(extra='forbid')
+    stream: str
+    timestamp: str|None = Field(max_length=13, min_length=13, pattern=r"^\d+$", default=None)
+    last_id: str|None = Field(default=None, pattern=r"^\d{1,20}-\d{1,20}$")
+
+    @field_validator('timestamp', mode="before")
+    def int_to_str(cls, v: int|str|None) -> str|None:
+        return str(v) if v is not None else None
+
+
+class TradeFilterModel(BaseModel):
+    """Only the trades that match all the given conditions are send"""
+    model_config = ConfigDict(extra='forbid')
+    side: Literal["Buy", "Sell"]|None = None
+    min_size: float|None = Field(default=None, gt=0)
+    min_notional: float|None = Field(default=None, gt=0)
+    block_trade: bool|None = None
+
+
+class DownsampleModel(BaseModel):
+    """One package per `interval_ms` of trades: with mode `latest` the last trade of the interval,
+    with `aggregate` the open, high, low, close, volume and number of the trades of the interval"""
+    model_config = ConfigDict(extra='forbid')
+    mode: Literal["latest", "aggregate"]
+    interval_ms: int = Field(ge=10, le=3_600_000)
+
+
 class TradesStreamModel(BaseWebSocketSubscriptionModel):
     """Validation model that checks the subscription to a trades stream. 
-    when timestamp is not supplied it will be created with the current timestamp"""
+    when timestamp is not supplied it will be created with the current timestamp.
+    With `batch_size` above 1 the trades are send as arrays of at most `batch_size` trades per message,
+    waiting at most `batch_delay_ms` for a live message to fill up.
+    A reconnecting client supplies the `id` of the last package it received as `last_id`,
+    only the entries after it are send (the timestamp is ignored then).
+    Instead of one `stream` a list of `streams` (names or `StreamStartModel`s) can be watched on one connection,
+    with `merge` their cached entries are replayed in timestamp order.
+    The trades can be filtered and downsampled on the server with `filter` and `downsample`.
+    With `encoding` `msgpack` or `columnar` the data packages are send as binary frames"""
     model_config = ConfigDict(extra='forbid')
-    stream: str
+    stream: str|None = None
+    streams: list[str|StreamStartModel]|None = Field(default=None, min_length=1, max_length=TRADES_MAX_STREAMS)
+    merge: bool = False
     timestamp: str|None = Field(max_length=13,  min_length=13, default_factory=make_str_timestamp)
+    batch_size: int = Field(default=1, ge=1, le=10000)
+    batch_delay_ms: int = Field(default=0, ge=0, le=10000)
+    last_id: str|None = Field(default=None, pattern=r"^\d{1,20}-\d{1,20}$")
+    filter: TradeFilterModel|None = None
+    downsample: DownsampleModel|None = None
+    encoding: Literal["json", "msgpack", "columnar"] = "json"
     
     async def extra_async_check(self) -> bool:
-        if not await check_stream_exsists(self.stream):
-            raise SubscriptionValueError(f"Stream '{0}' does not exist")
+        for stream in self.stream_names():
+            if not await check_stream_exsists(stream):
+                raise SubscriptionValueError(f"Stream '{stream}' does not exist")
         return True
+
+    @model_validator(mode='after')
+    def one_of_stream_or_streams(self) -> 'TradesStreamModel':
+        if (self.stream is None) == (self.streams is None):
+            raise ValueError("supply either `stream` or `streams`")
+        if self.streams is not None and self.last_id is not None:
+            raise ValueError("`last_id` of a subscription with `streams` is given per stream")
+        return self
+
+    @model_validator(mode='after')
+    def check_encoding(self) -> 'TradesStreamModel':
+        if self.encoding == "msgpack" and encodings.msgpack is None:
+            raise ValueError("encoding `msgpack` is not available on this server")
+        if self.encoding == "columnar" and self.downsample is not None and self.downsample.mode == "aggregate":
+            raise ValueError("encoding `columnar` has the fields of trades, not of aggregates")
+        return self
+
+    def stream_names(self) -> list[str]:
+        if self.streams is None:
+            return [self.stream]
+        return [stream if isinstance(stream, str) else stream.stream for stream in self.streams]
+
+    def starts(self) -> dict[str, str]:
+        """XRANGE start per stream: the timestamp or, with a resume cursor, the exclusive `(<last_id>`"""
+        starts = {}
+        for stream in self.streams or [StreamStartModel(stream=self.stream, last_id=self.last_id)]:
+            if isinstance(stream, str):
+                stream = StreamStartModel(stream=stream)
+            starts[stream.stream] = f"({stream.last_id}" if stream.last_id else stream.timestamp or self.timestamp
+        return starts
     
     @field_validator('timestamp', mode="before")
     def int_to_str(cls, v: int|str) -> str:
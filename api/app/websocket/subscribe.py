@@ -16,9 +16,11 @@ logger = streaming_logger(__name__, os.getenv("API_LOGGING_LEVEL", "ERROR"))
 logger.setLevel(10)  # set to debug
 
 
-async def check_subscription_call(websocket_conn: WebSocket, validation_model: BaseWebSocketSubscriptionModel):
+async def check_subscription_call(
+    websocket_conn: WebSocket, validation_model: BaseWebSocketSubscriptionModel
+) -> BaseWebSocketSubscriptionModel:
     """Check the subscription messages to the websocket server,
-    when valid returns the message as a dict.
+    when valid returns the validated model.
 
     Args:
         websocket_conn:         The (accepted) websocket connection
@@ -26,7 +28,7 @@ async def check_subscription_call(websocket_conn: WebSocket, validation_model: B
                                 `extra_async_check` method.
 
     Returns:
-        Upon receiving a valid input message (JSON), returns the message as a dict.
+        Upon receiving a valid input message (JSON), returns the instance of the validation_model.
         Otherwise let the client retry.
 
     Raises:
@@ -51,9 +53,8 @@ async def check_subscription_call(websocket_conn: WebSocket, validation_model: B
                 raise SubscriptionTerminatedError("client (got) disconnected before subscription finishes")
             subscripton = await check_subscription_model(received["text"], validation_model)
             await subscripton.extra_async_check()  # will raise  SubscriptionValueError
-            subscripton_dict = subscripton.model_dump()
-            await websocket_conn.send_text(f"subscribed with parameters {subscripton_dict}")
-            return subscripton_dict
+            await websocket_conn.send_text(f"subscribed with parameters {subscripton.model_dump()}")
+            return subscripton
         except SubscriptionTerminatedError as e:
             # terminate and don't send any msgs anymore
             raise WebSocketDisconnect(f"Client disconnected mid subscription process. Error: {e}")
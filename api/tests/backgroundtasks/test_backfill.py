@@ -0,0 +1,96 @@
+import asyncio
+import fakeredis
+import pytest
+from app.backgroundtasks.backfill import BybitTradeHistory, TradeBackfiller
+from app.backgroundtasks.exchange_pool import ExchangeConnection
+from app.db.producer.trades import create_trades_writer
+from helpers import make_trade, wait_for_length
+
+
+class FakeTradeHistory:
+    """offline stand-in for `BybitTradeHistory`"""
+
+    def __init__(self, trades: list[dict]):
+        self.trades = trades
+        self.requests = []
+
+    async def fetch_recent_trades(self, symbol: str) -> list[dict]:
+        self.requests.append(symbol)
+        return self.trades
+
+
+class FakeSession:
+    def get_public_trade_history(self, **kwargs):
+        return {"retCode": 0, "result": {"category": kwargs["category"], "list": [
+            {"execId": "b", "symbol": "BTCUSDT", "price": "42001.5", "size": "0.2", "side": "Sell", "time": "1705072083138", "isBlockTrade": False},
+            {"execId": "a", "symbol": "BTCUSDT", "price": "42001.0", "size": "0.1", "side": "Buy", "time": "1705072083137", "isBlockTrade": True},
+        ]}}
+
+
+@pytest.mark.asyncio
+async def test_trade_history_in_websocket_format():
+    trades = await BybitTradeHistory(FakeSession()).fetch_recent_trades("BTCUSDT")
+    assert [trade["i"] for trade in trades] == ["a", "b"]
+    assert trades[0] == {"T": 1705072083137, "s": "BTCUSDT", "S": "Buy", "v": "0.1", "p": "42001.0", "L": "", "i": "a", "BT": True}
+
+
+@pytest.mark.asyncio
+async def test_reconnect_backfills_the_gap(fake_bybit):
+    """the trades missed while disconnected are written in order before the first new trade, without duplicates"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    topic = "publicTrade.BTCUSDT"
+    history = FakeTradeHistory([make_trade(ts) for ts in (1001, 1500, 1600, 2000, 2100)])
+    backfiller = TradeBackfiller(history)
+    writers = {topic: await create_trades_writer(redis_db, "publicTrade:BTCUSDT")}
+    connection = ExchangeConnection(fake_bybit.uri, writers, backfiller=backfiller, reconnect_delay=0.05)
+    await connection.subscribe([topic])
+    connection.start()
+    try:
+        await fake_bybit.wait_for_subscriptions({topic})
+        await fake_bybit.publish(topic, [make_trade(1000), make_trade(1001)])
+        await wait_for_length(redis_db, "publicTrade:BTCUSDT", 2)
+        assert history.requests == []  # nothing stored before, nothing to fill
+
+        await fake_bybit.disconnect_all()
+        await fake_bybit.wait_for_subscriptions({topic})
+        await fake_bybit.publish(topic, [make_trade(2000)])
+        await wait_for_length(redis_db, "publicTrade:BTCUSDT", 5)
+        entries = await redis_db.xrange("publicTrade:BTCUSDT")
+        assert [entry[0] for entry in entries] == [b"1000-0", b"1001-0", b"1500-0", b"1600-0", b"2000-0"]
+        assert history.requests == ["BTCUSDT"]
+        assert connection.stats.reconnects == 1
+        assert backfiller.stats.gaps == 1 and backfiller.stats.incomplete == 0
+    finally:
+        await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_backfill_after_restart_skips_stored_trades():
+    """a new writer knows the trade ids of the last stored timestamp"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    first = await create_trades_writer(redis_db, "publicTrade:BTCUSDT")
+    first.add([make_trade(1000, trade_id="a"), make_trade(1000, trade_id="b")])
+    await first.flush()
+
+    writer = await create_trades_writer(redis_db, "publicTrade:BTCUSDT")
+    history = FakeTradeHistory([make_trade(900, trade_id="old"), make_trade(1000, trade_id="a"), make_trade(1000, trade_id="b"),
+                                make_trade(1000, trade_id="c"), make_trade(1200, trade_id="d")])
+    backfiller = TradeBackfiller(history)
+    assert await backfiller.backfill(writer, [make_trade(1200, trade_id="d")]) == 2
+    writer.add([make_trade(1200, trade_id="d")])
+    await writer.flush()
+    entries = await redis_db.xrange("publicTrade:BTCUSDT")
+    assert [(entry[0], entry[1][b"i"]) for entry in entries] == [
+        (b"1000-0", b"a"), (b"1000-1", b"b"), (b"1000-2", b"c"), (b"1200-0", b"d"),
+    ]
+    assert backfiller.stats.incomplete == 0
+
+
+@pytest.mark.asyncio
+async def test_reconnect_backoff():
+    """without an exchange the delay between the attempts doubles"""
+    connection = ExchangeConnection("ws://127.0.0.1:9", {}, reconnect_delay=0.01, max_reconnect_delay=0.04)
+    connection.start()
+    await asyncio.sleep(0.3)
+    await connection.close()
+    assert 3 <= connection.stats.reconnects <= 10
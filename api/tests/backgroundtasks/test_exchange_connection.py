@@ -0,0 +1,97 @@
+import asyncio
+import fakeredis
+import pytest
+from app.backgroundtasks.exchange_pool import ExchangeConnection, wait_for
+from app.db.producer.trades import TradesStreamWriter
+from helpers import make_trade
+
+
+class SlowRedis:
+    """fakeredis whose pipelines take `delay` seconds to execute, like a redis with a latency spike"""
+
+    def __init__(self, delay: float):
+        self.redis_db = fakeredis.FakeAsyncRedis()
+        self.delay = delay
+
+    def pipeline(self, *args, **kwargs):
+        pipe = self.redis_db.pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def slow_execute(*args, **kwargs):
+            await asyncio.sleep(self.delay)
+            return await execute(*args, **kwargs)
+        pipe.execute = slow_execute
+        return pipe
+
+    def __getattr__(self, name):
+        return getattr(self.redis_db, name)
+
+
+async def run_connection(fake_bybit, redis_db, frames: int, **kwargs) -> ExchangeConnection:
+    """publish `frames` frames of one trade while redis is slow, returns once the receiving stage has read them all
+    (and the response to the subscription)"""
+    topic = "publicTrade.BTCUSDT"
+    connection = ExchangeConnection(fake_bybit.uri, {topic: TradesStreamWriter(redis_db, "publicTrade:BTCUSDT")}, **kwargs)
+    await connection.subscribe([topic])
+    connection.start()
+    await fake_bybit.wait_for_subscriptions({topic})
+    for n in range(frames):
+        await fake_bybit.publish(topic, [make_trade(1000 + n)])
+
+    async def received():
+        while connection.stats.frames_received < frames + 1:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(received(), 2)
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_slow_redis_does_not_stall_receiving(fake_bybit):
+    """all frames are received while the first write still waits on redis, and all of them get written"""
+    redis_db = SlowRedis(delay=0.3)
+    connection = await run_connection(fake_bybit, redis_db, frames=50)
+    try:
+        assert connection.stats.frames_written <= 2  # the subscription response and the first trade
+        assert connection.stats.max_queue_depth > 1
+        await connection.close()
+        assert await redis_db.xlen("publicTrade:BTCUSDT") == 50
+        assert connection.stats.frames_dropped == 0
+        assert connection.stats.max_queue_lag_ms >= 300
+    finally:
+        await connection.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overflow_policy, first_written", [("drop_newest", 1000), ("drop_oldest", 1045)])
+async def test_overflow_policy(fake_bybit, overflow_policy, first_written):
+    redis_db = SlowRedis(delay=0.3)
+    connection = await run_connection(fake_bybit, redis_db, frames=50, queue_size=5, overflow_policy=overflow_policy)
+    try:
+        await connection.close()
+        stats = connection.stats
+        assert stats.frames_dropped > 0
+        assert stats.frames_written + stats.frames_dropped == stats.frames_received == 51
+        entries = await redis_db.xrange("publicTrade:BTCUSDT")
+        assert len(entries) == stats.frames_written - 1  # the subscription response
+        # the frame taken by the writing stage before redis got slow is always written
+        assert int(entries[0][0].split(b"-")[0]) == 1000
+        if overflow_policy == "drop_oldest":
+            assert [int(entry[0].split(b"-")[0]) for entry in entries[1:]] == list(range(1045, 1050))
+    finally:
+        await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_keeps_the_cancellation():
+    """a frame that arrives together with the cancellation doesn't keep the receiving stage running"""
+    frame = asyncio.get_running_loop().create_future()
+    receiving = asyncio.create_task(wait_for(frame, 10))
+    await asyncio.sleep(0)
+    frame.set_result("frame")
+    receiving.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await receiving
+
+    with pytest.raises(asyncio.TimeoutError):
+        await wait_for(asyncio.sleep(1), 0.01)
+    assert await wait_for(asyncio.sleep(0, "frame"), 1) == "frame"
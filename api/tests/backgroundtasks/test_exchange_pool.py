@@ -0,0 +1,103 @@
+import asyncio
+import fakeredis
+import pytest
+from app.backgroundtasks.exchange_pool import ExchangeConnectionPool
+from app.db.producer.orderbook import order_books, read_snapshot
+from helpers import make_trade, wait_for_length
+
+
+@pytest.mark.asyncio
+async def test_pool_multiplexes_topics(fake_bybit):
+    """many topics share a few connections and the frames end up in the stream of their topic"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    pool = ExchangeConnectionPool(fake_bybit.uri, max_connections=2, max_topics_per_connection=3, redis_db=redis_db)
+    await pool.start()
+    topics = [f"publicTrade.SYM{n}USDT" for n in range(5)]
+    try:
+        await pool.add_topics(topics)
+        await fake_bybit.wait_for_subscriptions(set(topics))
+        assert len(fake_bybit.connections) == 2
+        assert sorted(len(topics) for topics in pool.assignment().values()) == [2, 3]
+
+        await fake_bybit.publish("publicTrade.SYM0USDT", [make_trade(1000, "SYM0USDT"), make_trade(1000, "SYM0USDT", "second")])
+        await fake_bybit.publish("publicTrade.SYM4USDT", [make_trade(2000, "SYM4USDT")])
+        await wait_for_length(redis_db, "publicTrade:SYM0USDT", 2)
+        await wait_for_length(redis_db, "publicTrade:SYM4USDT", 1)
+        entries = await redis_db.xrange("publicTrade:SYM0USDT")
+        assert [entry[0] for entry in entries] == [b"1000-0", b"1000-1"]
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_rebalances_after_removal(fake_bybit):
+    redis_db = fakeredis.FakeAsyncRedis()
+    pool = ExchangeConnectionPool(fake_bybit.uri, max_connections=2, max_topics_per_connection=3, redis_db=redis_db)
+    await pool.start()
+    topics = [f"publicTrade.SYM{n}USDT" for n in range(6)]
+    try:
+        await pool.add_topics(topics)
+        await fake_bybit.wait_for_subscriptions(set(topics))
+        await pool.remove_topics(topics[:2])
+        assignment = pool.assignment()
+        assert sorted(sum(assignment.values(), [])) == topics[2:]
+        assert [len(topics) for topics in assignment.values()] == [2, 2]
+        await fake_bybit.wait_for_subscriptions(set(topics[2:]))
+
+        # without topics a connection is closed
+        await pool.remove_topics(topics[2:5])
+        assert list(pool.assignment().values()) == [topics[5:]]
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_moved_topic_is_not_written_twice(fake_bybit):
+    """while a topic is subscribed on two connections the duplicate trades are skipped"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    pool = ExchangeConnectionPool(fake_bybit.uri, max_connections=2, max_topics_per_connection=1, redis_db=redis_db)
+    await pool.start()
+    try:
+        await pool.add_topics(["publicTrade.BTCUSDT", "publicTrade.ETHUSDT"])
+        await fake_bybit.wait_for_subscriptions({"publicTrade.BTCUSDT", "publicTrade.ETHUSDT"})
+        second = pool.connections[1]
+        await second.subscribe(["publicTrade.BTCUSDT"])
+        await asyncio.sleep(0.05)
+        await fake_bybit.publish("publicTrade.BTCUSDT", [make_trade(1000), make_trade(1001)])
+        await wait_for_length(redis_db, "publicTrade:BTCUSDT", 2)
+        await asyncio.sleep(0.05)
+        assert await redis_db.xlen("publicTrade:BTCUSDT") == 2
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_maintains_order_books(fake_bybit):
+    """`orderbook` topics update the in process book and a snapshot of it is stored in redis"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    pool = ExchangeConnectionPool(fake_bybit.uri, redis_db=redis_db)
+    await pool.start()
+    topic = "orderbook.50.BOOKUSDT"
+    try:
+        await pool.add_topics([topic])
+        await fake_bybit.wait_for_subscriptions({topic})
+        await fake_bybit.publish_frame(topic, {
+            "topic": topic, "type": "snapshot", "ts": 1000, "data": {"s": "BOOKUSDT", "b": [["10", "1"]], "a": [["11", "2"]], "u": 5, "seq": 1},
+        })
+        await fake_bybit.publish_frame(topic, {
+            "topic": topic, "type": "delta", "ts": 1001, "data": {"s": "BOOKUSDT", "b": [["10.5", "3"]], "a": [], "u": 6, "seq": 2},
+        })
+
+        async def snapshot_stored():
+            while (snapshot := await read_snapshot(redis_db, "BOOKUSDT")) is None or snapshot["u"] < 6:
+                await asyncio.sleep(0.01)
+            return snapshot
+        snapshot = await asyncio.wait_for(snapshot_stored(), 3)
+        assert snapshot["b"] == [[10.5, 3.0], [10.0, 1.0]]
+        assert order_books["BOOKUSDT"].top()["bid"] == [10.5, 3.0]
+
+        # the book is no longer served from this process when the topic is removed
+        await pool.remove_topics([topic])
+        assert "BOOKUSDT" not in order_books
+    finally:
+        await pool.close()
@@ -0,0 +1,85 @@
+import asyncio
+import fakeredis
+import pytest
+from app.backgroundtasks.leases import IngestionLeases, lease_key
+
+
+class Recorder:
+    """stand-in for the exchange pool, records the topics it is told to ingest"""
+
+    def __init__(self):
+        self.topics: set[str] = set()
+
+    async def add_topics(self, topics: list[str]) -> None:
+        self.topics.update(topics)
+
+    async def remove_topics(self, topics: list[str]) -> None:
+        self.topics.difference_update(topics)
+
+
+def make_worker(redis_db, name: str, ttl: float = 0.3) -> tuple[IngestionLeases, Recorder]:
+    pool = Recorder()
+    leases = IngestionLeases(redis_db, pool.add_topics, pool.remove_topics, ttl=ttl, heartbeat_interval=ttl / 3, worker_id=name)
+    return leases, pool
+
+
+@pytest.mark.asyncio
+async def test_each_topic_is_ingested_once():
+    """two workers that want the same topics: the first one takes them, the second one takes the new ones"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    first, first_pool = make_worker(redis_db, "first")
+    second, second_pool = make_worker(redis_db, "second")
+
+    await first.add_topics(["publicTrade.BTCUSDT", "publicTrade.ETHUSDT"])
+    await second.add_topics(["publicTrade.BTCUSDT", "publicTrade.ETHUSDT", "publicTrade.SOLUSDT"])
+    assert first_pool.topics == {"publicTrade.BTCUSDT", "publicTrade.ETHUSDT"}
+    assert second_pool.topics == {"publicTrade.SOLUSDT"}
+    assert await redis_db.get(lease_key("publicTrade.BTCUSDT")) == b"first"
+
+    status = await second.status()
+    assert status["held"] == ["publicTrade.SOLUSDT"]
+    assert status["others"] == {"publicTrade.BTCUSDT": "first", "publicTrade.ETHUSDT": "first"}
+
+
+@pytest.mark.asyncio
+async def test_failover_after_missed_heartbeats():
+    """the leases of a worker that stops renewing expire and are taken over by the other worker"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    first, first_pool = make_worker(redis_db, "first")
+    second, second_pool = make_worker(redis_db, "second")
+    await first.add_topics(["publicTrade.BTCUSDT"])
+    await second.add_topics(["publicTrade.BTCUSDT"])
+    first.start()
+    second.start()
+    try:
+        # the heartbeats keep the lease with the first worker
+        await asyncio.sleep(0.6)
+        assert first_pool.topics == {"publicTrade.BTCUSDT"}
+        assert second_pool.topics == set()
+
+        await first.stop()  # a crashed worker: no heartbeats and no release
+        await asyncio.sleep(0.6)
+        assert second_pool.topics == {"publicTrade.BTCUSDT"}
+
+        # the first worker notices it lost the lease on its next heartbeat
+        await first.heartbeat()
+        assert first_pool.topics == set()
+    finally:
+        await first.close()
+        await second.close()
+    assert await redis_db.get(lease_key("publicTrade.BTCUSDT")) is None
+
+
+@pytest.mark.asyncio
+async def test_release_hands_over_right_away():
+    redis_db = fakeredis.FakeAsyncRedis()
+    first, _ = make_worker(redis_db, "first", ttl=60)
+    second, second_pool = make_worker(redis_db, "second", ttl=60)
+    await first.add_topics(["publicTrade.BTCUSDT"])
+    await second.add_topics(["publicTrade.BTCUSDT"])
+    assert second_pool.topics == set()
+
+    await first.close()
+    await second.heartbeat()
+    assert second_pool.topics == {"publicTrade.BTCUSDT"}
+    await second.close()
@@ -0,0 +1,91 @@
+import fakeredis
+import pytest
+from app.backgroundtasks.exchange_pool import ExchangeConnectionPool
+from app.backgroundtasks.leases import IngestionLeases
+from app.backgroundtasks.supervisor import IngestionSupervisor, symbol_topics
+from app.errors import SymbolError
+from helpers import make_registry, make_trade, wait_for_length
+
+
+async def make_worker(redis_db, uri: str, name: str, max_topics: int = 0, max_symbols: int = 10) -> IngestionSupervisor:
+    pool = ExchangeConnectionPool(uri, redis_db=redis_db)
+    await pool.start()
+    leases = IngestionLeases(redis_db, pool.add_topics, pool.remove_topics, worker_id=name, max_topics=max_topics)
+    registry = make_registry(redis_db)
+    await registry.refresh()
+    return IngestionSupervisor(registry, leases, pool, max_symbols=max_symbols, stale_after=60)
+
+
+async def close_worker(supervisor: IngestionSupervisor) -> None:
+    await supervisor.leases.close()
+    await supervisor.pool.close()
+
+
+@pytest.mark.asyncio
+async def test_start_stop_and_restart_at_runtime(fake_bybit):
+    redis_db = fakeredis.FakeAsyncRedis()
+    supervisor = await make_worker(redis_db, fake_bybit.uri, "worker")
+    try:
+        health = await supervisor.start_symbol("BTCUSDT")
+        assert [(topic["topic"], topic["owner"]) for topic in health] == [
+            ("publicTrade.BTCUSDT", "worker"), ("orderbook.50.BTCUSDT", "worker"),
+        ]
+        await fake_bybit.wait_for_subscriptions(set(symbol_topics("BTCUSDT")))
+        await fake_bybit.publish("publicTrade.BTCUSDT", [make_trade(1000)])
+        await wait_for_length(redis_db, "publicTrade:BTCUSDT", 1)
+        states = {topic["topic"]: topic["state"] for topic in await supervisor.health()}
+        assert states == {"orderbook.50.BTCUSDT": "starting", "publicTrade.BTCUSDT": "ok"}
+
+        # new writers continue the stream
+        await supervisor.restart_symbol("BTCUSDT")
+        await fake_bybit.wait_for_subscriptions(set(symbol_topics("BTCUSDT")))
+        await fake_bybit.publish("publicTrade.BTCUSDT", [make_trade(1000), make_trade(2000)])
+        await wait_for_length(redis_db, "publicTrade:BTCUSDT", 2)
+
+        await supervisor.stop_symbol("BTCUSDT")
+        assert await supervisor.health() == []
+        assert supervisor.pool.topics == set()
+        assert await redis_db.get("ingest-lease:publicTrade.BTCUSDT") is None
+    finally:
+        await close_worker(supervisor)
+
+
+@pytest.mark.asyncio
+async def test_start_is_checked_against_the_registry(fake_bybit):
+    redis_db = fakeredis.FakeAsyncRedis()
+    supervisor = await make_worker(redis_db, fake_bybit.uri, "worker", max_symbols=2)
+    try:
+        with pytest.raises(SymbolError, match="unknown"):
+            await supervisor.start_symbol("DOGEUSDT")
+        with pytest.raises(SymbolError, match="not trading"):
+            await supervisor.start_symbol("NEWUSDT")
+        await supervisor.start_symbol("BTCUSDT")
+        await supervisor.start_symbol("ETHUSDT")
+        with pytest.raises(SymbolError, match="maximum"):
+            await supervisor.start_symbol("SOLUSDT")
+        await supervisor.start_symbol("ETHUSDT")  # already enabled
+    finally:
+        await close_worker(supervisor)
+
+
+@pytest.mark.asyncio
+async def test_symbols_are_spread_over_the_workers(fake_bybit):
+    """a symbol started through one worker is synced by the others, `max_topics` leaves the rest to them"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    first = await make_worker(redis_db, fake_bybit.uri, "first", max_topics=2)
+    second = await make_worker(redis_db, fake_bybit.uri, "second", max_topics=2)
+    try:
+        await first.start_symbol("BTCUSDT")
+        await first.start_symbol("ETHUSDT")
+        await second.sync()
+        assert first.pool.topics == set(symbol_topics("BTCUSDT"))
+        assert second.pool.topics == set(symbol_topics("ETHUSDT"))
+        assert {topic["state"] for topic in await first.health("ETHUSDT")} == {"remote"}
+
+        # stopped through the first worker, the second one stops on its next sync
+        await first.stop_symbol("ETHUSDT")
+        await second.sync()
+        assert second.pool.topics == set()
+    finally:
+        await close_worker(first)
+        await close_worker(second)
@@ -0,0 +1,38 @@
+"""Memory and decoding throughput of the columnar chunks, reported with `pytest -s tests/benchmarks`"""
+import time
+import numpy as np
+from app.db.columnar import decode_chunk, encode_trades
+from helpers import make_chunk_trades
+
+TRADES = 10_000
+
+
+def test_columnar_benchmark():
+    """memory and throughput of the columnar chunks compared to a string fields entry per trade"""
+    trades = make_chunk_trades(TRADES)
+    fields_bytes = sum(len(key) + len(str(int(value) if isinstance(value, bool) else value)) for trade in trades for key, value in trade.items())
+
+    start = time.perf_counter()
+    chunks = [encode_trades(trades[i: i + 1000]) for i in range(0, TRADES, 1000)]
+    encode_time = time.perf_counter() - start
+    chunk_bytes = sum(len(chunk["data"]) for chunk in chunks)
+
+    start = time.perf_counter()
+    records = np.concatenate([decode_chunk(chunk) for chunk in chunks])
+    vwap = (records["p"] * records["v"]).sum() / records["v"].sum()
+    decode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prices = [float(trade["p"]) for trade in trades]
+    sizes = [float(trade["v"]) for trade in trades]
+    sum(p * v for p, v in zip(prices, sizes)) / sum(sizes)
+    fields_decode_time = time.perf_counter() - start
+
+    print(
+        f"{TRADES} trades: fields {fields_bytes / TRADES:.0f} bytes/trade, columnar {chunk_bytes / TRADES:.0f} bytes/trade; "
+        f"encode {encode_time / TRADES * 1e6:.2f}us/trade, "
+        f"decode+vwap columnar {decode_time * 1e3:.2f}ms vs fields {fields_decode_time * 1e3:.2f}ms"
+    )
+    assert chunk_bytes < fields_bytes / 2
+    assert records.dtype.itemsize == 43
+    assert vwap > 0
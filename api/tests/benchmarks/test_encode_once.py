@@ -0,0 +1,34 @@
+"""CPU cost per message of the live packages for several subscribers, reported with `pytest -s tests/benchmarks`"""
+import json
+import time
+from app.db.consumer.hub import StreamEntry
+from app.db.consumer.trades import make_data_package
+from helpers import make_raw_entries
+
+MSGS_PER_SEC = 10_000
+SUBSCRIBERS = 10
+
+
+def test_encode_once_benchmark():
+    """CPU cost per message for `SUBSCRIBERS` clients: decoding and encoding per client (previous path)
+    against decoding and encoding once per entry and reusing the string for every client"""
+    raw_entries = make_raw_entries(MSGS_PER_SEC)
+
+    start = time.process_time()
+    for _, raw_fields in raw_entries:
+        for _ in range(SUBSCRIBERS):
+            json.dumps(make_data_package("data", raw_fields))
+    per_client = (time.process_time() - start) / MSGS_PER_SEC
+
+    start = time.process_time()
+    for raw_entry in raw_entries:
+        entry = StreamEntry(*raw_entry)
+        for _ in range(SUBSCRIBERS):
+            entry.package
+    encode_once = (time.process_time() - start) / MSGS_PER_SEC
+
+    print(
+        f"{SUBSCRIBERS} subscribers at {MSGS_PER_SEC} msgs/s: "
+        f"per client encoding {per_client * 1e6:.1f}us/msg ({per_client * MSGS_PER_SEC:.0%} of a core), "
+        f"encode once {encode_once * 1e6:.1f}us/msg ({encode_once * MSGS_PER_SEC:.0%} of a core)"
+    )
@@ -0,0 +1,46 @@
+"""Bytes on the wire and CPU per trade of the package encodings, reported with `pytest -s tests/benchmarks`"""
+import time
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+from app.db.consumer.hub import StreamEntry
+from app.db.consumer.trades import encode_packages
+from helpers import make_raw_entries
+
+MSGS_PER_SEC = 10_000
+
+
+def frame_size(payload_size: int) -> int:
+    """bytes of an unmasked websocket frame"""
+    return payload_size + 2 + (2 if payload_size >= 126 else 0) + (6 if payload_size >= 65536 else 0)
+
+
+def test_encoding_benchmark():
+    """bytes on the wire and server CPU per trade for every encoding, for one second of trades at 10k msgs/s.
+    The frames are compressed with permessage-deflate (context takeover, as negotiated by default) for
+    the compressed size, the CPU is of the encoding and the frame serialization, and of the compression"""
+    entries = [StreamEntry(*raw_entry, "publicTrade:BTCUSDT") for raw_entry in make_raw_entries(MSGS_PER_SEC)]
+    results = {}
+    for batch_size in (1, 100):
+        for encoding in ("json", "msgpack", "columnar"):
+            if encoding == "columnar" and batch_size == 1:
+                continue  # always a batch
+            for entry in entries:
+                entry._json = entry._package = entry._encoded = None  # the first client that receives the entries
+            start = time.process_time()
+            frames = [
+                Frame(Opcode.TEXT if isinstance(package, str) else Opcode.BINARY, package.encode() if isinstance(package, str) else package)
+                for package in encode_packages(entries, batch_size, encoding)
+            ]
+            sent = sum(len(frame.serialize(mask=False)) for frame in frames)
+            cpu = time.process_time() - start
+            deflate = PerMessageDeflate(False, False, 15, 15)
+            start = time.process_time()
+            compressed = sum(frame_size(len(deflate.encode(frame).data)) for frame in frames)
+            deflate_cpu = time.process_time() - start
+            results[encoding, batch_size] = sent
+            print(
+                f"{encoding} batch_size {batch_size}: {cpu / MSGS_PER_SEC * 1e6:.2f}us/trade, {sent / MSGS_PER_SEC:.1f} bytes/trade, "
+                f"{compressed / MSGS_PER_SEC:.1f} bytes/trade with permessage-deflate (+{deflate_cpu / MSGS_PER_SEC * 1e6:.2f}us/trade)"
+            )
+    assert results["msgpack", 1] < results["json", 1]
+    assert results["columnar", 100] < results["msgpack", 100] < results["json", 100]
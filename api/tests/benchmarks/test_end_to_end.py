@@ -0,0 +1,262 @@
+"""End-to-end load test: a local fake bybit server publishes `publicTrade` frames at a fixed rate into
+`fetch_exchange_ws_stream`, N websocket clients follow the stream on `/trades` of `app.routers.ws`
+(served in process by uvicorn), and the ingest rate, the latency from trade timestamp to client,
+CPU and memory are reported. Everything runs in the pytest process, so CPU and memory are the
+totals of the exchange, the api and the clients.
+
+By default a short smoke run is done. Tune it with environment variables:
+
+    BENCHMARK_RATE              trades per second published, 0 publishes as fast as possible (default 1000)
+    BENCHMARK_DURATION          seconds of publishing (default 2)
+    BENCHMARK_TRADES_PER_FRAME  trades per websocket frame (default 10)
+    BENCHMARK_CLIENTS           number of `/trades` clients (default 2)
+    BENCHMARK_BATCH_SIZE        `batch_size` of the client subscriptions (default 1)
+    BENCHMARK_FRAMES            JSON lines file with recorded bybit frames to replay, synthetic trades otherwise
+    BENCHMARK_REDIS_URL         use this redis instead of the in process fakeredis server
+    BENCHMARK_OUTPUT            write the report as JSON to this file
+    BENCHMARK_BASELINE          a previous report, the run is compared against it
+    BENCHMARK_MAX_REGRESSION    fail when the ingest rate drops more than this fraction below the baseline
+
+e.g. `BENCHMARK_RATE=0 BENCHMARK_DURATION=10 BENCHMARK_OUTPUT=after.json BENCHMARK_BASELINE=before.json
+pytest -s tests/benchmarks`"""
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+import itertools
+import json
+import os
+import resource
+import time
+import fakeredis
+from fastapi import FastAPI
+import numpy as np
+import pytest
+import redis.asyncio as redis
+import uvicorn
+import websockets
+from app.backgroundtasks import exchange_trades
+from app.backgroundtasks.exchange_pool import topic_to_stream_name
+from app.db import utils
+from app.db.consumer import trades
+from app.db.consumer.hub import TradesHub
+from app.routers import ws
+from helpers import make_trade
+
+
+@dataclass
+class BenchmarkConfig:
+    rate: float = float(os.getenv("BENCHMARK_RATE", 1000))
+    duration: float = float(os.getenv("BENCHMARK_DURATION", 2))
+    trades_per_frame: int = int(os.getenv("BENCHMARK_TRADES_PER_FRAME", 10))
+    clients: int = int(os.getenv("BENCHMARK_CLIENTS", 2))
+    batch_size: int = int(os.getenv("BENCHMARK_BATCH_SIZE", 1))
+    frames_file: str | None = os.getenv("BENCHMARK_FRAMES")
+    redis_url: str | None = os.getenv("BENCHMARK_REDIS_URL")
+    symbol: str = field(default_factory=lambda: f"BENCH{int(time.time())}")
+
+
+def load_trades(config: BenchmarkConfig):
+    """endless trades of the recorded frames, or synthetic ones"""
+    if config.frames_file:
+        with open(config.frames_file) as f:
+            recorded = [trade for line in f if line.strip() for trade in json.loads(line)["data"]]
+        assert recorded, f"no trades in {config.frames_file}"
+        return itertools.cycle(recorded)
+    return (make_trade(0, size=f"{0.001 * (n % 100 + 1):.3f}", side=("Buy", "Sell")[n % 2]) for n in itertools.count())
+
+
+async def publish_frames(server, topic: str, config: BenchmarkConfig) -> int:
+    """publish frames for `config.duration` seconds at `config.rate` trades per second,
+    the trades get the current time as timestamp. Returns the number of published trades"""
+    source = load_trades(config)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    published = 0
+    while loop.time() - start < config.duration:
+        now_ms = int(time.time() * 1000)
+        frame = [
+            {**trade, "T": now_ms, "s": config.symbol, "i": f"bench-{published + n}"}
+            for n, trade in enumerate(itertools.islice(source, config.trades_per_frame))
+        ]
+        await server.publish(topic, frame)
+        published += len(frame)
+        if config.rate > 0:
+            await asyncio.sleep(max(0.0, start + published / config.rate - loop.time()))
+        else:
+            await asyncio.sleep(0)  # let the ingestion keep up with the receive queue
+    return published
+
+
+class TradesClient:
+    """a `/trades` websocket client that records the latency of every received trade"""
+
+    def __init__(self, uri: str, stream_name: str, batch_size: int, since_ms: int):
+        self.uri = uri
+        self.stream_name = stream_name
+        self.batch_size = batch_size
+        self.since_ms = since_ms
+        self.latencies_ms: list[int] = []
+        self.subscribed = asyncio.Event()
+
+    async def run(self) -> None:
+        async with websockets.connect(self.uri, max_size=None, close_timeout=0.1) as websocket:
+            await websocket.recv()  # connection established
+            await websocket.send(json.dumps({"stream": self.stream_name, "batch_size": self.batch_size}))
+            async for msg in websocket:
+                if msg.startswith("subscribed"):
+                    self.subscribed.set()
+                    continue
+                now_ms = time.time() * 1000
+                package = json.loads(msg)
+                if package.get("type") != "data":
+                    continue
+                data = package["data"] if isinstance(package["data"], list) else [package["data"]]
+                self.latencies_ms += [now_ms - int(trade["T"]) for trade in data if int(trade["T"]) >= self.since_ms]
+
+
+@asynccontextmanager
+async def serve(app: FastAPI):
+    """serve the app with uvicorn on a free port, yields the base uri"""
+    # a `/trades` handler waiting for live trades only notices a closed client on its next send, don't wait for it
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_level="warning", timeout_graceful_shutdown=1))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"ws://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+async def cancel(task: asyncio.Task) -> None:
+    task.cancel()
+    await asyncio.wait([task])
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(max(values))}
+
+
+def compare_with_baseline(report: dict, baseline: dict) -> dict:
+    """relative change of the main numbers against the baseline, positive is more"""
+    def change(current, previous):
+        return (current - previous) / previous if current is not None and previous else None
+    return {
+        "ingest_trades_per_sec": change(report["ingest_trades_per_sec"], baseline["ingest_trades_per_sec"]),
+        "latency_p50_ms": change(report["latency_ms"]["p50"], baseline["latency_ms"]["p50"]),
+        "latency_p99_ms": change(report["latency_ms"]["p99"], baseline["latency_ms"]["p99"]),
+        "cpu_percent": change(report["cpu_percent"], baseline["cpu_percent"]),
+        "max_rss_mb": change(report["max_rss_mb"], baseline["max_rss_mb"]),
+    }
+
+
+async def wait_until(condition, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await condition():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run_benchmark(fake_bybit, monkeypatch, config: BenchmarkConfig) -> dict:
+    server = fakeredis.FakeServer()
+
+    def make_client():
+        if config.redis_url:
+            return redis.Redis.from_url(config.redis_url)
+        return fakeredis.FakeAsyncRedis(server=server)
+    # every redis_conn_manager of the ingestion, the consumers and the subscription check uses the stand-in
+    monkeypatch.setattr(utils, "make_redis_client", make_client)
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(block_ms=100))
+
+    topic = f"publicTrade.{config.symbol}"
+    stream_name = topic_to_stream_name(topic)
+    redis_db = make_client()
+    app = FastAPI()
+    app.include_router(ws.router)
+
+    ingestion = asyncio.create_task(exchange_trades.fetch_exchange_ws_stream(topic, uri=fake_bybit.uri))
+    clients = []
+    try:
+        await fake_bybit.wait_for_subscriptions({topic}, timeout=5)
+        # a first frame creates the stream, the clients can only subscribe to an existing stream
+        await fake_bybit.publish(topic, [make_trade(int(time.time() * 1000), config.symbol, "warmup")])
+        assert await wait_until(lambda: redis_db.exists(stream_name), 5), "the ingestion didn't create the stream"
+
+        async with serve(app) as uri:
+            since_ms = int(time.time() * 1000) + 1
+            clients = [TradesClient(f"{uri}/trades", stream_name, config.batch_size, since_ms) for _ in range(config.clients)]
+            client_tasks = [asyncio.create_task(client.run()) for client in clients]
+            await asyncio.wait_for(asyncio.gather(*(client.subscribed.wait() for client in clients)), 10)
+            await asyncio.sleep(0.2)  # the clients pass the replay of the warmup trade
+
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            published = await publish_frames(fake_bybit, topic, config)
+
+            async def ingested() -> bool:
+                return await redis_db.xlen(stream_name) >= published + 1
+            all_ingested = await wait_until(ingested, 30)
+            ingest_seconds = time.perf_counter() - wall_start
+
+            async def delivered() -> bool:
+                return all(len(client.latencies_ms) >= published for client in clients)
+            await wait_until(delivered, 30)
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            stored = await redis_db.xlen(stream_name) - 1  # without the warmup trade
+
+            for task in client_tasks:
+                await cancel(task)
+    finally:
+        await cancel(ingestion)
+        if config.redis_url:
+            await redis_db.delete(*[key async for key in redis_db.scan_iter(match=f"*{config.symbol}*")])
+        await redis_db.aclose()
+        await trades.trades_hub.close()
+
+    latencies = [latency for client in clients for latency in client.latencies_ms]
+    return {
+        "config": asdict(config),
+        "published_trades": published,
+        "stored_trades": stored,
+        "ingest_seconds": ingest_seconds,
+        "ingest_trades_per_sec": published / ingest_seconds if all_ingested else None,
+        "delivered_trades": len(latencies),
+        "expected_deliveries": published * config.clients,
+        "latency_ms": percentiles(latencies),
+        "cpu_seconds": cpu_seconds,
+        "cpu_percent": 100 * cpu_seconds / wall_seconds,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+@pytest.mark.asyncio
+async def test_end_to_end_benchmark(fake_bybit, monkeypatch):
+    """every published trade is stored and delivered to every client, the report is printed (`pytest -s`)"""
+    config = BenchmarkConfig()
+    report = await run_benchmark(fake_bybit, monkeypatch, config)
+
+    baseline_file = os.getenv("BENCHMARK_BASELINE")
+    if baseline_file:
+        with open(baseline_file) as f:
+            report["change_vs_baseline"] = compare_with_baseline(report, json.load(f))
+    print(json.dumps(report, indent=2))
+    output_file = os.getenv("BENCHMARK_OUTPUT")
+    if output_file:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+
+    assert report["ingest_trades_per_sec"] is not None, "not all published trades were stored"
+    assert report["delivered_trades"] == report["expected_deliveries"]
+    max_regression = os.getenv("BENCHMARK_MAX_REGRESSION")
+    if baseline_file and max_regression:
+        assert report["change_vs_baseline"]["ingest_trades_per_sec"] >= -float(max_regression)
@@ -0,0 +1,35 @@
+"""CPU cost per trade of decoding the `publicTrade` frames and assigning the stream ids,
+reported with `pytest -s tests/benchmarks`"""
+import json
+import time
+import fakeredis
+from app.db.producer.trades import TradesStreamWriter
+from app.serialize import loads
+
+
+def make_frames(count: int, trades_per_frame: int) -> list[str]:
+    """`publicTrade` frames like the ones bybit sends during a liquidation cascade"""
+    frames = []
+    for f in range(count):
+        ts = 1705072083137 + f // 3  # several frames per millisecond
+        data = [
+            {"T": ts, "s": "BTCUSDT", "S": "Sell", "v": "0.125", "p": f"{42000 - f / 10:.2f}", "L": "MinusTick",
+             "i": f"2b9a{f:04x}-{n:04x}-5dc2-bd1c-8a1c5e9b1f3e", "BT": False}
+            for n in range(trades_per_frame)
+        ]
+        frames.append(json.dumps({"topic": "publicTrade.BTCUSDT", "type": "snapshot", "ts": ts, "data": data}))
+    return frames
+
+
+def test_frame_decoding_benchmark():
+    frames = make_frames(2000, 50)
+    trades = 2000 * 50
+
+    writer = TradesStreamWriter(fakeredis.FakeAsyncRedis(), "publicTrade:BTCUSDT")
+    start = time.perf_counter()
+    for frame in frames:
+        writer.add(loads(frame)["data"])
+    elapsed = time.perf_counter() - start
+
+    assert len(writer.buffer) == trades
+    print(f"frame decoding: {elapsed / trades * 1e9:.0f} ns/trade")
@@ -0,0 +1,29 @@
+"""Latency of a command with a client per call against one borrowed from the app wide pool,
+reported with `pytest -s tests/benchmarks`"""
+import time
+import pytest
+import redis.asyncio as redis
+from app.db.utils import close_redis_pool, init_redis_pool, redis_conn_manager
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_benchmark(fake_redis_server):
+    host, port = fake_redis_server
+    calls = 300
+    start = time.perf_counter()
+    for _ in range(calls):
+        client = redis.Redis(host=host, port=port)
+        await client.ping()
+        await client.aclose()
+    per_call_client = time.perf_counter() - start
+
+    try:
+        await init_redis_pool(max_connections=10)
+        start = time.perf_counter()
+        for _ in range(calls):
+            async with redis_conn_manager() as redis_db:
+                await redis_db.ping()
+        pooled = time.perf_counter() - start
+    finally:
+        await close_redis_pool()
+    print(f"per call client: {per_call_client / calls * 1e6:.0f}us/call, pooled: {pooled / calls * 1e6:.0f}us/call")
@@ -0,0 +1,25 @@
+"""Time of `sort_stream` on the outputs it gets: ascending XRANGE, descending XREVRANGE and shuffled
+entries, reported with `pytest -s tests/benchmarks`"""
+import random
+import time
+import pytest
+from app.db.utils import parse_stream_id, sort_stream
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("order", ["ascending", "descending", "shuffled"])
+async def test_sort_stream_benchmark(order):
+    """100k entries, XRANGE and XREVRANGE output is returned without sorting"""
+    raw_data = [(f"{1705072083137 + n // 7}-{n % 7}".encode(), {}) for n in range(100_000)]
+    expected = list(raw_data)
+    if order == "descending":
+        raw_data.reverse()
+    elif order == "shuffled":
+        random.Random(1).shuffle(raw_data)
+
+    start = time.perf_counter()
+    result = await sort_stream(raw_data)
+    elapsed = time.perf_counter() - start
+
+    assert result == expected == sorted(raw_data, key=lambda entry: parse_stream_id(entry[0].decode()))
+    print(f"sort_stream of 100k {order} entries: {elapsed * 1000:.1f} ms")
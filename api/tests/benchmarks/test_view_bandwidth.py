@@ -0,0 +1,35 @@
+"""CPU and bandwidth per client of the filtered and downsampled subscriptions, reported with `pytest -s tests/benchmarks`"""
+import time
+from websockets.frames import Frame, Opcode
+from app.db.consumer.views import TradeView, make_trade_view
+from helpers import make_entry
+
+MSGS_PER_SEC = 10_000
+
+
+def test_view_benchmark():
+    """CPU and bytes per client for one second of trades at 10k msgs/s: every trade against filtered
+    (block trades, 1% of the trades) and downsampled (latest and aggregate per 100ms) subscriptions.
+    The send of a package is approximated by the serialization of its websocket frame"""
+    raw_entries = [make_entry(1705072083137 + n // 10, n % 10, block="1" if n % 100 == 0 else "0") for n in range(MSGS_PER_SEC)]
+    for entry in raw_entries:
+        entry.package  # encoded once by the hub for all clients
+
+    def run(view: TradeView | None) -> tuple[float, int]:
+        start = time.process_time()
+        sent = 0
+        entries = raw_entries if view is None else view.process(raw_entries) + view.flush()
+        for entry in entries:
+            sent += len(Frame(Opcode.TEXT, entry.package.encode()).serialize(mask=False))
+        return time.process_time() - start, sent
+
+    every_cpu, every_bytes = run(None)
+    results = {
+        "block trades": run(make_trade_view({"block_trade": True})),
+        "latest 100ms": run(make_trade_view(None, {"mode": "latest", "interval_ms": 100})),
+        "aggregate 100ms": run(make_trade_view(None, {"mode": "aggregate", "interval_ms": 100})),
+    }
+    print(f"every trade at {MSGS_PER_SEC} msgs/s: {every_cpu * 1e3:.1f}ms CPU, {every_bytes / 1024:.0f}KiB per client per second")
+    for name, (cpu, sent) in results.items():
+        print(f"{name}: {cpu * 1e3:.1f}ms CPU, {sent / 1024:.1f}KiB per client per second ({1 - sent / every_bytes:.1%} bytes saved)")
+        assert sent < every_bytes / 10
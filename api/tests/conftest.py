@@ -0,0 +1,113 @@
+import asyncio
+import json
+import pytest_asyncio
+import websockets
+
+
+class FakeBybitServer:
+    """Local stand-in for the public websocket of bybit. Handles (un)subscribe requests
+    and pushes `publicTrade` frames to the connections subscribed to a topic."""
+
+    def __init__(self):
+        self.server = None
+        self.connections: dict = {}  # websocket connection => set of subscribed topics
+        self.subscribe_requests: list[dict] = []
+
+    @property
+    def uri(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    async def start(self) -> None:
+        self.server = await websockets.serve(self.handler, "127.0.0.1", 0)
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handler(self, websocket) -> None:
+        self.connections[websocket] = set()
+        try:
+            async for msg in websocket:
+                request = json.loads(msg)
+                if request["op"] == "ping":
+                    await websocket.send(json.dumps({"success": True, "ret_msg": "pong", "op": "ping"}))
+                    continue
+                self.subscribe_requests.append(request)
+                if request["op"] == "subscribe":
+                    self.connections[websocket].update(request["args"])
+                elif request["op"] == "unsubscribe":
+                    self.connections[websocket].difference_update(request["args"])
+                await websocket.send(json.dumps({"success": True, "ret_msg": "", "op": request["op"]}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.pop(websocket, None)
+
+    async def disconnect_all(self) -> None:
+        """drop all client connections, like an exchange restart"""
+        for websocket in list(self.connections):
+            await websocket.close(code=1011, reason="restart")
+
+        async def disconnected():
+            while self.connections:
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(disconnected(), 2)
+
+    def subscriptions(self) -> list[set[str]]:
+        return list(self.connections.values())
+
+    async def wait_for_subscriptions(self, topics: set[str], timeout: float = 2) -> None:
+        """wait until every topic is subscribed on one of the connections"""
+        async def subscribed():
+            while not topics <= set().union(*self.subscriptions()):
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(subscribed(), timeout)
+
+    async def publish(self, topic: str, trades: list[dict]) -> None:
+        """send a `publicTrade` frame to the connections subscribed to the topic"""
+        await self.publish_frame(topic, {"topic": topic, "type": "snapshot", "ts": trades[-1]["T"], "data": trades})
+
+    async def publish_frame(self, topic: str, frame: dict) -> None:
+        """send any frame, e.g. of an `orderbook` topic, to the connections subscribed to the topic"""
+        frame = json.dumps(frame)
+        for websocket, topics in list(self.connections.items()):
+            if topic in topics:
+                await websocket.send(frame)
+
+
+@pytest_asyncio.fixture
+async def fake_bybit():
+    server = FakeBybitServer()
+    await server.start()
+    yield server
+    await server.close()
+
+
+async def answer_ok(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """minimal RESP server that answers every command with OK (and PING with PONG)"""
+    try:
+        while True:
+            header = await reader.readline()
+            if not header:
+                break
+            args = []
+            for _ in range(int(header[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            writer.write(b"+PONG\r\n" if args[0].upper() == b"PING" else b"+OK\r\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def fake_redis_server(monkeypatch):
+    """a local RESP server, REDIS_HOST and REDIS_PORT point to it. Yields its (host, port)"""
+    server = await asyncio.start_server(answer_ok, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    monkeypatch.setenv("REDIS_HOST", host)
+    monkeypatch.setenv("REDIS_PORT", str(port))
+    yield host, port
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,54 @@
+import json
+import fakeredis
+import msgpack
+import pytest
+from app.db.consumer import trades
+from app.db.consumer.encodings import decode_columnar_batch, encode_binary_packages
+from app.db.consumer.hub import StreamEntry, TradesHub
+from app.db.consumer.trades import encode_packages
+from helpers import make_conn_manager, make_raw_entries
+
+
+def make_entries(count: int) -> list[StreamEntry]:
+    return [StreamEntry(*raw_entry, "publicTrade:BTCUSDT") for raw_entry in make_raw_entries(count)]
+
+
+def test_msgpack_matches_json():
+    entries = make_entries(3)
+    assert [msgpack.unpackb(package) for package in encode_binary_packages(entries, 1, "msgpack")] == [
+        json.loads(package) for package in encode_packages(entries, 1)
+    ]
+    assert msgpack.unpackb(encode_binary_packages(entries, 3, "msgpack")[0]) == json.loads(encode_packages(entries, 3)[0])
+    # encoded once for all subscribers
+    assert encode_binary_packages(entries, 1, "msgpack")[0] is encode_binary_packages(entries, 1, "msgpack")[0]
+
+
+def test_columnar_roundtrip():
+    entries = make_entries(25)
+    [package] = encode_binary_packages(entries, 100, "columnar")
+    header, records, ids = decode_columnar_batch(package)
+    assert (header["stream"], header["id"], header["n"]) == ("publicTrade:BTCUSDT", entries[-1].id, 25)
+    assert ids == [entry.fields["i"] for entry in entries]
+    assert records["T"].tolist() == [int(entry.fields["T"]) for entry in entries]
+    assert records["p"].tolist() == [float(entry.fields["p"]) for entry in entries]
+    assert records["v"].tolist() == [0.001] * 25
+
+
+@pytest.mark.asyncio
+async def test_consumer_sends_binary_packages(monkeypatch):
+    """info packages stay JSON, the data packages are bytes"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for raw_id, raw_fields in make_raw_entries(3):
+        await redis_db.xadd("publicTrade:BTCUSDT", raw_fields, id=raw_id)
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    consumer = trades.multi_trades_consumer({"publicTrade:BTCUSDT": "0"}, batch_size=2, encoding="columnar")
+    received = []
+    async for package in consumer:
+        if isinstance(package, bytes):
+            received.append(decode_columnar_batch(package)[0]["n"])
+        elif json.loads(package)["msg"] == "wait for new data":
+            break
+    await consumer.aclose()
+    assert received == [2, 1]
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import fakeredis
+import pytest
+from app.db.consumer.hub import StreamEntry, Subscriber, TradesHub
+from app.errors import SlowConsumerError
+from helpers import make_conn_manager
+
+
+@pytest.mark.asyncio
+async def test_hub_shares_one_reader():
+    """all subscribers of a stream get the same decoded entry from a single reader"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    await redis_db.xadd("publicTrade:HUB1", {"p": "1"}, id="1-0")
+    hub = TradesHub(make_conn_manager(redis_db), block_ms=100)
+    async with hub.subscribe("publicTrade:HUB1") as first, hub.subscribe("publicTrade:HUB1") as second:
+        assert len(hub.tails) == 1
+        assert hub.stats()[0]["subscribers"] == 2
+        await redis_db.xadd("publicTrade:HUB1", {"p": "2"}, id="2-0")
+        entry_first = await asyncio.wait_for(first.get(), 1)
+        entry_second = await asyncio.wait_for(second.get(), 1)
+        assert entry_first is entry_second
+        assert entry_first.id == "2-0"
+        assert entry_first.fields == {"p": "2"}
+    assert hub.tails == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy, expected", [("drop", ["1-0", "2-0"]), ("coalesce", ["3-0", "4-0"])])
+async def test_slow_consumer_policies(policy, expected):
+    redis_db = fakeredis.FakeAsyncRedis()
+    hub = TradesHub(make_conn_manager(redis_db), block_ms=100)
+    async with hub.subscribe(f"publicTrade:{policy}", maxsize=2, policy=policy) as subscriber:
+        for n in range(1, 5):
+            await redis_db.xadd(f"publicTrade:{policy}", {"p": str(n)}, id=f"{n}-0")
+        tail = hub.tails[f"publicTrade:{policy}"]
+        while tail.entries_read < 4:
+            await asyncio.sleep(0.01)
+        assert subscriber.dropped == 2
+        assert [(await subscriber.get()).id for _ in range(2)] == expected
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_disconnect():
+    redis_db = fakeredis.FakeAsyncRedis()
+    hub = TradesHub(make_conn_manager(redis_db), block_ms=100)
+    async with hub.subscribe("publicTrade:SLOW", maxsize=1, policy="disconnect") as slow, \
+            hub.subscribe("publicTrade:SLOW", maxsize=10) as fast:
+        for n in range(1, 4):
+            await redis_db.xadd("publicTrade:SLOW", {"p": str(n)}, id=f"{n}-0")
+        assert (await asyncio.wait_for(fast.get(), 1)).id == "1-0"
+        while hub.tails["publicTrade:SLOW"].entries_read < 3:
+            await asyncio.sleep(0.01)
+        with pytest.raises(SlowConsumerError):
+            await slow.get()
+        assert [(await fast.get()).id for _ in range(2)] == ["2-0", "3-0"]
+
+
+def test_no_slow_consumer_policy_during_the_replay():
+    """a full queue during the replay isn't a slow consumer, the entries that didn't fit are replayed"""
+    subscriber = Subscriber("publicTrade:REPLAY", maxsize=2, policy="disconnect", replaying=True)
+    for n in range(1, 4):
+        subscriber.push(StreamEntry(f"{n}-0".encode(), {b"p": str(n).encode()}))
+    assert not subscriber.end_replay(lambda entry: entry.key <= (1, 0))
+    assert subscriber.queue.empty()
+
+    for n in range(4, 6):
+        subscriber.push(StreamEntry(f"{n}-0".encode(), {b"p": str(n).encode()}))
+    assert subscriber.end_replay(lambda entry: entry.key <= (4, 0))
+    assert subscriber.get_nowait().id == "5-0"
+    for n in range(6, 9):
+        subscriber.push(StreamEntry(f"{n}-0".encode(), {b"p": str(n).encode()}))
+    with pytest.raises(SlowConsumerError):
+        subscriber.get_nowait()
+
+
+@pytest.mark.asyncio
+async def test_hub_reads_all_streams_with_one_reader():
+    """one subscriber of several streams, a stream added during a blocking XREAD is picked up right away"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    hub = TradesHub(make_conn_manager(redis_db), block_ms=5000)
+    async with hub.subscribe(["publicTrade:MULTI1", "publicTrade:MULTI2"]) as subscriber:
+        await redis_db.xadd("publicTrade:MULTI2", {"p": "1"}, id="1-0")
+        entry = await asyncio.wait_for(subscriber.get(), 1)
+        assert (entry.stream, entry.id) == ("publicTrade:MULTI2", "1-0")
+        assert json.loads(entry.package)["stream"] == "publicTrade:MULTI2"
+
+        await asyncio.sleep(0.1)  # the reader blocks on the first two streams
+        async with hub.subscribe("publicTrade:MULTI3") as third:
+            await redis_db.xadd("publicTrade:MULTI3", {"p": "2"}, id="2-0")
+            assert (await asyncio.wait_for(third.get(), 1)).id == "2-0"
+        assert sorted(hub.tails) == ["publicTrade:MULTI1", "publicTrade:MULTI2"]
+        await redis_db.xadd("publicTrade:MULTI1", {"p": "3"}, id="3-0")
+        assert (await asyncio.wait_for(subscriber.get(), 1)).stream == "publicTrade:MULTI1"
+    await hub.close()
@@ -0,0 +1,9 @@
+import json
+from app.db.consumer.hub import StreamEntry
+from app.db.consumer.trades import make_data_package
+from helpers import make_raw_entries
+
+
+def test_encoded_package_matches_current_path():
+    raw_id, raw_fields = make_raw_entries(1)[0]
+    assert json.loads(StreamEntry(raw_id, raw_fields).package) == make_data_package("data", raw_fields, raw_id.decode())
@@ -0,0 +1,189 @@
+import asyncio
+import functools
+import json
+import fakeredis
+import pytest
+from app.db.consumer import trades
+from app.db.consumer.hub import TradesHub
+from app.db.consumer.views import make_trade_view
+from app.metrics import SEND_LAG
+from helpers import make_conn_manager
+
+
+@pytest.mark.asyncio
+async def test_consumer_replays_then_follows_live(monkeypatch):
+    """the cached entries are replayed once and the live entries follow without gaps or duplicates"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for n in range(1, 4):
+        await redis_db.xadd("publicTrade:LIVE", {"p": str(n)}, id=f"{n}-0")
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    consumer = trades.multi_trades_consumer({"publicTrade:LIVE": "0"})
+    received = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:LIVE", {"p": "4"}, id="4-0")
+        elif package["type"] == "data":
+            received.append(package["data"]["p"])
+            if len(received) == 4:
+                break
+    await consumer.aclose()
+    assert received == ["1", "2", "3", "4"]
+
+
+@pytest.mark.asyncio
+async def test_long_replay_is_no_slow_consumer(monkeypatch):
+    """live entries that overflow the queue during the replay are read from redis, without a disconnect"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for n in range(1, 4):
+        await redis_db.xadd("publicTrade:LONG", {"p": str(n)}, id=f"{n}-0")
+    hub = TradesHub(make_conn_manager(redis_db), block_ms=100)
+    monkeypatch.setattr(hub, "subscribe", functools.partial(hub.subscribe, maxsize=2, policy="disconnect"))
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", hub)
+
+    consumer = trades.multi_trades_consumer({"publicTrade:LONG": "0"})
+    received = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:LONG", {"p": "9"}, id="9-0")
+        elif package["type"] == "info":
+            assert not package["msg"].startswith("disconnected")
+        elif package["type"] == "data":
+            received.append(package["data"]["p"])
+            if received == ["1"]:
+                # the replay is slow, the live entries overflow the queue
+                for n in range(4, 9):
+                    await redis_db.xadd("publicTrade:LONG", {"p": str(n)}, id=f"{n}-0")
+                while hub.tails["publicTrade:LONG"].entries_read < 5:
+                    await asyncio.sleep(0.01)
+            if len(received) == 9:
+                break
+    await consumer.aclose()
+    assert received == [str(n) for n in range(1, 10)]
+
+
+@pytest.mark.asyncio
+async def test_consumer_batches(monkeypatch):
+    """with a batch size the trades are send as lists, both during the replay and live"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for n in range(1, 4):
+        await redis_db.xadd("publicTrade:BATCH", {"p": str(n)}, id=f"{n}-0")
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    consumer = trades.multi_trades_consumer({"publicTrade:BATCH": "0"}, batch_size=2, batch_delay_ms=200)
+    batches = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            for n in range(4, 7):
+                await redis_db.xadd("publicTrade:BATCH", {"p": str(n)}, id=f"{n}-0")
+        elif package["type"] == "data":
+            batches.append([trade["p"] for trade in package["data"]])
+            if sum(len(batch) for batch in batches) == 6:
+                break
+    await consumer.aclose()
+    assert batches == [["1", "2"], ["3"], ["4", "5"], ["6"]]
+
+
+@pytest.mark.asyncio
+async def test_consumer_resumes_after_last_id(monkeypatch):
+    """a reconnecting client gets exactly the entries after the id of its last package, replayed and live"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for n in range(1, 4):
+        await redis_db.xadd("publicTrade:RESUME", {"p": str(n)}, id=f"5-{n}")
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    consumer = trades.multi_trades_consumer({"publicTrade:RESUME": "(5-1"})
+    received = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:RESUME", {"p": "4"}, id="6-0")
+        elif package["type"] == "data":
+            received.append((package["stream"], package["id"], package["data"]["p"]))
+            if len(received) == 3:
+                break
+    await consumer.aclose()
+    assert received == [("publicTrade:RESUME", "5-2", "2"), ("publicTrade:RESUME", "5-3", "3"), ("publicTrade:RESUME", "6-0", "4")]
+
+
+@pytest.mark.asyncio
+async def test_multi_stream_consumer_merges_the_replay(monkeypatch):
+    """the cached entries of several streams are replayed in timestamp order, live entries follow tagged with their stream"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for stream, ids in (("publicTrade:M1", ["1-0", "4-0", "5-0"]), ("publicTrade:M2", ["2-0", "3-0", "6-0"])):
+        for entry_id in ids:
+            await redis_db.xadd(stream, {"p": entry_id}, id=entry_id)
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    # M1 resumes after 1-0, M2 starts at 3 ms
+    consumer = trades.multi_trades_consumer({"publicTrade:M1": "(1-0", "publicTrade:M2": "3"}, batch_size=2, merge=True)
+    packages = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:M2", {"p": "7-0"}, id="7-0")
+        elif package["type"] == "data":
+            packages.append((package["stream"], package["id"], [trade["p"] for trade in package["data"]]))
+            if package["id"] == "7-0":
+                await redis_db.xadd("publicTrade:M1", {"p": "8-0"}, id="8-0")
+            elif package["id"] == "8-0":
+                break
+    await consumer.aclose()
+    assert packages == [
+        ("publicTrade:M2", "3-0", ["3-0"]),
+        ("publicTrade:M1", "5-0", ["4-0", "5-0"]),
+        ("publicTrade:M2", "6-0", ["6-0"]),
+        ("publicTrade:M2", "7-0", ["7-0"]),
+        ("publicTrade:M1", "8-0", ["8-0"]),
+    ]
+    # the lag is observed once the live package is send
+    assert SEND_LAG.labels("publicTrade:M2").count == 1
+
+
+@pytest.mark.asyncio
+async def test_consumer_downsamples(monkeypatch):
+    """a downsampled subscription gets the last trade per interval, the pending interval is send when no trades follow"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    for ms in (1000, 1050, 1100, 1150):
+        await redis_db.xadd("publicTrade:SAMPLE", {"p": str(ms), "S": "Buy"}, id=f"{ms}-0")
+    await redis_db.xadd("publicTrade:SAMPLE", {"p": "1160", "S": "Sell"}, id="1160-0")
+    monkeypatch.setattr(trades, "redis_conn_manager", make_conn_manager(redis_db))
+    monkeypatch.setattr(trades, "trades_hub", TradesHub(make_conn_manager(redis_db), block_ms=100))
+
+    view = make_trade_view({"side": "Buy"}, {"mode": "latest", "interval_ms": 100})
+    consumer = trades.multi_trades_consumer({"publicTrade:SAMPLE": "0"}, view=view)
+    received = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:SAMPLE", {"p": "1210", "S": "Buy"}, id="1210-0")
+        elif package["type"] == "data":
+            received.append(package["data"]["p"])
+            if len(received) == 3:
+                break
+    await consumer.aclose()
+    assert received == ["1050", "1150", "1210"]
+
+    # a trade of an interval that was already send on idle is folded into the next interval
+    view = make_trade_view(None, {"mode": "aggregate", "interval_ms": 100})
+    consumer = trades.multi_trades_consumer({"publicTrade:SAMPLE": "(1210-0"}, view=view)
+    aggregates = []
+    async for encoded in consumer:
+        package = json.loads(encoded)
+        if package["type"] == "info" and package["msg"] == "wait for new data":
+            await redis_db.xadd("publicTrade:SAMPLE", {"p": "1220", "v": "1"}, id="1220-0")
+        elif package["type"] == "data":
+            aggregates.append((package["data"]["t"], package["data"]["c"]))
+            if len(aggregates) == 2:
+                break
+            await redis_db.xadd("publicTrade:SAMPLE", {"p": "1230", "v": "1"}, id="1230-0")
+    await consumer.aclose()
+    assert aggregates == [(1200, 1220.0), (1300, 1230.0)]
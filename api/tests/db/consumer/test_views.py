@@ -0,0 +1,45 @@
+import json
+from app.db.consumer.views import Downsampler, TradeFilter, TradeView, make_trade_view
+from helpers import make_entry
+
+
+def test_filter():
+    trades = [
+        make_entry(1, side="Sell", size="2"),
+        make_entry(2, size="0.5", price="100"),
+        make_entry(3, size="2", price="100", block="1"),
+        make_entry(4, size="2", price="10"),
+    ]
+    assert [e.id for e in TradeView(TradeFilter(side="Buy")).process(trades)] == ["2-0", "3-0", "4-0"]
+    assert [e.id for e in TradeView(TradeFilter(min_size=1)).process(trades)] == ["1-0", "3-0", "4-0"]
+    assert [e.id for e in TradeView(TradeFilter(min_notional=50)).process(trades)] == ["1-0", "2-0", "3-0"]
+    assert [e.id for e in TradeView(TradeFilter(block_trade=True)).process(trades)] == ["3-0"]
+    assert [e.id for e in TradeView(TradeFilter(side="Buy", min_size=1, block_trade=False)).process(trades)] == ["4-0"]
+
+
+def test_downsample_latest():
+    view = TradeView(sampler=Downsampler("latest", 100))
+    trades = [make_entry(ms) for ms in (1000, 1050, 1099, 1100, 1250, 1260)]
+    samples = view.process(trades)
+    # the last trade of every complete interval, the entries themselves
+    assert samples == [trades[2], trades[3]]
+    assert view.idle_timeout == 0.1
+    assert view.flush() == [trades[5]]
+    assert view.idle_timeout is None
+    # a later trade of the flushed interval starts the next one
+    assert view.process([make_entry(1280)]) == []
+    assert view.sampler.pending["publicTrade:BTCUSDT"][0] == 13
+
+
+def test_downsample_aggregate():
+    view = make_trade_view(None, {"mode": "aggregate", "interval_ms": 1000})
+    trades = [make_entry(1000, size="1", price="10"), make_entry(1500, size="2", price="12"),
+              make_entry(1999, size="3", price="9"), make_entry(2000, size="1", price="11")]
+    [sample] = view.process(trades)
+    assert sample.id == "1999-0"  # a resume cursor after the interval
+    assert json.loads(sample.package)["data"] == {
+        "t": 1000, "s": "BTCUSDT", "o": 10.0, "h": 12.0, "l": 9.0, "c": 9.0, "v": 6.0, "n": 3,
+    }
+    [pending] = view.flush()
+    assert (pending.fields["t"], pending.fields["n"], pending.fields["c"]) == (2000, 1, 11.0)
+    assert make_trade_view(None, None) is None
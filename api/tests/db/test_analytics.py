@@ -0,0 +1,90 @@
+import math
+import fakeredis
+import numpy as np
+import pytest
+from app.db.analytics import TradeAnalytics, analyze_trades, iter_trade_records
+from app.db.producer.trades import TradesStreamWriter
+from helpers import make_trade
+
+TRADES = 5_000
+
+
+def make_trades(count: int) -> list[dict]:
+    rng = np.random.default_rng(1)
+    prices = 42000 * np.exp(np.cumsum(rng.normal(0, 1e-4, count)))
+    sizes = rng.exponential(0.01, count)
+    sizes[::1000] = 5  # a few whales
+    return [
+        make_trade(1705072083137 + n // 4, trade_id=f"trade-{n}", size=repr(float(sizes[n])), side="Sell" if n % 3 == 0 else "Buy",
+                   price=repr(float(prices[n])))
+        for n in range(count)
+    ]
+
+
+def reference(trades: list[dict]) -> dict:
+    """the statistics in plain python, one trade at a time"""
+    volume = sum(float(t["v"]) for t in trades)
+    buy = sum(float(t["v"]) for t in trades if t["S"] == "Buy")
+    notional = sum(float(t["p"]) * float(t["v"]) for t in trades)
+    returns = [math.log(float(b["p"]) / float(a["p"])) for a, b in zip(trades, trades[1:])]
+    return {
+        "count": len(trades), "volume": volume, "buy_volume": buy, "imbalance": (2 * buy - volume) / volume,
+        "vwap": notional / volume, "realized_volatility": math.sqrt(sum(r * r for r in returns)),
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage_format", ["fields", "columnar"])
+async def test_analytics_match_reference(storage_format):
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:BTCUSDT", storage_format=storage_format)
+    trades = make_trades(TRADES)
+    writer.add([dict(trade) for trade in trades])
+    await writer.flush(force=True)
+
+    chunk_sizes = [len(records) async for records in iter_trade_records(
+        redis_db, "publicTrade:BTCUSDT", chunk_size=700, storage_format=storage_format)]
+    assert sum(chunk_sizes) == TRADES
+    assert storage_format == "columnar" or max(chunk_sizes) == 700
+
+    analytics = TradeAnalytics(large_trade_size=1)
+    async for records in iter_trade_records(redis_db, "publicTrade:BTCUSDT", chunk_size=700, storage_format=storage_format):
+        analytics.update(records)
+    result = analytics.result()
+    for key, value in reference(trades).items():
+        assert result[key] == pytest.approx(value, rel=1e-9), key
+    assert [trade["T"] for trade in result["large_trades"]] == [trades[n]["T"] for n in range(0, TRADES, 1000)]
+    assert result["open"] == float(trades[0]["p"]) and result["close"] == float(trades[-1]["p"])
+
+
+@pytest.mark.asyncio
+async def test_analytics_of_time_range():
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:BTCUSDT")
+    trades = make_trades(TRADES)
+    writer.add([dict(trade) for trade in trades])
+    await writer.flush()
+
+    start, end = trades[1000]["T"], trades[2000]["T"]
+    selection = [trade for trade in trades if start <= trade["T"] <= end]
+    result = await analyze_trades(redis_db, "publicTrade:BTCUSDT", start, end, chunk_size=333, max_large_trades=1)
+    assert result["count"] == len(selection)
+    assert result["vwap"] == pytest.approx(reference(selection)["vwap"])
+    assert len(result["large_trades"]) == 1 and result["large_trades"][0]["v"] == 5
+
+    empty = await analyze_trades(redis_db, "publicTrade:BTCUSDT", 0, 1)
+    assert empty["count"] == 0 and empty["vwap"] is None
+
+
+@pytest.mark.asyncio
+async def test_large_trade_with_unknown_side():
+    """a side the columnar chunks don't know is stored as `UNKNOWN`"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:BTCUSDT", storage_format="columnar")
+    writer.add([make_trade(1, size="5", side="Unknown")])
+    await writer.flush(force=True)
+
+    analytics = TradeAnalytics(large_trade_size=1)
+    async for records in iter_trade_records(redis_db, "publicTrade:BTCUSDT", storage_format="columnar"):
+        analytics.update(records)
+    assert analytics.result()["large_trades"] == [{"T": 1, "p": 42000.1, "v": 5.0, "S": ""}]
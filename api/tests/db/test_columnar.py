@@ -0,0 +1,36 @@
+import fakeredis
+import numpy as np
+import pytest
+from app.db.columnar import decode_chunk, decode_trade_ids, encode_trades, read_trades_columnar, records_to_dicts
+from app.db.producer.trades import TradesStreamWriter
+from helpers import make_chunk_trades
+
+
+@pytest.mark.parametrize("uuid_ids", [True, False])
+def test_chunk_roundtrip(uuid_ids):
+    trades = make_chunk_trades(100, uuid_ids)
+    fields = encode_trades(trades)
+    records = decode_chunk(fields)
+    assert len(records) == fields["n"] == 100
+    assert records["T"].tolist() == [trade["T"] for trade in trades]
+    assert np.allclose(records["p"], [float(trade["p"]) for trade in trades])
+    ids = decode_trade_ids(records, fields)
+    assert ids == [trade["i"] for trade in trades]
+    decoded = records_to_dicts(records, ids, "BTCUSDT")
+    assert [(d["S"], d["L"], d["BT"]) for d in decoded] == [(t["S"], t["L"], int(t["BT"])) for t in trades]
+
+
+@pytest.mark.asyncio
+async def test_writer_stores_chunks():
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:COLUMNAR", storage_format="columnar")
+    writer.chunks.chunk_size = 40
+    writer.add(make_chunk_trades(100))
+    await writer.flush(force=True)
+    assert not await redis_db.exists("publicTrade:COLUMNAR")
+    assert await redis_db.xlen("publicTradeChunk:COLUMNAR") == 3
+
+    records = await read_trades_columnar(redis_db, "publicTrade:COLUMNAR", 1705072083138, 1705072083140)
+    assert len(records) == 30
+    assert records["T"].min() == 1705072083138
+    assert records["T"].max() == 1705072083140
@@ -0,0 +1,58 @@
+from contextlib import asynccontextmanager
+import csv
+import io
+import json
+import fakeredis
+import pyarrow as pa
+import pytest
+from app.db import export
+
+
+async def make_stream(monkeypatch, count: int = 25) -> fakeredis.FakeAsyncRedis:
+    redis_db = fakeredis.FakeAsyncRedis()
+    for n in range(count):
+        await redis_db.xadd("publicTrade:EXPORT", {
+            "T": 1000 + n // 2, "s": "EXPORT", "S": "Buy", "v": "0.5", "p": f"{100 + n}", "L": "PlusTick", "i": f"id-{n}", "BT": 0,
+        }, id=f"{1000 + n // 2}-{n % 2}")
+
+    @asynccontextmanager
+    async def conn_manager():
+        yield redis_db
+    monkeypatch.setattr(export, "redis_conn_manager", conn_manager)
+    return redis_db
+
+
+async def collect(exporter, chunks) -> list:
+    return [part async for part in exporter(chunks)]
+
+
+@pytest.mark.asyncio
+async def test_pages_with_cursor(monkeypatch):
+    """a range read in pages of `limit` rows, every next page starts after the last id of the previous one"""
+    await make_stream(monkeypatch)
+    rows, cursor = [], None
+    while True:
+        chunks = export.iter_entry_chunks("publicTrade:EXPORT", 1001, 1010, cursor=cursor, limit=6, chunk_size=4)
+        page = [json.loads(line) for part in await collect(export.export_ndjson, chunks) for line in part.splitlines()]
+        rows += page
+        if len(page) < 6:
+            break
+        cursor = page[-1]["id"]
+    assert [row["id"] for row in rows] == [f"{1000 + n // 2}-{n % 2}" for n in range(2, 22)]
+    assert rows[0] == {"id": "1001-0", "T": "1001", "s": "EXPORT", "S": "Buy", "v": "0.5", "p": "102", "L": "PlusTick", "i": "id-2", "BT": "0"}
+
+
+@pytest.mark.asyncio
+async def test_csv_and_arrow(monkeypatch):
+    await make_stream(monkeypatch)
+    parts = await collect(export.export_csv, export.iter_entry_chunks("publicTrade:EXPORT", chunk_size=10))
+    assert len(parts) == 4  # the header and a part per chunk
+    rows = list(csv.DictReader(io.StringIO("".join(parts))))
+    assert len(rows) == 25
+    assert rows[-1]["id"] == "1012-0" and rows[-1]["p"] == "124"
+
+    parts = await collect(export.export_arrow, export.iter_entry_chunks("publicTrade:EXPORT", chunk_size=10))
+    table = pa.ipc.open_stream(b"".join(parts)).read_all()
+    assert table.schema == export.ARCHIVE_SCHEMA
+    assert table.num_rows == 25
+    assert table.column("p").to_pylist()[:3] == [100.0, 101.0, 102.0]
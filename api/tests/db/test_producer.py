@@ -0,0 +1,120 @@
+import fakeredis
+import pytest
+from app.db.producer.trades import TradesStreamWriter
+from helpers import make_trade
+
+
+def make_trades(timestamps: list[int]) -> list[dict]:
+    return [make_trade(ts, trade_id=f"id-{n}") for n, ts in enumerate(timestamps)]
+
+
+@pytest.mark.asyncio
+async def test_writer_assigns_sequential_ids():
+    """trades with the same timestamp should get an increasing suffix"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:BTCUSDT", max_latency_ms=0)
+    writer.add(make_trades([1705072083137, 1705072083137, 1705072083138]))
+    assert await writer.flush() == 3
+
+    entries = await redis_db.xrange("publicTrade:BTCUSDT")
+    assert [entry[0] for entry in entries] == [b"1705072083137-0", b"1705072083137-1", b"1705072083138-0"]
+    assert entries[0][1][b"BT"] == b"0"
+
+
+@pytest.mark.asyncio
+async def test_writer_batches_and_stats():
+    """a flush is split in pipelines of at most `max_batch_size` entries"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:ETHUSDT", max_batch_size=2, max_latency_ms=50)
+    writer.add(make_trades([1, 2, 3]))
+    assert writer.due
+    await writer.flush()
+    assert writer.stats.flushes == 2
+    assert writer.stats.entries == 3
+    assert writer.stats.max_batch_size == 2
+    assert writer.time_to_flush() is None
+    assert await redis_db.xlen("publicTrade:ETHUSDT") == 3
+
+
+@pytest.mark.asyncio
+async def test_writer_waits_for_flush_window():
+    """within the flush window the buffer is not due until it is full"""
+    writer = TradesStreamWriter(fakeredis.FakeAsyncRedis(), "publicTrade:SOLUSDT", max_batch_size=10, max_latency_ms=10_000)
+    writer.add(make_trades([1]))
+    assert not writer.due
+    assert 0 < writer.time_to_flush() <= 10
+
+
+@pytest.mark.asyncio
+async def test_writer_skips_older_trades():
+    writer = TradesStreamWriter(fakeredis.FakeAsyncRedis(), "publicTrade:OPUSDT", last_id="100-0")
+    writer.add(make_trades([99, 100]))
+    assert [new_id for new_id, _ in writer.buffer] == ["100-1"]
+
+
+@pytest.mark.asyncio
+async def test_writer_drops_rejected_trades():
+    """trades redis rejects (here: already written by another process) are counted, not retried"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    await redis_db.xadd("publicTrade:ARBUSDT", {"i": "other"}, id="5-0")
+    writer = TradesStreamWriter(redis_db, "publicTrade:ARBUSDT", max_latency_ms=0)
+    writer.add(make_trades([3, 6]))
+    assert await writer.flush() == 1
+    assert writer.stats.rejected == 1
+    assert not writer.buffer
+
+    writer.add(make_trades([7]))
+    assert await writer.flush() == 1
+    assert [entry[0] for entry in await redis_db.xrange("publicTrade:ARBUSDT")] == [b"5-0", b"6-0", b"7-0"]
+
+
+@pytest.mark.asyncio
+async def test_writer_retries_after_connection_error(monkeypatch):
+    """a failed pipeline keeps the batch buffered, the retry writes every trade (and chunk) once"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:XRPUSDT", max_latency_ms=0, storage_format="both")
+    writer.add(make_trades([1, 2, 3]))
+    pipeline = redis_db.pipeline
+
+    def failing_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+
+        async def execute(raise_on_error=True):
+            raise ConnectionError("connection lost")
+        pipe.execute = execute
+        return pipe
+
+    monkeypatch.setattr(redis_db, "pipeline", failing_pipeline)
+    with pytest.raises(ConnectionError):
+        await writer.flush(force=True)
+    assert len(writer.buffer) == 3
+    assert writer.chunks.buffer == []
+
+    monkeypatch.setattr(redis_db, "pipeline", pipeline)
+    assert await writer.flush(force=True) == 3
+    assert await redis_db.xlen("publicTrade:XRPUSDT") == 3
+    [(_, chunk)] = await redis_db.xrange(writer.chunk_stream_name)
+    assert chunk[b"n"] == b"3"
+
+
+@pytest.mark.asyncio
+async def test_rejected_chunk_counts_its_own_trades():
+    """a rejected chunk drops the trades buffered by earlier flushes too, they aren't subtracted from this batch"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:LDOUSDT", max_latency_ms=0, storage_format="columnar")
+    writer.chunks.chunk_size, writer.chunks.max_age_ms = 4, 10**6
+    writer.add(make_trades([1, 2, 3]))
+    assert await writer.flush() == 3
+    await redis_db.xadd(writer.chunk_stream_name, {"n": 1}, id="10-0")
+    writer.add(make_trades([4, 5]))
+    assert await writer.flush() == 1  # the chunk of 1-4 is rejected, 5 waits for the next chunk
+    assert writer.stats.rejected == 4
+
+
+@pytest.mark.asyncio
+async def test_candle_series_errors_drop_no_trades():
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:NOCANDLES", max_latency_ms=0, timeseries_symbol="NOCANDLES")
+    writer.add(make_trades([1, 2]))
+    assert await writer.flush() == 2  # the series of the symbol don't exist
+    assert writer.stats.rejected == 0
@@ -0,0 +1,72 @@
+import os
+import fakeredis
+import pytest
+from app.db.archive import read_trades, watermark_key
+from app.db.columnar import ColumnarChunkBuffer
+from app.db.producer.trades import TradesStreamWriter
+from app.db.retention import RetentionWorker
+from helpers import make_trade
+
+HOUR = 3600 * 1000
+START = 1705071600000  # 2024-01-12 15:00 UTC
+
+
+def make_trades(timestamps: list[int]) -> list[dict]:
+    return [
+        make_trade(ts, trade_id=f"id-{n}", size="0.5", side="Buy" if n % 2 else "Sell", price=f"{42000 + n}.5")
+        for n, ts in enumerate(timestamps)
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage_format", ["fields", "columnar"])
+async def test_retention_archives_before_trimming(tmp_path, storage_format):
+    """entries older than the window end up in hourly parquet files, the query layer serves both tiers"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:BTCUSDT", storage_format=storage_format)
+    if writer.chunks is not None:
+        writer.chunks = ColumnarChunkBuffer(chunk_size=5)
+    # 3 trades every 10 minutes during 3 hours, 2 in the same millisecond
+    timestamps = sorted([START + n * 600_000 for n in range(18)] * 2 + [START + n * 600_000 + 1 for n in range(18)])
+    writer.add(make_trades(timestamps))
+    await writer.flush(force=True)
+
+    worker = RetentionWorker(redis_db, window_ms=HOUR, archive_dir=str(tmp_path), batch_size=7, storage_format=storage_format)
+    await worker.run_once(now_ms=START + 3 * HOUR)
+    hot_stream = "publicTradeChunk:BTCUSDT" if storage_format == "columnar" else "publicTrade:BTCUSDT"
+    assert worker.stats.errors == 0
+    assert worker.stats.trimmed > 0
+    assert sorted(os.listdir(tmp_path / "symbol=BTCUSDT")) == ["hour=2024011215", "hour=2024011216"]
+    assert await redis_db.get(watermark_key(hot_stream)) is not None
+
+    columnar = storage_format == "columnar"
+    trades = await read_trades(redis_db, "publicTrade:BTCUSDT", archive_dir=str(tmp_path), columnar=columnar)
+    assert trades["T"].tolist() == timestamps
+    assert trades["i"].tolist() == [f"id-{n}" for n in range(len(timestamps))]
+    assert trades["p"].iloc[1] == 42001.5
+
+    # a range across the archive and redis
+    part = await read_trades(redis_db, "publicTrade:BTCUSDT", START + HOUR + 1, START + 2 * HOUR + 1, str(tmp_path), columnar)
+    assert part["T"].tolist() == [ts for ts in timestamps if START + HOUR + 1 <= ts <= START + 2 * HOUR + 1]
+
+    # the first trades, from the archive only, and across the archive and redis
+    for limit in (5, 40, 100):
+        first = await read_trades(redis_db, "publicTrade:BTCUSDT", archive_dir=str(tmp_path), columnar=columnar, limit=limit)
+        assert first["T"].tolist() == timestamps[:limit]
+
+    # the next run has nothing new to archive
+    archived = worker.stats.archived
+    await worker.run_once(now_ms=START + 3 * HOUR)
+    assert worker.stats.archived == archived
+
+
+@pytest.mark.asyncio
+async def test_retention_without_archive(tmp_path):
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = TradesStreamWriter(redis_db, "publicTrade:ETHUSDT")
+    writer.add(make_trades([START, START + 1, START + HOUR]))
+    await writer.flush()
+    worker = RetentionWorker(redis_db, window_ms=HOUR, archive=False, archive_dir=str(tmp_path))
+    assert await worker.apply("publicTrade:ETHUSDT", now_ms=START + HOUR + 2) == 2
+    assert await redis_db.xlen("publicTrade:ETHUSDT") == 1
+    assert not os.listdir(tmp_path)
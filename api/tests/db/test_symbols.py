@@ -0,0 +1,35 @@
+import fakeredis
+import pytest
+from app.db.symbols import ENABLED_KEY
+from helpers import FakeInstrumentsSession, make_registry
+
+
+@pytest.mark.asyncio
+async def test_refresh_follows_the_pages():
+    redis_db = fakeredis.FakeAsyncRedis()
+    session = FakeInstrumentsSession()
+    registry = make_registry(redis_db, session)
+    assert await registry.refresh() == 7
+    assert [request["cursor"] for request in session.requests] == ["", "3", "6"]
+    instruments = await registry.instruments()
+    assert sorted(instruments) == ["1000PEPEUSDT", "ARBUSDT", "BTCUSDT", "ETHUSDT", "NEWUSDT", "OPUSDT", "SOLUSDT"]
+    assert (await registry.get("NEWUSDT"))["status"] == "PreLaunch"
+
+    # another process doesn't refresh within the interval, unless forced
+    other = make_registry(redis_db, session)
+    assert await other.refresh() == 0
+    assert await other.refresh(force=True) == 7
+    assert len(session.requests) == 6
+
+
+@pytest.mark.asyncio
+async def test_seeded_once():
+    redis_db = fakeredis.FakeAsyncRedis()
+    registry = make_registry(redis_db)
+    await registry.seed(["BTCUSDT", "ETHUSDT"])
+    await registry.disable("ETHUSDT")
+    await registry.enable("SOLUSDT")
+    # a restart doesn't bring back the disabled symbols
+    await make_registry(redis_db).seed(["BTCUSDT", "ETHUSDT"])
+    assert await registry.enabled() == ["BTCUSDT", "SOLUSDT"]
+    assert await redis_db.scard(ENABLED_KEY) == 2
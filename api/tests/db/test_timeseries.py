@@ -0,0 +1,54 @@
+import fakeredis
+from fastapi import HTTPException
+import pytest
+from app.db.producer.trades import create_trades_writer
+from app.db.timeseries import candle_key, ensure_candle_series, get_candles
+from app.routers import candles as candles_router
+
+
+def make_trade(ts: int, price: str, size: str, trade_id: str) -> dict:
+    return {"T": ts, "s": "BTCUSDT", "S": "Buy", "v": size, "p": price, "L": "PlusTick", "i": trade_id, "BT": False}
+
+
+@pytest.mark.asyncio
+async def test_writer_feeds_candles():
+    """closed buckets come from the compaction rules, the open bucket is aggregated from the raw series"""
+    redis_db = fakeredis.FakeAsyncRedis()
+    writer = await create_trades_writer(redis_db, "publicTrade:BTCUSDT", max_latency_ms=0)
+    assert writer.timeseries_symbol == "BTCUSDT"
+    writer.add([
+        make_trade(1000, "10", "1", "a"),
+        make_trade(1500, "12", "2", "b"),
+        make_trade(1500, "11", "1", "c"),  # same millisecond: last price, summed size
+        make_trade(1900, "9", "1", "d"),
+        make_trade(2100, "20", "5", "e"),
+    ])
+    await writer.flush()
+
+    # only the first bucket is closed
+    assert len(await redis_db.execute_command("TS.RANGE", candle_key("BTCUSDT", "1s", "open"), 0, "+")) == 1
+
+    candles = await get_candles(redis_db, "BTCUSDT", "1s")
+    assert candles == [
+        {"t": 1000, "open": 10.0, "high": 11.0, "low": 9.0, "close": 9.0, "volume": 5.0},
+        {"t": 2000, "open": 20.0, "high": 20.0, "low": 20.0, "close": 20.0, "volume": 5.0},
+    ]
+    assert await get_candles(redis_db, "BTCUSDT", "1m", 0, 59_999) == [
+        {"t": 0, "open": 10.0, "high": 20.0, "low": 9.0, "close": 20.0, "volume": 10.0},
+    ]
+    assert await get_candles(redis_db, "BTCUSDT", "1s", 2000, 2999) == candles[1:]
+
+
+@pytest.mark.asyncio
+async def test_ensure_candle_series_is_idempotent():
+    redis_db = fakeredis.FakeAsyncRedis()
+    assert await ensure_candle_series(redis_db, "ETHUSDT")
+    assert await ensure_candle_series(redis_db, "ETHUSDT")
+
+
+@pytest.mark.asyncio
+async def test_unknown_symbol_has_no_candles():
+    redis_db = fakeredis.FakeAsyncRedis()
+    with pytest.raises(HTTPException) as e:
+        await candles_router.candles(symbol="UNKNOWNUSDT", interval="1m", start_timestamp=0, end_timestamp="+", redis_db=redis_db)
+    assert e.value.status_code == 404
@@ -1,5 +1,5 @@
 import pytest
-from app.db.utils import sort_stream
+from app.db.utils import close_redis_pool, get_redis_pool_stats, init_redis_pool, redis_conn_manager, sort_stream
 from app.errors import KeyTypeError
 
 
@@ -62,4 +62,24 @@ async def test_sort_stream_type_inconsistency():
     ]
     with pytest.raises(KeyTypeError):
         await sort_stream(raw_data)
-    
\ No newline at end of file
+    
+
+@pytest.mark.asyncio
+async def test_redis_pool_reuses_connections(fake_redis_server):
+    """borrowing a client from the pool should not open a new connection per call"""
+    calls = 300
+    try:
+        pool = await init_redis_pool(max_connections=10)
+        for _ in range(calls):
+            async with redis_conn_manager() as redis_db:
+                await redis_db.ping()
+        connection = await pool.get_connection()
+        in_use = get_redis_pool_stats()["in_use"]
+        await pool.release(connection)
+        stats = get_redis_pool_stats()
+    finally:
+        await close_redis_pool()
+
+    assert stats["created"] == 1
+    assert stats["acquired"] == calls + 1
+    assert (in_use, stats["in_use"], stats["idle"]) == (1, 0, 1)
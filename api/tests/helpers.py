@@ -0,0 +1,92 @@
+"""Factories and fakes shared by the test modules, on the path through the pytest `pythonpath` setting"""
+import asyncio
+from contextlib import asynccontextmanager
+import json
+from pathlib import Path
+import uuid
+from app.db.consumer.hub import StreamEntry
+from app.db.symbols import BybitInstruments, SymbolRegistry
+
+
+def make_trade(
+    ts: int, symbol: str = "BTCUSDT", trade_id: str | None = None, size: str = "0.001", side: str = "Buy", price: str = "42000.10",
+) -> dict:
+    """a trade as found in the `data` list of a bybit `publicTrade` frame"""
+    return {
+        "T": ts, "s": symbol, "S": side, "v": size, "p": price,
+        "L": "PlusTick", "i": trade_id or f"{symbol}-{ts}", "BT": False,
+    }
+
+
+INSTRUMENTS_FIXTURE = Path(__file__).parent / "fixtures" / "bybit_instruments_linear.json"
+
+
+class FakeInstrumentsSession:
+    """offline stand-in for the pybit session, serves the recorded instruments in pages"""
+
+    def __init__(self, page_size: int = 3):
+        self.response = json.loads(INSTRUMENTS_FIXTURE.read_text())
+        self.page_size = page_size
+        self.requests = []
+
+    def get_instruments_info(self, **kwargs):
+        self.requests.append(kwargs)
+        start = int(kwargs.get("cursor") or 0)
+        instruments = self.response["result"]["list"]
+        end = start + self.page_size
+        return {**self.response, "result": {
+            "category": kwargs["category"], "list": instruments[start: end], "nextPageCursor": str(end) if end < len(instruments) else "",
+        }}
+
+
+def make_registry(redis_db, session: FakeInstrumentsSession | None = None, **kwargs) -> SymbolRegistry:
+    return SymbolRegistry(redis_db, BybitInstruments(session or FakeInstrumentsSession()), **kwargs)
+
+
+def make_conn_manager(redis_db):
+    """a `redis_conn_manager` that yields `redis_db`, e.g. a fakeredis"""
+    @asynccontextmanager
+    async def conn_manager():
+        yield redis_db
+    return conn_manager
+
+
+async def wait_for_length(redis_db, stream_name: str, length: int, timeout: float = 2) -> None:
+    async def written():
+        while await redis_db.xlen(stream_name) < length:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(written(), timeout)
+
+
+def make_raw_entries(count: int) -> list[tuple[bytes, dict]]:
+    """stream entries as returned by redis, one second of trades at 10k msgs/s"""
+    return [
+        (
+            f"{1705072083137 + n // 10}-{n % 10}".encode(),
+            {
+                b"T": str(1705072083137 + n // 10).encode(), b"s": b"BTCUSDT", b"S": b"Buy", b"v": b"0.001",
+                b"p": b"42000.10", b"L": b"PlusTick", b"i": f"20f43950-d8dd-5b31-9112-{n:012d}".encode(), b"BT": b"0",
+            },
+        )
+        for n in range(count)
+    ]
+
+
+def make_entry(ms: int, seq: int = 0, side: str = "Buy", size: str = "0.001", price: str = "42000.10", block: str = "0") -> StreamEntry:
+    """a hub entry of the `publicTrade:BTCUSDT` stream"""
+    return StreamEntry(f"{ms}-{seq}".encode(), {
+        b"T": str(ms).encode(), b"s": b"BTCUSDT", b"S": side.encode(), b"v": size.encode(), b"p": price.encode(),
+        b"L": b"PlusTick", b"i": f"20f43950-d8dd-5b31-9112-{ms:08d}{seq:04d}".encode(), b"BT": block.encode(),
+    }, "publicTrade:BTCUSDT")
+
+
+def make_chunk_trades(count: int, uuid_ids: bool = True) -> list[dict]:
+    """trades with varying sides, prices and block flags, ten per millisecond"""
+    return [
+        {
+            "T": 1705072083137 + n // 10, "s": "BTCUSDT", "S": "Buy" if n % 3 else "Sell", "v": "0.001",
+            "p": f"{42000 + n % 100 / 10:.2f}", "L": "PlusTick", "BT": n % 50 == 0,
+            "i": str(uuid.UUID(int=n + 1)) if uuid_ids else f"trade-{n}",
+        }
+        for n in range(count)
+    ]
@@ -0,0 +1,39 @@
+import time
+import fakeredis
+import pytest
+from app.db.producer.trades import TradesStreamWriter
+from app.metrics import REGISTRY, TRADES_INGESTED, Counter, Histogram, Registry
+from helpers import make_trade
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Handled requests", ("path",)))
+    latency = registry.register(Histogram("latency_seconds", "Request latency", buckets=(0.1, 1.0)))
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Handled requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 3',
+        "# HELP latency_seconds Request latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_writer_counts_ingested_trades():
+    writer = TradesStreamWriter(fakeredis.FakeAsyncRedis(), "publicTrade:METRICUSDT")
+    writer.add([make_trade(int(time.time() * 1000), "METRICUSDT", str(n)) for n in range(3)])
+    await writer.flush()
+    assert TRADES_INGESTED.labels("METRICUSDT").value == 3
+    text = REGISTRY.render()
+    assert 'trades_ingested_total{symbol="METRICUSDT"} 3' in text
+    assert 'trades_ingest_lag_seconds_count{symbol="METRICUSDT"} 1' in text
@@ -0,0 +1,27 @@
+import pytest
+from pydantic import ValidationError
+from app.websocket.models import TradesStreamModel
+
+
+def test_multi_stream_subscription_starts():
+    subscription = TradesStreamModel.model_validate_json(
+        '{"streams": ["publicTrade:BTCUSDT", {"stream": "publicTrade:ETHUSDT", "last_id": "1705072083137-2"},'
+        ' {"stream": "publicTrade:SOLUSDT", "timestamp": 1705072000000}], "timestamp": "1705071000000", "merge": true}'
+    )
+    assert subscription.stream_names() == ["publicTrade:BTCUSDT", "publicTrade:ETHUSDT", "publicTrade:SOLUSDT"]
+    assert subscription.starts() == {
+        "publicTrade:BTCUSDT": "1705071000000",
+        "publicTrade:ETHUSDT": "(1705072083137-2",
+        "publicTrade:SOLUSDT": "1705072000000",
+    }
+
+
+def test_stream_or_streams():
+    with pytest.raises(ValidationError):
+        TradesStreamModel.model_validate_json('{"stream": "publicTrade:BTCUSDT", "streams": ["publicTrade:ETHUSDT"]}')
+    with pytest.raises(ValidationError):
+        TradesStreamModel.model_validate_json('{"timestamp": "1705071000000"}')
+    with pytest.raises(ValidationError):
+        TradesStreamModel.model_validate_json('{"streams": ["publicTrade:BTCUSDT"], "last_id": "5-1"}')
+    single = TradesStreamModel.model_validate_json('{"stream": "publicTrade:BTCUSDT", "last_id": "5-1"}')
+    assert single.starts() == {"publicTrade:BTCUSDT": "(5-1"}
@@ -0,0 +1,55 @@
+import fakeredis
+from app.db.producer.orderbook import OrderBookWriter
+from app.orderbook import OrderBook, pybit_orderbook, trim_depth
+
+
+def snapshot(bids, asks, u=100):
+    return {"topic": "orderbook.50.BTCUSDT", "type": "snapshot", "ts": 1000, "data": {"s": "BTCUSDT", "b": bids, "a": asks, "u": u, "seq": 7}}
+
+
+def delta(bids, asks, u, ts=2000):
+    return {"topic": "orderbook.50.BTCUSDT", "type": "delta", "ts": ts, "data": {"s": "BTCUSDT", "b": bids, "a": asks, "u": u, "seq": 8}}
+
+
+def test_snapshot_and_deltas():
+    """levels are kept best first, a size of 0 removes a level and a delta before the snapshot is ignored"""
+    book = OrderBook("BTCUSDT")
+    assert not book.apply(delta([["100", "1"]], [], u=99))
+
+    book.apply(snapshot([["99.5", "2"], ["100", "1"]], [["101", "3"], ["100.5", "4"]]))
+    assert book.depth()["b"] == [[100.0, 1.0], [99.5, 2.0]]
+    assert book.depth()["a"] == [[100.5, 4.0], [101.0, 3.0]]
+
+    book.apply(delta([["100", "0"], ["99.8", "5"], ["99.5", "2.5"]], [["100.2", "1"], ["101", "0"]], u=101))
+    depth = book.depth()
+    assert depth["b"] == [[99.8, 5.0], [99.5, 2.5]]
+    assert depth["a"] == [[100.2, 1.0], [100.5, 4.0]]
+    assert (depth["u"], depth["seq"], depth["ts"]) == (101, 8, 2000)
+    assert book.depth(1)["a"] == [[100.2, 1.0]]
+    assert trim_depth(depth, 1)["b"] == [[99.8, 5.0]]
+
+    top = book.top()
+    assert top["bid"] == [99.8, 5.0] and top["ask"] == [100.2, 1.0]
+    assert round(top["spread"], 6) == 0.4 and round(top["mid"], 6) == 100.0
+
+    # /api/orderbook keeps the shape of the exchange response
+    response = pybit_orderbook(book.depth(1))
+    assert (response["retCode"], response["retMsg"]) == (0, "OK")
+    assert response["result"] | {"ts": 0} == {"s": "BTCUSDT", "b": [["99.8", "5.0"]], "a": [["100.2", "1.0"]], "ts": 0, "u": 101, "seq": 8}
+
+
+def test_update_id_1_resets_the_book():
+    """after a restart of the exchange service a delta with `u` 1 is the new snapshot"""
+    book = OrderBook("BTCUSDT")
+    book.apply(snapshot([["100", "1"]], [["101", "1"]]))
+    book.apply(delta([["90", "1"]], [], u=1))
+    assert book.depth() | {"ts": 0} == {"symbol": "BTCUSDT", "ts": 0, "u": 1, "seq": 8, "b": [[90.0, 1.0]], "a": []}
+    assert book.top()["spread"] is None
+
+
+def test_writer_resets_the_book_on_reconnect():
+    writer = OrderBookWriter(fakeredis.FakeAsyncRedis(), "orderbook.50.RECONNECTUSDT", snapshot_interval_ms=0)
+    writer.add_frame(snapshot([["100", "1"]], [["101", "1"]]))
+    assert writer.book.ready and not writer.needs_backfill
+    writer.on_reconnect()
+    assert not writer.book.ready and writer.book.depth()["b"] == []
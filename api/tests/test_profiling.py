@@ -0,0 +1,96 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+from app.db.consumer.hub import StreamEntry
+from app.db.consumer.trades import encode_packages
+from app.profiling import LoopLagMonitor, StageTimers, profile, stage_timers
+from app.routers import admin, profiling as profiling_router
+from helpers import make_trade
+
+
+def encode_count() -> int:
+    return next((stage["count"] for stage in stage_timers.stats() if stage["stage"] == "consumer.encode"), 0)
+
+
+def test_stage_timers(monkeypatch):
+    """the hot paths only observe when the timers are enabled"""
+    entries = [StreamEntry.from_fields(f"{ts}-0", make_trade(ts), "publicTrade:BTCUSDT") for ts in range(1, 11)]
+    monkeypatch.setattr(stage_timers, "enabled", False)
+    before = encode_count()
+    encode_packages(entries, 5)
+    assert encode_count() == before
+
+    monkeypatch.setattr(stage_timers, "enabled", True)
+    encode_packages(entries, 5)
+    assert encode_count() == before + 1
+    [stats] = [stage for stage in stage_timers.stats() if stage["stage"] == "consumer.encode"]
+    assert stats["total_seconds"] > 0
+
+    StageTimers().reset()
+    assert encode_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    time.sleep(0.2)  # blocks the event loop
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    assert not monitor.running
+    assert monitor.max >= 0.15
+
+
+def spin(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def busy(seconds: float) -> None:
+    """keeps the event loop busy in python code, yielding every 10ms"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        spin(0.01)
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_profile_cprofile():
+    report, _ = await asyncio.gather(profile(0.2, "cprofile", limit=10), busy(0.15))
+    assert "cProfile" in report
+    assert "busy" in report
+
+
+@pytest.mark.asyncio
+async def test_profile_sampling():
+    report, _ = await asyncio.gather(profile(0.2, "sampling"), busy(0.15))
+    header, *stacks = report.splitlines()
+    assert "samples every" in header
+    assert any("test_profiling.py:busy;test_profiling.py:spin" in stack for stack in stacks)
+
+
+@pytest.mark.asyncio
+async def test_one_profile_at_a_time():
+    running = asyncio.create_task(profile(0.1))
+    await asyncio.sleep(0)
+    with pytest.raises(RuntimeError):
+        await profile(0.1)
+    assert "cProfile" in await running
+    with pytest.raises(HTTPException) as e:
+        await asyncio.gather(profiling_router.run_profile(0.1), profiling_router.run_profile(0.1))
+    assert e.value.status_code == 409
+
+
+def test_admin_token(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+    with pytest.raises(HTTPException):
+        admin.check_admin_token("anything")
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    for token in (None, "wrong"):
+        with pytest.raises(HTTPException) as e:
+            admin.check_admin_token(token)
+        assert e.value.status_code == 403
+    admin.check_admin_token("secret")